@@ -7,6 +7,8 @@ with the following headings:
 
 wavelength,white,grey,black
 
+Any number of targets (two or more) can be used by adding a column for each.
+
 From these performs a linar fit for each wavelength in the image (interpolating
 field spectra to match).
 
@@ -19,108 +21,132 @@ Creation Date: 2018-02-20
 
 from __future__ import print_function
 import argparse
+import functools
 import time
 import numpy
 
-from arsf_envi_reader import numpy_bin_reader
+from arsf_envi_reader import bil_processing
 from arsf_envi_reader import envi_header
 
 DEFAULT_SCALE_FACTOR = 10000
 
-def get_elc_coefficients(image_spectra_file, field_spectra_file):
+def get_elc_coefficients(image_spectra_file, field_spectra_file,
+                         return_r_squared=False):
     """
-    Takes images spectra and field spectra from white, grey and black
-    targets and performs a linear fit for each band.
+    Takes images spectra and field spectra from two or more targets
+    (e.g., white, grey and black) and performs a linear fit for each band.
 
-    Returns numpy array containing two columns with ax and bx
+    Targets are all columns other than 'wavelength' in the image spectra
+    file, each must also be present in the field spectra file. Field spectra
+    are interpolated to the wavelengths of the image spectra.
 
-    """
+    Returns numpy array containing two columns with ax and bx
 
+    If 'return_r_squared' is True also returns a numpy array containing the
+    coefficient of determination (R^2) of the fit for each band.
 
+    """
     image_spectra = numpy.genfromtxt(image_spectra_file,
                                      delimiter=",", names=True)
     field_spectra = numpy.genfromtxt(field_spectra_file,
                                      delimiter=",", names=True)
 
-    elc_coefficients = []
+    targets = [name for name in image_spectra.dtype.names
+               if name != "wavelength"]
+
+    if len(targets) < 2:
+        raise Exception("Need at least two targets to perform linear fit, "
+                        "found: {}".format(", ".join(targets)))
+    for target in targets:
+        if target not in field_spectra.dtype.names:
+            raise Exception("Target '{}' from image spectra was not found in "
+                            "field spectra".format(target))
+
+    # Get radiance from image spectra as an array of bands*targets
+    image_values = numpy.column_stack([image_spectra[target]
+                                       for target in targets])
+
+    # Get coresponding values from field spectra
+    # As wavelengths are likely to not exactly match up
+    # use interpolation to get value for image wavelengths
+    field_values = numpy.column_stack([numpy.interp(image_spectra["wavelength"],
+                                                    field_spectra["wavelength"],
+                                                    field_spectra[target])
+                                       for target in targets])
+
+    # Perform least squares linear fit for all bands
+    image_anomaly = image_values - image_values.mean(axis=1)[:, numpy.newaxis]
+    field_mean = field_values.mean(axis=1)
+    field_anomaly = field_values - field_mean[:, numpy.newaxis]
+
+    ax = (image_anomaly * field_anomaly).sum(axis=1) \
+            / (image_anomaly**2).sum(axis=1)
+    bx = field_mean - ax * image_values.mean(axis=1)
+
+    elc_coefficients = numpy.column_stack([ax, bx])
+
+    if return_r_squared:
+        residuals = field_values - (ax[:, numpy.newaxis] * image_values
+                                    + bx[:, numpy.newaxis])
+        r_squared = 1 - (residuals**2).sum(axis=1) \
+                          / (field_anomaly**2).sum(axis=1)
+        return elc_coefficients, r_squared
+
+    return elc_coefficients
+
+def apply_elc_to_block(block, elc_coefficients,
+                       scale_factor=DEFAULT_SCALE_FACTOR):
+    """
+    Apply coefficients for an empirical line calibration to a block of
+    lines (numpy array n_lines*bands*samples).
 
-    for i, wavelength in enumerate(image_spectra["wavelength"]):
-        # Get radiance from image spectra for given wavelength
-        image_white = image_spectra["white"][i]
-        image_grey = image_spectra["grey"][i]
-        image_black = image_spectra["black"][i]
+    A single output array is created for the block and all subsequent
+    operations are carried out in place.
 
-        # Get coresponding values from field spectra
-        # As wavelengths are likely to not exactly match up
-        # use interpolation to get value for image wavelength
-        field_white = numpy.interp(wavelength, field_spectra["wavelength"],
-                                   field_spectra["white"])
-        field_grey = numpy.interp(wavelength, field_spectra["wavelength"],
-                                  field_spectra["grey"])
-        field_black = numpy.interp(wavelength, field_spectra["wavelength"],
-                                   field_spectra["black"])
+    Returns a floating point array n_lines*bands*samples, the conversion to
+    the output data type is carried out when the block is written.
+    """
+    gain = elc_coefficients[:, 0][numpy.newaxis, :, numpy.newaxis]
+    offset = elc_coefficients[:, 1][numpy.newaxis, :, numpy.newaxis]
 
-        # Perform linear fit
-        ax, bx = numpy.polyfit([image_black, image_grey, image_white],
-                               [field_black, field_grey, field_white],
-                               1)
-        elc_coefficients.append([ax, bx])
+    # Apply coefficients
+    elc_block = numpy.multiply(block, gain)
+    numpy.add(elc_block, offset, out=elc_block)
 
-    elc_coefficients = numpy.array(elc_coefficients)
+    # Set any negative values to 0
+    numpy.maximum(elc_block, 0, out=elc_block)
 
-    return elc_coefficients
+    numpy.multiply(elc_block, scale_factor, out=elc_block)
+
+    return elc_block
 
 def apply_elc(input_image, output_image, image_spectra_file,
               field_spectra_file,
-              scale_factor=DEFAULT_SCALE_FACTOR):
+              scale_factor=DEFAULT_SCALE_FACTOR,
+              workers=1):
     """
     Derive coefficients for an emprical line calibration and apply
     to a BIL file.
+
+    The image is processed in blocks of lines, if 'workers' is greater
+    than 1 blocks are processed in parallel.
     """
 
     print("Getting coefficients")
     elc_coefficients = get_elc_coefficients(image_spectra_file,
                                             field_spectra_file)
 
-    print("Applying to image")
     # Read ENVI header
     input_header_file = envi_header.find_hdr_file(input_image)
     input_header_dict = envi_header.read_hdr_file(input_header_file)
 
-    # Open input file
-    in_data = numpy_bin_reader.BilReader(input_image)
-
-    # Open file for output
-    out_file = open(output_image, "wb")
-
-    for i, line in enumerate(in_data):
-        print(" Line {0:05}/{1:05}".format(i, in_data.lines), end="\r")
-
-        # Apply coefficients
-        elc_line = elc_coefficients[:,0] * line.transpose() \
-                     + elc_coefficients[:,1]
-        elc_line = elc_line.transpose()
-
-        # Set any negative values to 0
-        elc_line = numpy.where(elc_line < 0, 0, elc_line)
-
-        elc_line = elc_line * scale_factor
-        # For default scale factor is over 1000 express as integer
-        if scale_factor >= 1000:
-            elc_line = elc_line.astype(numpy.uint16)
-        else:
-            elc_line = elc_line.astype(numpy.float32)
-        elc_line.tofile(out_file)
-
-    print(" Line {0:05}/{0:05}".format(in_data.lines), end="\n")
-
     output_header_dict = input_header_dict
 
-    # See if need to change data type
+    # For default scale factor is over 1000 express as integer
     if scale_factor >= 1000:
-        output_header_dict["data type"] = 12
+        out_numpy_dtype = numpy.uint16
     else:
-        output_header_dict["data type"] = 4
+        out_numpy_dtype = numpy.float32
 
     # Remove radiance data units
     try:
@@ -140,13 +166,15 @@ def apply_elc(input_image, output_image, image_spectra_file,
     output_header_dict["description"] = "BIL file created by {} on {}".format(__file__,
                                             time.strftime("%Y-%m-%d %H:%M:%S"))
 
-    # Copy header
-    envi_header.write_envi_header(output_image + ".hdr",
-                                  output_header_dict)
-
-    # Close files
-    out_file.close()
-    in_data = None
+    print("Applying to image")
+    # Apply to each block of lines and write out data and header
+    bil_processing.process_bil(input_image, output_image,
+                               functools.partial(apply_elc_to_block,
+                                                 elc_coefficients=elc_coefficients,
+                                                 scale_factor=scale_factor),
+                               workers=workers,
+                               out_numpy_dtype=out_numpy_dtype,
+                               hdr_data_dict=output_header_dict)
 
 
 if __name__ == "__main__":
@@ -169,9 +197,14 @@ if __name__ == "__main__":
                         help="Scale factor to apply to reflectance values. "
                              "Used so image can be saved as uint16. "
                              "(Default {})".format(DEFAULT_SCALE_FACTOR))
+    parser.add_argument("--workers", type=int,
+                        required=False,
+                        default=1,
+                        help="Number of processes to use (Default 1)")
 
     args = parser.parse_args()
 
     apply_elc(args.inputimage[0], args.outputimage[0],
-              args.image_spectra, args.field_spectra, args.scale)
+              args.image_spectra, args.field_spectra, args.scale,
+              workers=args.workers)
     print("Saved to {}".format(args.outputimage[0]))
@@ -8,6 +8,12 @@ http://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.savgol_filter.h
 
 And arsf_envi_reader (available from: https://github.com/pmlrsg/arsf_tools)
 
+The filter coefficients are calculated once and applied along the band axis
+to blocks of lines, which can be processed in parallel. Filtered values are
+the same as applying scipy.signal.savgol_filter to each line to within
+floating point precision (for integer data types values are truncated, so
+may differ by 1 where a value is very close to a whole number).
+
 Dan Clewley
 16/06/2016
 
@@ -15,47 +21,123 @@ Dan Clewley
 
 from __future__ import print_function
 import argparse
+import functools
+import numpy
+from scipy import ndimage
 from scipy import signal
 
+from arsf_envi_reader import bil_processing
 from arsf_envi_reader import numpy_bin_reader
-from arsf_envi_reader import envi_header
 
 POLY_ORDER = 3
 WINDOW_SIZE = 7
 
+def get_savgol_coefficients(window_size=WINDOW_SIZE, poly_order=POLY_ORDER):
+    """
+    Get coefficients to apply a Savitzky-Golay filter.
+
+    Returns the convolution coefficients and a matrix window_size*window_size
+    which gives the filtered values for a single window. The first and last
+    rows of this are used for bands at the edges, where scipy fits a
+    polynomial to the first / last window (mode='interp').
+
+    The window size must be an odd number.
+    """
+    if window_size % 2 != 1:
+        raise ValueError("Window size must be an odd number "
+                         "(got {})".format(window_size))
+    coefficients = signal.savgol_coeffs(window_size, poly_order)
+    # Filtering the identity matrix gives the filter as a matrix
+    window_matrix = signal.savgol_filter(numpy.eye(window_size), window_size,
+                                         poly_order, axis=0)
+    return coefficients, window_matrix
+
+def savgol_filter_block(block, coefficients, window_matrix):
+    """
+    Apply Savitzky-Golay filter along the band axis of a block of lines
+    (numpy array n_lines*bands*samples) using coefficients from
+    get_savgol_coefficients.
+
+    Negative values in the output are set to 0.
+    """
+    window_size = window_matrix.shape[0]
+    half_window = window_size // 2
+
+    if block.shape[1] < window_size:
+        raise ValueError("Window size ({}) must be less than or equal to "
+                         "the number of bands ({})".format(window_size,
+                                                           block.shape[1]))
+
+    out_block = ndimage.convolve1d(block, coefficients, axis=1,
+                                   output=numpy.float64, mode="constant")
+
+    # Set bands at the edges from a polynomial fit to the first / last window
+    if half_window > 0:
+        out_block[:, :half_window, :] = \
+                    numpy.einsum("ij,njs->nis", window_matrix[:half_window],
+                                 block[:, :window_size, :])
+        out_block[:, -half_window:, :] = \
+                    numpy.einsum("ij,njs->nis", window_matrix[-half_window:],
+                                 block[:, -window_size:, :])
+
+    # Remove negative values
+    numpy.maximum(out_block, 0, out=out_block)
+
+    return out_block
+
+def apply_savgol_filter(input_image, output_image, window_size=WINDOW_SIZE,
+                        poly_order=POLY_ORDER, workers=1):
+    """
+    Apply Savitzky-Golay filter to each spectra in a BIL file.
+
+    The output file has the same data type as the input. The image is
+    processed in blocks of lines, if 'workers' is greater than 1 blocks are
+    processed in parallel.
+
+    The window size is checked against the number of bands before the
+    output file is created.
+    """
+    coefficients, window_matrix = get_savgol_coefficients(window_size,
+                                                          poly_order)
+
+    in_data = numpy_bin_reader.BilReader(input_image, memmap=True)
+    n_bands = in_data.get_num_bands()
+    in_data = None
+    if window_size > n_bands:
+        raise ValueError("Window size ({}) must be less than or equal to "
+                         "the number of bands ({})".format(window_size,
+                                                           n_bands))
+
+    bil_processing.process_bil(input_image, output_image,
+                               functools.partial(savgol_filter_block,
+                                                 coefficients=coefficients,
+                                                 window_matrix=window_matrix),
+                               workers=workers)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("inputimage", nargs=1,
                         type=str, help="Input image")
     parser.add_argument("outputimage", nargs=1,
                         type=str, help="Output image")
+    parser.add_argument("--window_size", type=int,
+                        required=False,
+                        default=WINDOW_SIZE,
+                        help="Window size for filter, must be an odd number "
+                             "(Default {})".format(WINDOW_SIZE))
+    parser.add_argument("--poly_order", type=int,
+                        required=False,
+                        default=POLY_ORDER,
+                        help="Order of polynomial used for filter "
+                             "(Default {})".format(POLY_ORDER))
+    parser.add_argument("--workers", type=int,
+                        required=False,
+                        default=1,
+                        help="Number of processes to use (Default 1)")
     args = parser.parse_args()
 
-    # Open input file
-    in_data = numpy_bin_reader.BilReader(args.inputimage[0])
-
-    # Open file for output
-    out_file = open(args.outputimage[0], "wb")
-
-    for i, line in enumerate(in_data):
-        print(" Line {0}/{1}".format(str(i).zfill(len(str(in_data.lines))),
-                                     in_data.lines), end="\r")
-        # Apply filter
-        out_line = signal.savgol_filter(line,
-                                        WINDOW_SIZE, POLY_ORDER,
-                                        axis=0)
-        # Remove negative values
-        out_line[out_line < 0] = 0
-        # Set output to the same as input
-        out_line = out_line.astype(line.dtype)
-        out_line.tofile(out_file)
-
-    print(" Line {0}/{0}".format(in_data.lines), end="\n")
-
-    # Copy header
-    envi_header.write_envi_header(args.outputimage[0] + ".hdr",
-                                  in_data.get_hdr_dict())
-
-    # Close files
-    out_file.close()
-    in_data = None
+    apply_savgol_filter(args.inputimage[0], args.outputimage[0],
+                        window_size=args.window_size,
+                        poly_order=args.poly_order,
+                        workers=args.workers)
+    print("Saved to {}".format(args.outputimage[0]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module to apply a function to an ENVI BIL file a block of lines at a time,
+optionally using multiple processes.
+
+The input file is mapped using numpy.memmap in each process and results
+are written directly to an output file which is allocated before processing
+starts, so only the position of each block is passed between processes.
+
+"""
+
+###########################################################
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+###########################################################
+
+import multiprocessing
+import numpy
+from . import numpy_bin_reader
+from . import numpy_bin_writer
+
+# Data used by each worker process, set by _init_worker
+_worker_data = {}
+
+def _init_worker(input_file, output_file, func, output_shape, output_dtype):
+    """
+    Open input and output files in a worker process
+    """
+    _worker_data["in_data"] = numpy_bin_reader.BilReader(input_file,
+                                                         memmap=True)
+    _worker_data["out_data"] = numpy.memmap(output_file, dtype=output_dtype,
+                                            mode="r+", shape=output_shape)
+    _worker_data["func"] = func
+
+def _process_block(block_position):
+    """
+    Apply function to a block of lines in a worker process and write
+    to the output file.
+    """
+    start_line, n_lines = block_position
+
+    block = _worker_data["in_data"].read_block(start_line, n_lines)
+    out_block = _worker_data["func"](block)
+
+    _worker_data["out_data"][start_line:start_line + n_lines] = out_block
+    _worker_data["out_data"].flush()
+
+    return n_lines
+
+def process_bil(input_file, output_file, func, workers=1, block_lines=None,
+                out_bands=None, out_numpy_dtype=None, hdr_data_dict=None):
+    """
+    Apply a function to each block of lines in a BIL file and write
+    the output to a new BIL file.
+
+    The function is passed a numpy array n_lines*bands*samples and must
+    return an array n_lines*out_bands*samples. If 'workers' is greater than
+    1 blocks are processed in parallel using a pool of processes, in this case
+    the function must be able to be pickled (e.g., a function defined at the
+    top level of a module or a functools.partial of one).
+
+    Requires:
+
+    * input_file - Input BIL file
+    * output_file - Output BIL file
+    * func - Function to apply to each block of lines
+    * workers - Number of processes to use (optional)
+    * block_lines - Number of lines in each block (optional, default based
+      on numpy_bin_reader.DEFAULT_BLOCK_MEMORY)
+    * out_bands - Number of bands in the output (optional, default same
+      as input)
+    * out_numpy_dtype - Data type of output (optional, default same as input)
+    * hdr_data_dict - Dictionary to use for output header (optional, default
+      header of input). Size and data type are set to match the output file.
+
+    """
+    in_data = numpy_bin_reader.BilReader(input_file, memmap=True)
+
+    if not in_data.check_interleave("bil"):
+        raise Exception("The function 'process_bil' is only "
+                        "valid for BIL format files")
+
+    if block_lines is None:
+        block_lines = in_data.get_block_lines()
+    if out_bands is None:
+        out_bands = in_data.get_num_bands()
+    if out_numpy_dtype is None:
+        out_numpy_dtype = in_data.numpy_dtype
+    if hdr_data_dict is None:
+        hdr_data_dict = in_data.get_hdr_dict()
+
+    samples = in_data.get_num_samples()
+    lines = in_data.get_num_lines()
+
+    block_positions = [(start_line, min(block_lines, lines - start_line))
+                       for start_line in range(0, lines, block_lines)]
+
+    if workers > 1:
+        # Only need to allocate output file and write the header as data
+        # are written by worker processes so use the minimum buffer.
+        out_data = numpy_bin_writer.BilWriter(output_file, samples, lines,
+                                              out_bands, out_numpy_dtype,
+                                              hdr_data_dict, buffer_memory=0)
+        process_pool = multiprocessing.Pool(workers, _init_worker,
+                                            (input_file, output_file, func,
+                                             (lines, out_bands, samples),
+                                             out_numpy_dtype))
+        try:
+            for _ in process_pool.imap_unordered(_process_block,
+                                                 block_positions):
+                pass
+            process_pool.close()
+        except:
+            process_pool.terminate()
+            raise
+        finally:
+            process_pool.join()
+        # All lines have been written to the file by the worker processes
+        out_data.current_line = lines
+    else:
+        out_data = numpy_bin_writer.BilWriter(output_file, samples, lines,
+                                              out_bands, out_numpy_dtype,
+                                              hdr_data_dict)
+        for start_line, n_lines in block_positions:
+            out_data.write_block(func(in_data.read_block(start_line,
+                                                         n_lines)))
+
+    # Close output file and write header
+    out_data.close()
+    in_data = None
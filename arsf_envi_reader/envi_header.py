@@ -34,6 +34,16 @@ ENVI_TO_NUMPY_DTYPE = {'1':  numpy.uint8,
                        '14': numpy.int64,
                        '15': numpy.uint64}
 
+NUMPY_TO_ENVI_DTYPE = dict((numpy.dtype(numpy_dtype).name, envi_dtype)
+                           for envi_dtype, numpy_dtype
+                           in ENVI_TO_NUMPY_DTYPE.items())
+
+#: Maximum number of parsed headers kept by read_hdr_file
+HDR_CACHE_SIZE = 256
+
+# Parsed headers, stored as (modification time, size), header dictionary
+_hdr_cache = collections.OrderedDict()
+
 def find_hdr_file(rawfilename):
     """
     Find ENVI header file associated with data file
@@ -57,70 +67,120 @@ def find_hdr_file(rawfilename):
 
     return hdrfile
 
-def read_hdr_file(hdrfilename, keep_case=False):
+def _parse_hdr_file(hdrfile, keep_case=False):
     """
-    Read information from ENVI header file to a dictionary.
-
-    By default all keys are converted to lowercase. To stop this behaviour
-    and keep the origional case set 'keep_case = True'
+    Parse lines from an open ENVI header file to a dictionary.
 
+    Reads through the file once, values for blocks split over multiple
+    lines are joined once the end of the block is reached.
     """
     output = collections.OrderedDict()
-    comments = ""
-    inblock = False
-
-    try:
-        hdrfile = open(hdrfilename, "r")
-    except:
-        raise IOError("Could not open hdr file " + str(hdrfilename) + \
-                      ". Reason: " + str(sys.exc_info()[1]), sys.exc_info()[2])
+    comments = []
+    block_values = None
+    key = None
 
     # Read line, split it on equals, strip whitespace from resulting strings
     # and add key/value pair to output
     for currentline in hdrfile:
         # ENVI headers accept blocks bracketed by curly braces - check for these
-        if not inblock:
+        if block_values is None:
             # Check for a comment
-            if re.search("^;", currentline) is not None:
-                comments += currentline
+            if currentline.startswith(";"):
+                comments.append(currentline)
             # Split line on first equals sign
-            elif re.search("=", currentline) is not None:
-                linesplit = re.split("=", currentline, 1)
-                key = linesplit[0].strip()
+            elif "=" in currentline:
+                key, _, value = currentline.partition("=")
+                key = key.strip()
                 # Convert all values to lower case unless requested to keep.
                 if not keep_case:
                     key = key.lower()
-                value = linesplit[1].strip()
+                value = value.strip()
 
                 # If value starts with an open brace, it's the start of a block
                 # - strip the brace off and read the rest of the block
-                if re.match("{", value) is not None:
-                    inblock = True
-                    value = re.sub("^{", "", value, 1)
+                if value.startswith("{"):
+                    value = value[1:]
 
                     # If value ends with a close brace it's the end
                     # of the block as well - strip the brace off
-                    if re.search("}$", value):
-                        inblock = False
-                        value = re.sub("}$", "", value, 1)
+                    if value.endswith("}"):
+                        value = value[:-1]
+                    else:
+                        block_values = []
                 value = value.strip()
                 output[key] = value
+                if block_values is not None:
+                    block_values.append(value)
         else:
             # If we're in a block, just read the line, strip whitespace
             # (and any closing brace ending the block) and add the whole thing
             value = currentline.strip()
-            if re.search("}$", value):
-                inblock = False
-                value = re.sub("}$", "", value, 1)
-                value = value.strip()
-            output[key] = output[key] + value
+            if value.endswith("}"):
+                block_values.append(value[:-1].strip())
+                output[key] = "".join(block_values)
+                block_values = None
+            else:
+                block_values.append(value)
 
-    hdrfile.close()
+    # If the file ended within a block keep the values read
+    if block_values is not None:
+        output[key] = "".join(block_values)
 
-    output['_comments'] = comments
+    output['_comments'] = "".join(comments)
 
     return output
 
+def read_hdr_file(hdrfilename, keep_case=False):
+    """
+    Read information from ENVI header file to a dictionary.
+
+    By default all keys are converted to lowercase. To stop this behaviour
+    and keep the origional case set 'keep_case = True'
+
+    Parsed headers are cached using the path, modification time and size
+    of the file so reading the same header again doesn't require parsing it.
+    A copy of the cached dictionary is returned so it can be edited.
+
+    """
+    try:
+        hdr_stat = os.stat(hdrfilename)
+        cache_key = (os.path.abspath(hdrfilename), keep_case)
+        file_id = (getattr(hdr_stat, "st_mtime_ns", hdr_stat.st_mtime),
+                   hdr_stat.st_size)
+    except (OSError, TypeError):
+        cache_key = None
+
+    if cache_key is not None and cache_key in _hdr_cache:
+        cached_id, cached_output = _hdr_cache.pop(cache_key)
+        if cached_id == file_id:
+            # Move to end so least recently used headers are removed first
+            _hdr_cache[cache_key] = (cached_id, cached_output)
+            return collections.OrderedDict(cached_output)
+
+    try:
+        hdrfile = open(hdrfilename, "r")
+    except:
+        raise IOError("Could not open hdr file " + str(hdrfilename) + \
+                      ". Reason: " + str(sys.exc_info()[1]), sys.exc_info()[2])
+
+    try:
+        output = _parse_hdr_file(hdrfile, keep_case)
+    finally:
+        hdrfile.close()
+
+    if cache_key is not None:
+        _hdr_cache[cache_key] = (file_id, output)
+        while len(_hdr_cache) > HDR_CACHE_SIZE:
+            _hdr_cache.popitem(last=False)
+
+    return collections.OrderedDict(output)
+
+def clear_hdr_cache():
+    """
+    Remove all headers from the cache used by read_hdr_file
+    """
+    _hdr_cache.clear()
+
 def write_envi_header(filename, header_dict):
     """
     Writes a dictionary to an ENVI header file
@@ -157,3 +217,144 @@ def write_envi_header(filename, header_dict):
             hdrfile.write(comment_line)
     hdrfile.close()
 
+
+class EnviHeader(collections.OrderedDict):
+    """
+    Dictionary of values from an ENVI header, with list values (e.g.,
+    wavelength, fwhm and bbl) available as NumPy arrays.
+
+    Values are stored as strings in the same format as read_hdr_file so it
+    can be passed to write_envi_header. Lists are only split and converted
+    to arrays the first time they are requested, the arrays are kept until
+    the value is changed.
+
+    Example::
+
+       from arsf_envi_reader import envi_header
+
+       header = envi_header.EnviHeader.from_file("FENIX219b-14-1.hdr")
+
+       # Get bands closest to wavelengths for red, green and blue
+       rgb_bands = header.get_nearest_bands([640, 540, 470])
+
+       # Write out copy of header
+       envi_header.write_envi_header("out_file.bil.hdr", header)
+
+    """
+    def __init__(self, *args, **kwargs):
+        # Cached values / arrays for each key
+        self._values = {}
+        self._arrays = {}
+        self._sorted_wavelengths = None
+        collections.OrderedDict.__init__(self, *args, **kwargs)
+
+    @classmethod
+    def from_file(cls, hdrfilename, keep_case=False):
+        """
+        Read an ENVI header file using read_hdr_file
+        """
+        return cls(read_hdr_file(hdrfilename, keep_case=keep_case))
+
+    def __setitem__(self, key, value, *args, **kwargs):
+        self._clear_cached(key)
+        collections.OrderedDict.__setitem__(self, key, value, *args, **kwargs)
+
+    def __delitem__(self, key, *args, **kwargs):
+        self._clear_cached(key)
+        collections.OrderedDict.__delitem__(self, key, *args, **kwargs)
+
+    def _clear_cached(self, key):
+        """
+        Remove cached values for a key which has been changed
+        """
+        self._values.pop(key, None)
+        self._arrays.pop(key, None)
+        if key == "wavelength":
+            self._sorted_wavelengths = None
+
+    def to_dict(self):
+        """
+        Get values as a dictionary (the same as returned by read_hdr_file)
+        """
+        return collections.OrderedDict(self)
+
+    def get_values(self, key):
+        """
+        Get a list of values for a key, split on commas with whitespace
+        removed.
+        """
+        if key not in self._values:
+            self._values[key] = [value.strip() for value
+                                 in str(self[key]).split(",")]
+        return self._values[key]
+
+    def get_array(self, key, numpy_dtype=numpy.float64):
+        """
+        Get values for a key as a numpy array.
+        """
+        if key not in self._arrays:
+            self._arrays[key] = numpy.array(self.get_values(key),
+                                            dtype=numpy.float64)
+        return self._arrays[key].astype(numpy_dtype, copy=False)
+
+    @property
+    def wavelength(self):
+        """
+        Wavelength of each band as a numpy array
+        """
+        return self.get_array("wavelength")
+
+    @property
+    def fwhm(self):
+        """
+        Full width half maximum of each band as a numpy array
+        """
+        return self.get_array("fwhm")
+
+    @property
+    def bbl(self):
+        """
+        Bad band list as a boolean numpy array (True for good bands)
+        """
+        return self.get_array("bbl") != 0
+
+    def get_nearest_bands(self, wavelengths):
+        """
+        Get the index of the band (starting at 0) with the closest
+        wavelength to each wavelength provided.
+
+        Returns a numpy array of band indices.
+        """
+        wavelengths = numpy.asarray(wavelengths, dtype=numpy.float64)
+
+        if self._sorted_wavelengths is None:
+            band_order = numpy.argsort(self.wavelength, kind="mergesort")
+            self._sorted_wavelengths = (band_order,
+                                        self.wavelength[band_order])
+        band_order, sorted_wavelengths = self._sorted_wavelengths
+
+        if sorted_wavelengths.size == 1:
+            return numpy.zeros(wavelengths.shape, dtype=numpy.int64)
+
+        # Get the position of each wavelength between two bands and see
+        # which of the two is closer
+        upper_position = numpy.clip(numpy.searchsorted(sorted_wavelengths,
+                                                       wavelengths),
+                                    1, sorted_wavelengths.size - 1)
+        # If bands have the same wavelength use the first
+        lower_position = numpy.searchsorted(sorted_wavelengths,
+                                            sorted_wavelengths[upper_position - 1])
+        lower_distance = numpy.abs(wavelengths
+                                   - sorted_wavelengths[lower_position])
+        upper_distance = numpy.abs(sorted_wavelengths[upper_position]
+                                   - wavelengths)
+
+        # If both are the same distance use the first band
+        use_lower = (lower_distance < upper_distance) \
+                        | ((lower_distance == upper_distance)
+                           & (band_order[lower_position]
+                              < band_order[upper_position]))
+        nearest_position = numpy.where(use_lower, lower_position,
+                                       upper_position)
+
+        return band_order[nearest_position]
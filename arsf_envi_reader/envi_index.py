@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module to keep an index of ENVI files within a directory tree.
+
+Values from the header of each ENVI file (dimensions, data type, interleave,
+acquisition date, GPS start / stop times and the bounds from map info) are
+stored in an SQLite database along with the size of the file and, optionally,
+a checksum. Files can then be selected from the index (e.g., all lines from
+one day overlapping a bounding box) without walking the file system and
+parsing each header.
+
+When the index is updated only files which are new or have changed since
+they were last indexed are read.
+
+Example::
+
+   from arsf_envi_reader import envi_index
+
+   envi_index.update_index("flightlines.sqlite", ["/data/flightlines"])
+
+   for row in envi_index.query_index("flightlines.sqlite",
+                                     date="17-06-2017",
+                                     bbox=(500000, 510000, 6000000, 6010000)):
+       print(row["path"])
+
+"""
+
+###########################################################
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+###########################################################
+
+import hashlib
+import os
+import sqlite3
+import numpy
+from . import envi_header
+from . import numpy_bin_reader
+
+#: Version of the table layout, the index is rebuilt if this doesn't match
+INDEX_VERSION = 1
+
+#: Columns stored for each file and their SQLite types
+INDEX_COLUMNS = [("path", "TEXT PRIMARY KEY"),
+                 ("header_file", "TEXT"),
+                 ("file_size", "INTEGER"),
+                 ("file_mtime", "REAL"),
+                 ("header_mtime", "REAL"),
+                 ("samples", "INTEGER"),
+                 ("lines", "INTEGER"),
+                 ("bands", "INTEGER"),
+                 ("data_type", "TEXT"),
+                 ("interleave", "TEXT"),
+                 ("date", "TEXT"),
+                 ("start_time", "TEXT"),
+                 ("stop_time", "TEXT"),
+                 ("projection", "TEXT"),
+                 ("min_x", "REAL"),
+                 ("max_x", "REAL"),
+                 ("min_y", "REAL"),
+                 ("max_y", "REAL"),
+                 ("size_ok", "INTEGER"),
+                 ("checksum", "TEXT")]
+
+#: Extensions of data files with a header named '<base>.hdr'
+DATA_EXTENSIONS = ("", ".raw", ".bil", ".bsq", ".bip", ".img")
+
+#: Size of blocks read when calculating checksums
+CHECKSUM_BLOCK_SIZE = 16*1024*1024
+
+def get_map_info_bounds(header_dict):
+    """
+    Get the bounds of an image from the 'map info' key of a header.
+
+    Returns a tuple with projection name, min_x, max_x, min_y, max_y or None
+    if the header doesn't contain map info. Rotation is not taken into
+    account.
+    """
+    try:
+        map_info = [value.strip() for value
+                    in header_dict["map info"].split(",")]
+        projection = map_info[0]
+        ref_x, ref_y = float(map_info[1]), float(map_info[2])
+        easting, northing = float(map_info[3]), float(map_info[4])
+        pixel_x, pixel_y = float(map_info[5]), float(map_info[6])
+        samples = int(header_dict["samples"])
+        lines = int(header_dict["lines"])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+    # Reference pixel starts at 1 (top left corner of first pixel)
+    min_x = easting - (ref_x - 1) * pixel_x
+    max_y = northing + (ref_y - 1) * pixel_y
+    max_x = min_x + samples * pixel_x
+    min_y = max_y - lines * pixel_y
+
+    return projection, min_x, max_x, min_y, max_y
+
+def get_checksum(data_file):
+    """
+    Calculate the MD5 checksum of a file
+    """
+    checksum = hashlib.md5()
+    with open(data_file, "rb") as data_handler:
+        data_block = data_handler.read(CHECKSUM_BLOCK_SIZE)
+        while data_block:
+            checksum.update(data_block)
+            data_block = data_handler.read(CHECKSUM_BLOCK_SIZE)
+    return checksum.hexdigest()
+
+def _get_int(header_dict, key):
+    """
+    Get an integer value from a header, or None if it isn't present
+    """
+    try:
+        return int(header_dict[key])
+    except (KeyError, ValueError):
+        return None
+
+def _get_last_word(header_dict, key):
+    """
+    Get the last word of a value from a header (e.g., the date from
+    'acquisition date'), or None if it isn't present
+    """
+    try:
+        return header_dict[key].split(" ")[-1]
+    except KeyError:
+        return None
+
+def get_file_values(data_file, checksum=False):
+    """
+    Get the values stored in the index for an ENVI file.
+
+    Returns a dictionary with a value for each of INDEX_COLUMNS.
+    """
+    header_file = envi_header.find_hdr_file(data_file)
+    if header_file is None:
+        raise IOError("Could not find header for {}".format(data_file))
+
+    header_dict = envi_header.read_hdr_file(header_file)
+    data_stat = os.stat(data_file)
+
+    values = dict((column, None) for column, _ in INDEX_COLUMNS)
+    values["path"] = os.path.abspath(data_file)
+    values["header_file"] = os.path.abspath(header_file)
+    values["file_size"] = data_stat.st_size
+    values["file_mtime"] = data_stat.st_mtime
+    values["header_mtime"] = os.stat(header_file).st_mtime
+    values["samples"] = _get_int(header_dict, "samples")
+    values["lines"] = _get_int(header_dict, "lines")
+    values["bands"] = _get_int(header_dict, "bands")
+    values["interleave"] = header_dict.get("interleave", "").lower() or None
+    values["date"] = _get_last_word(header_dict, "acquisition date")
+    values["start_time"] = _get_last_word(header_dict, "gps start time")
+    values["stop_time"] = _get_last_word(header_dict, "gps stop time")
+
+    try:
+        values["data_type"] = numpy.dtype(
+            envi_header.ENVI_TO_NUMPY_DTYPE[header_dict["data type"]]).name
+    except KeyError:
+        pass
+
+    bounds = get_map_info_bounds(header_dict)
+    if bounds is not None:
+        (values["projection"], values["min_x"], values["max_x"],
+         values["min_y"], values["max_y"]) = bounds
+
+    try:
+        values["size_ok"] = \
+                    int(numpy_bin_reader._BinaryReader.check_size(data_file))
+    except (KeyError, ValueError):
+        values["size_ok"] = None
+
+    if checksum:
+        values["checksum"] = get_checksum(data_file)
+
+    return values
+
+def find_envi_files(directories):
+    """
+    Find all ENVI files within a list of directories, including
+    subdirectories.
+
+    A file is taken to be an ENVI file if there is a header named
+    '<file>.hdr'. If the header is named '<base>.hdr' (without the extension
+    of the file) the file is only used if it has a known data extension
+    (DATA_EXTENSIONS) or it is the only file with that base name, so other
+    files with the same name as the header (e.g., log files) are not
+    indexed.
+    """
+    envi_files = []
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            names = set(filenames)
+            # Count files with each base name (other than headers)
+            n_base = {}
+            for filename in filenames:
+                if not filename.lower().endswith(".hdr"):
+                    base = os.path.splitext(filename)[0]
+                    n_base[base] = n_base.get(base, 0) + 1
+            for filename in filenames:
+                if filename.lower().endswith(".hdr"):
+                    continue
+                base, extension = os.path.splitext(filename)
+                if filename + ".hdr" in names:
+                    envi_files.append(os.path.join(dirpath, filename))
+                elif base + ".hdr" in names and \
+                        (extension.lower() in DATA_EXTENSIONS
+                         or n_base[base] == 1):
+                    envi_files.append(os.path.join(dirpath, filename))
+    return sorted(envi_files)
+
+def open_index(index_file):
+    """
+    Open an index, creating the table if it doesn't exist.
+
+    Returns an sqlite3 connection, rows are returned as sqlite3.Row so
+    values can be accessed by column name.
+    """
+    connection = sqlite3.connect(index_file)
+    connection.row_factory = sqlite3.Row
+
+    index_version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if index_version != INDEX_VERSION:
+        connection.execute("DROP TABLE IF EXISTS envi_files")
+    connection.execute("CREATE TABLE IF NOT EXISTS envi_files "
+                       "({})".format(", ".join("{} {}".format(column,
+                                                               column_type)
+                                               for column, column_type
+                                               in INDEX_COLUMNS)))
+    connection.execute("CREATE INDEX IF NOT EXISTS envi_files_date "
+                       "ON envi_files (date)")
+    connection.execute("CREATE INDEX IF NOT EXISTS envi_files_bounds "
+                       "ON envi_files (min_x, max_x, min_y, max_y)")
+    connection.execute("PRAGMA user_version = {}".format(INDEX_VERSION))
+    connection.commit()
+
+    return connection
+
+def update_index(index_file, directories, checksum=False, remove_missing=True):
+    """
+    Add ENVI files within directories to an index.
+
+    Requires:
+
+    * index_file - SQLite file to store index in (created if it doesn't exist)
+    * directories - List of directories to search for ENVI files
+    * checksum - Calculate an MD5 checksum for each file (optional, slow for
+      large files)
+    * remove_missing - Remove files from the index which are within the
+      directories but no longer exist (optional)
+
+    Only files which are new, or where the size or modification time of the
+    file or header has changed, are read.
+
+    Returns the number of files added or updated.
+
+    """
+    connection = open_index(index_file)
+
+    indexed = {}
+    for row in connection.execute("SELECT path, file_size, file_mtime, "
+                                  "header_mtime, checksum FROM envi_files"):
+        indexed[row["path"]] = row
+
+    envi_files = [os.path.abspath(data_file) for data_file
+                  in find_envi_files(directories)]
+
+    insert_sql = "INSERT OR REPLACE INTO envi_files ({}) VALUES ({})".format(
+                    ", ".join(column for column, _ in INDEX_COLUMNS),
+                    ", ".join("?" for _ in INDEX_COLUMNS))
+
+    n_updated = 0
+    try:
+        for data_file in envi_files:
+            row = indexed.get(data_file)
+            if row is not None:
+                data_stat = os.stat(data_file)
+                header_file = envi_header.find_hdr_file(data_file)
+                if (row["file_size"] == data_stat.st_size
+                        and row["file_mtime"] == data_stat.st_mtime
+                        and row["header_mtime"] == os.stat(header_file).st_mtime
+                        and (row["checksum"] is not None or not checksum)):
+                    continue
+            values = get_file_values(data_file, checksum=checksum)
+            connection.execute(insert_sql, [values[column] for column, _
+                                            in INDEX_COLUMNS])
+            n_updated += 1
+
+        if remove_missing:
+            found_files = set(envi_files)
+            directory_paths = [os.path.join(os.path.abspath(directory), "")
+                               for directory in directories]
+            for path in indexed:
+                if path not in found_files and \
+                        any(path.startswith(directory_path)
+                            for directory_path in directory_paths):
+                    connection.execute("DELETE FROM envi_files WHERE path = ?",
+                                       (path,))
+        connection.commit()
+    finally:
+        connection.close()
+
+    return n_updated
+
+def query_index(index_file, date=None, bbox=None, interleave=None,
+                size_ok=None):
+    """
+    Get files from an index.
+
+    Requires:
+
+    * index_file - SQLite file containing index
+    * date - Acquisition date, in the same format as the header (optional)
+    * bbox - Bounding box as (min_x, max_x, min_y, max_y), files which
+      overlap are returned (optional)
+    * interleave - Interleave of file (e.g., 'bil') (optional)
+    * size_ok - If True only return files where the size matches the header,
+      if False only those where it doesn't (optional)
+
+    Returns a list of sqlite3.Row, sorted by date, start time and path.
+
+    """
+    conditions = []
+    parameters = []
+    if date is not None:
+        conditions.append("date = ?")
+        parameters.append(date)
+    if bbox is not None:
+        min_x, max_x, min_y, max_y = bbox
+        conditions.append("min_x <= ? AND max_x >= ? "
+                          "AND min_y <= ? AND max_y >= ?")
+        parameters.extend([max_x, min_x, max_y, min_y])
+    if interleave is not None:
+        conditions.append("interleave = ?")
+        parameters.append(interleave.lower())
+    if size_ok is not None:
+        conditions.append("size_ok = ?")
+        parameters.append(int(size_ok))
+
+    query_sql = "SELECT * FROM envi_files"
+    if conditions:
+        query_sql += " WHERE " + " AND ".join(conditions)
+    query_sql += " ORDER BY date, start_time, path"
+
+    connection = open_index(index_file)
+    try:
+        return connection.execute(query_sql, parameters).fetchall()
+    finally:
+        connection.close()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module to read values from a large number of ENVI header files into a table.
+
+Headers are parsed in parallel using a pool of processes and selected fields
+are extracted into a NumPy structured array with a row for each header.
+Values can be cached in a file, keyed by the path, modification time and
+size of each header, so only new or changed headers are parsed when scanning
+again. Headers which no longer exist are removed from the cache.
+
+Example::
+
+   from arsf_envi_reader import header_scanner
+
+   header_table = header_scanner.scan_headers(glob.glob("*/*.hdr"),
+                                              workers=8,
+                                              cache_file="headers.cache")
+   print(header_table["file"][header_table["lines"] > 10000])
+
+"""
+
+###########################################################
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+###########################################################
+
+import collections
+import multiprocessing
+import os
+import pickle
+import numpy
+from . import envi_header
+
+#: Field to extract from headers. 'keys' is a list of header keys to try
+#: in order, the value of the first found is converted using 'converter'.
+HeaderField = collections.namedtuple("HeaderField",
+                                     ["name", "keys", "numpy_dtype",
+                                      "converter"])
+
+#: Maximum length of string fields
+STRING_LENGTH = 64
+
+def last_word(value):
+    """
+    Get the last word of a value (e.g., the date from 'acquisition date')
+    """
+    return value.split(" ")[-1]
+
+def first_value(value):
+    """
+    Get the first value in a list as a float
+    """
+    return float(value.split(",")[0])
+
+def first_digit(value):
+    """
+    Get the first character of a value as an integer
+    """
+    return int(value[0])
+
+#: Fields extracted by default
+DEFAULT_FIELDS = [
+    HeaderField("date", ["acquisition date"], "U{}".format(STRING_LENGTH),
+                last_word),
+    HeaderField("start_time", ["gps start time"], "U{}".format(STRING_LENGTH),
+                last_word),
+    HeaderField("stop_time", ["gps stop time"], "U{}".format(STRING_LENGTH),
+                last_word),
+    HeaderField("bands", ["bands"], numpy.float64, int),
+    HeaderField("samples", ["samples"], numpy.float64, int),
+    HeaderField("lines", ["lines"], numpy.float64, int),
+    HeaderField("fps", ["fps"], numpy.float64, float),
+    HeaderField("tint", ["tint"], numpy.float64, float),
+    HeaderField("tint1", ["tint1", "tint_vnir"], numpy.float64, float),
+    HeaderField("tint2", ["tint2", "tint_swir"], numpy.float64, float),
+    HeaderField("binning", ["binning", "binning_vnir"], numpy.float64,
+                first_digit),
+    HeaderField("binning2", ["binning2", "binning_swir"], numpy.float64,
+                first_digit),
+    HeaderField("temperature", ["temperature"], numpy.float64, first_value)]
+
+def _get_missing_value(field):
+    """
+    Get value to use if a field isn't in a header (NaN for numeric fields
+    and an empty string for strings).
+    """
+    if numpy.dtype(field.numpy_dtype).kind in ("U", "S"):
+        return ""
+    return float("nan")
+
+def read_header_fields(header_file, fields=DEFAULT_FIELDS):
+    """
+    Read a header and extract values for fields.
+
+    Returns a tuple with a value for each field. Missing values or those which
+    couldn't be converted are set to NaN (or an empty string).
+    """
+    header_dict = envi_header.read_hdr_file(header_file)
+
+    values = []
+    for field in fields:
+        value = _get_missing_value(field)
+        for key in field.keys:
+            if key in header_dict:
+                try:
+                    value = field.converter(header_dict[key])
+                except (ValueError, IndexError):
+                    pass
+                break
+        values.append(value)
+
+    return tuple(values)
+
+def _read_header_fields_task(task):
+    """
+    Read header fields within a worker process
+    """
+    header_file, fields = task
+    return read_header_fields(header_file, fields)
+
+def _get_file_id(header_file):
+    """
+    Get modification time and size of a file to check if it has changed
+    """
+    file_stat = os.stat(header_file)
+    return (getattr(file_stat, "st_mtime_ns", file_stat.st_mtime),
+            file_stat.st_size)
+
+def _load_cache(cache_file, field_names):
+    """
+    Load cached values, returns an empty cache if the file doesn't exist
+    or was created for a different list of fields.
+    """
+    if cache_file is None or not os.path.isfile(cache_file):
+        return {}
+    try:
+        with open(cache_file, "rb") as cache_handler:
+            cache_data = pickle.load(cache_handler)
+    except Exception:
+        return {}
+    if cache_data.get("fields") != field_names:
+        return {}
+    return cache_data["headers"]
+
+def _save_cache(cache_file, field_names, header_cache):
+    """
+    Save cached values
+    """
+    with open(cache_file, "wb") as cache_handler:
+        pickle.dump({"fields": field_names, "headers": header_cache},
+                    cache_handler, protocol=2)
+
+def scan_headers(header_files, fields=DEFAULT_FIELDS, workers=1,
+                 cache_file=None):
+    """
+    Read values for fields from a list of ENVI header files.
+
+    Requires:
+
+    * header_files - List of header files
+    * fields - List of HeaderField to extract (optional, default DEFAULT_FIELDS)
+    * workers - Number of processes to use to parse headers (optional)
+    * cache_file - File to store values in, only headers which aren't in
+      the cache or have changed will be parsed. Headers in the cache which
+      no longer exist are removed (optional)
+
+    Returns a numpy structured array with a row for each header and a column
+    for 'file' and each field.
+
+    """
+    field_names = [field.name for field in fields]
+    header_cache = _load_cache(cache_file, field_names)
+
+    # Remove headers which have been deleted from the cache
+    deleted = [header_path for header_path in header_cache
+               if not os.path.isfile(header_path)]
+    for header_path in deleted:
+        del header_cache[header_path]
+
+    file_ids = {}
+    to_read = []
+    for header_file in header_files:
+        header_path = os.path.abspath(header_file)
+        file_ids[header_path] = _get_file_id(header_path)
+        cached = header_cache.get(header_path)
+        if cached is None or cached[0] != file_ids[header_path]:
+            to_read.append(header_path)
+
+    # Parse all headers which aren't in the cache
+    tasks = [(header_path, fields) for header_path in to_read]
+    if workers > 1 and len(tasks) > 1:
+        process_pool = multiprocessing.Pool(workers)
+        try:
+            read_values = process_pool.map(_read_header_fields_task, tasks,
+                                           chunksize=max(1, len(tasks)
+                                                         // (workers * 4)))
+            process_pool.close()
+        except:
+            process_pool.terminate()
+            raise
+        finally:
+            process_pool.join()
+    else:
+        read_values = [_read_header_fields_task(task) for task in tasks]
+
+    for header_path, values in zip(to_read, read_values):
+        header_cache[header_path] = (file_ids[header_path], values)
+
+    if cache_file is not None and (len(to_read) > 0 or len(deleted) > 0):
+        _save_cache(cache_file, field_names, header_cache)
+
+    # Create table
+    table_dtype = [("file", "U{}".format(max([1] + [len(header_file) for
+                                                    header_file in
+                                                    header_files])))]
+    table_dtype.extend([(field.name, field.numpy_dtype) for field in fields])
+    header_table = numpy.zeros(len(header_files), dtype=table_dtype)
+
+    for i, header_file in enumerate(header_files):
+        values = header_cache[os.path.abspath(header_file)][1]
+        header_table[i] = (header_file,) + values
+
+    return header_table
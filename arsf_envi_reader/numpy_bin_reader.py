@@ -23,9 +23,15 @@ check_size written by Terry Cain and originally part of bil_library
 import abc
 import collections
 import os
+import threading
 import numpy
 from . import envi_header
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 # Try to import c++ arsf binaryreader (faster)
 HAVE_ARSF_BINARYREADER = False
 try:
@@ -34,14 +40,115 @@ try:
 except ImportError:
     pass
 
+#: Default amount of memory (in bytes) to use for each block of lines
+#: returned by iter_blocks
+DEFAULT_BLOCK_MEMORY = 64 * 1024 * 1024
+
+#: Order of dimensions in the file for each interleave
+INTERLEAVE_AXES = {"bil": ("lines", "bands", "samples"),
+                   "bsq": ("bands", "lines", "samples"),
+                   "bip": ("lines", "samples", "bands")}
+
+class _Prefetcher(object):
+    """
+    Class to read records (e.g., lines) from a file in a background thread.
+
+    Records are read in order into a pool of 'n_buffers' + 1 reusable buffers,
+    so up to 'n_buffers' records are read ahead of the one being used.
+
+    The first dimension of 'record_shape' is the number of lines in each
+    record. If the last record is incomplete only the complete lines
+    are returned.
+    """
+    def __init__(self, binary_file, numpy_dtype, record_shape, n_records,
+                 n_buffers):
+        self.free_buffers = queue.Queue()
+        self.full_buffers = queue.Queue()
+        self.stop_event = threading.Event()
+        self.current_buffer = None
+
+        for _ in range(n_buffers + 1):
+            self.free_buffers.put(numpy.empty(record_shape, dtype=numpy_dtype))
+
+        self.read_thread = threading.Thread(target=self._read_records,
+                                            args=(binary_file, n_records))
+        self.read_thread.daemon = True
+        self.read_thread.start()
+
+    def _read_records(self, binary_file, n_records):
+        """
+        Read records into free buffers until 'n_records' have been read,
+        the end of the file is reached or close is called.
+        """
+        try:
+            with open(binary_file, "rb") as file_handler:
+                for _ in range(n_records):
+                    record = self.free_buffers.get()
+                    if self.stop_event.is_set():
+                        return
+                    n_bytes = file_handler.readinto(record)
+                    self.full_buffers.put((record, n_bytes))
+                    if n_bytes < record.nbytes:
+                        break
+        except Exception as err:
+            self.full_buffers.put((None, err))
+            return
+        self.full_buffers.put((None, None))
+
+    def get(self):
+        """
+        Get the next record. Returns None once all records have been read.
+
+        The buffer used for the record is reused once the next record
+        is requested.
+        """
+        if self.current_buffer is not None:
+            self.free_buffers.put(self.current_buffer)
+            self.current_buffer = None
+
+        record, n_bytes = self.full_buffers.get()
+
+        if record is None:
+            # Put back so subsequent calls also get the end of the file
+            self.full_buffers.put((record, n_bytes))
+            if n_bytes is not None:
+                raise n_bytes
+            return None
+
+        self.current_buffer = record
+        n_lines = n_bytes // (record.nbytes // record.shape[0])
+        if n_lines == 0:
+            return None
+        return record[:n_lines]
+
+    def close(self):
+        """
+        Stop the read thread.
+        """
+        self.stop_event.set()
+        # Make sure the read thread isn't left waiting for a buffer
+        self.free_buffers.put(None)
+
 class _BinaryReader(collections.Iterator):
     """
     Abstract class for reading binary files with different interleaves.
+
+    If 'memmap' is True the file is opened as a numpy.memmap and data
+    are returned as views of this rather than being copied.
+
+    If 'prefetch' is greater than 0 (and memmap isn't used) when iterating
+    through the file a background thread reads up to 'prefetch' lines (or
+    bands for BSQ) ahead of the one being used. The arrays returned are
+    reused for later lines so need to be copied if they are to be kept after
+    the next line is requested.
     """
-    def __init__(self, input_file):
+    def __init__(self, input_file, memmap=False, prefetch=0):
 
         self.binreader_file = None
         self.file_handler = None
+        self.memmap_data = None
+        self.prefetch = prefetch
+        self.prefetcher = None
 
         # File name of binary file
         self.binary_file = input_file
@@ -63,7 +170,15 @@ class _BinaryReader(collections.Iterator):
         self.interleave_checked = False
 
         # Open binary file
-        if HAVE_ARSF_BINARYREADER:
+        if memmap:
+            if not self.check_size(input_file):
+                raise IOError("Could not open file, "
+                              "size doesn't match header")
+            self.memmap_data = numpy.memmap(input_file,
+                                            dtype=self.numpy_dtype,
+                                            mode="r",
+                                            shape=self.get_memmap_shape())
+        elif HAVE_ARSF_BINARYREADER:
             try:
                 self.binreader_file = binfile.BinFile(input_file)
             except Exception as err:
@@ -97,6 +212,10 @@ class _BinaryReader(collections.Iterator):
     def read_pixel(self, sample_number, line_number):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def read_block(self, start_line, n_lines):
+        raise NotImplementedError
+
     def next(self):
         return self.__next__()
 
@@ -124,6 +243,220 @@ class _BinaryReader(collections.Iterator):
         """
         return self.bands
 
+    def get_memmap_shape(self):
+        """
+        Get the shape of the array used to map the whole file.
+
+        This is (lines, bands, samples) for BIL, (bands, lines, samples)
+        for BSQ and (lines, samples, bands) for BIP.
+        """
+        return tuple(getattr(self, axis) for axis in self._get_axes())
+
+    def _get_block_transpose(self):
+        """
+        Get the order to transpose dimensions of an array with the same
+        interleave as the file to lines*bands*samples.
+        """
+        axes = self._get_axes()
+        return [axes.index(axis) for axis in ("lines", "bands", "samples")]
+
+    def _get_axes(self):
+        """
+        Get the order of dimensions in the file from the interleave
+        """
+        interleave = self.hdr_data_dict["interleave"].lower()
+        try:
+            return INTERLEAVE_AXES[interleave]
+        except KeyError:
+            raise Exception("Interleave '{}' is not "
+                            "supported".format(interleave))
+
+    def get_memmap(self):
+        """
+        Return the whole file as a numpy.memmap with the shape given by
+        get_memmap_shape.
+
+        Only available if the file was opened with 'memmap=True'.
+        """
+        if self.memmap_data is None:
+            raise Exception("File was not opened using memmap")
+        return self.memmap_data
+
+    def read_pixels(self, pixels):
+        """
+        Read all bands for a list of pixels, each given as
+        (sample_number, line_number).
+
+        Returns a numpy array n_pixels*bands, in the order the pixels were
+        provided.
+
+        The offset within the file of each value is calculated and values
+        are read in the order they are stored, so only the values needed are
+        read and the file is read from start to end.
+        """
+        pixels = numpy.asarray(pixels, dtype=numpy.int64).reshape(-1, 2)
+
+        if self.memmap_data is None and self.binreader_file is not None:
+            out_pixels = numpy.empty((pixels.shape[0], self.bands),
+                                     dtype=self.numpy_dtype)
+            for i, (sample_number, line_number) in enumerate(pixels):
+                out_pixels[i] = self.read_pixel(sample_number, line_number)
+            return out_pixels
+
+        # Get index of each value for an array n_pixels*bands
+        index_arrays = {"samples": pixels[:, 0][:, numpy.newaxis],
+                        "lines": pixels[:, 1][:, numpy.newaxis],
+                        "bands": numpy.arange(self.bands)[numpy.newaxis, :]}
+        file_index = tuple(index_arrays[axis] for axis in self._get_axes())
+
+        if self.memmap_data is not None:
+            return self.memmap_data[file_index]
+
+        offsets = numpy.ravel_multi_index(file_index, self.get_memmap_shape())
+        offsets = offsets.ravel()
+        read_order = numpy.argsort(offsets)
+
+        out_pixels = numpy.empty(offsets.size, dtype=self.numpy_dtype)
+        out_pixels[read_order] = self._read_runs(offsets[read_order], 1)[:, 0]
+
+        return out_pixels.reshape(pixels.shape[0], self.bands)
+
+    def read_window(self, sample_offset, line_offset, n_samples, n_lines,
+                    bands=None):
+        """
+        Read a spatial subset of the file, starting at 'sample_offset' and
+        'line_offset' with a size of 'n_samples' by 'n_lines'.
+
+        Reads all bands unless a list of band numbers is provided using
+        'bands'.
+
+        Returns a numpy array n_lines*bands*n_samples. If the window extends
+        past the edge of the file only the part within the file is returned.
+        Raises an IndexError if the offsets or bands are outside the file or
+        the window is empty.
+
+        Only the runs of values within the window are read (e.g., part of each
+        band within each line for a BIL file). Where these are contiguous
+        within the file they are read as a single run.
+        """
+        if not 0 <= sample_offset < self.samples:
+            raise IndexError("Sample offset {} is outside the file "
+                             "(0 - {})".format(sample_offset,
+                                               self.samples - 1))
+        if not 0 <= line_offset < self.lines:
+            raise IndexError("Line offset {} is outside the file "
+                             "(0 - {})".format(line_offset, self.lines - 1))
+        if n_samples < 1 or n_lines < 1:
+            raise IndexError("Window size must be at least 1 sample by 1 "
+                             "line, got {} by {}".format(n_samples, n_lines))
+
+        n_samples = min(n_samples, self.samples - sample_offset)
+        n_lines = min(n_lines, self.lines - line_offset)
+        if bands is None:
+            band_numbers = numpy.arange(self.bands)
+        else:
+            band_numbers = numpy.asarray(bands, dtype=numpy.int64).ravel()
+            if band_numbers.size == 0:
+                raise IndexError("No bands were requested")
+            if band_numbers.min() < 0 or band_numbers.max() >= self.bands:
+                raise IndexError("Band numbers must be between 0 and "
+                                 "{}".format(self.bands - 1))
+
+        axes = self._get_axes()
+        out_axes = self._get_block_transpose()
+
+        if self.memmap_data is not None:
+            index_arrays = {"samples": slice(sample_offset,
+                                             sample_offset + n_samples),
+                            "lines": slice(line_offset, line_offset + n_lines),
+                            "bands": band_numbers}
+            window = self.memmap_data[tuple(index_arrays[axis]
+                                            for axis in axes)]
+            return window.transpose(out_axes)
+        elif self.binreader_file is not None:
+            block = self.read_block(line_offset, n_lines)
+            return block[:, band_numbers,
+                         sample_offset:sample_offset + n_samples]
+
+        index_arrays = {"samples": numpy.arange(sample_offset,
+                                                sample_offset + n_samples),
+                        "lines": numpy.arange(line_offset,
+                                              line_offset + n_lines),
+                        "bands": band_numbers}
+        outer_index = index_arrays[axes[0]]
+        middle_index = index_arrays[axes[1]]
+        inner_index = index_arrays[axes[2]]
+        file_shape = self.get_memmap_shape()
+
+        # Read a run covering the window along the inner dimension for each
+        # position along the outer and middle dimensions.
+        run_start = inner_index.min()
+        run_length = inner_index.max() + 1 - run_start
+        offsets = (outer_index[:, numpy.newaxis] * file_shape[1]
+                   + middle_index[numpy.newaxis, :]) * file_shape[2] \
+                    + run_start
+        inner_length = run_length
+
+        # If the runs are contiguous within the file merge them.
+        if run_length == file_shape[2] \
+                and numpy.all(numpy.diff(middle_index) == 1):
+            offsets = offsets[:, :1]
+            run_length *= middle_index.size
+            if middle_index.size == file_shape[1] \
+                    and numpy.all(numpy.diff(outer_index) == 1):
+                offsets = offsets[:1]
+                run_length *= outer_index.size
+
+        window = self._read_runs(offsets.ravel(), run_length)
+        window = window.reshape(outer_index.size, middle_index.size,
+                                inner_length)
+        window = window[:, :, inner_index - run_start]
+
+        return window.transpose(out_axes)
+
+    def get_block_lines(self, block_memory=DEFAULT_BLOCK_MEMORY):
+        """
+        Get the number of lines which can be read as a single block
+        using no more than 'block_memory' bytes (minimum of one line).
+        """
+        return max(1, min(self.lines, int(block_memory // self.line_size)))
+
+    def iter_blocks(self, block_lines=None):
+        """
+        Iterate through the file a block of lines at a time.
+
+        For each block returns a numpy array n_lines*bands*samples, the
+        last block may contain fewer than 'block_lines' lines.
+
+        If 'block_lines' is not provided it is set using get_block_lines
+        so each block uses around DEFAULT_BLOCK_MEMORY bytes.
+
+        If the reader was opened with 'prefetch' the blocks are read in a
+        background thread for BIL and BIP files. The arrays returned are
+        reused so need to be copied if they are to be kept after the next
+        block is requested.
+        """
+        if block_lines is None:
+            block_lines = self.get_block_lines()
+
+        if self.prefetch > 0 and self.memmap_data is None \
+                and self._get_axes()[0] == "lines":
+            n_blocks = (self.lines + block_lines - 1) // block_lines
+            record_shape = (block_lines,) + self.get_memmap_shape()[1:]
+            block_prefetcher = _Prefetcher(self.binary_file, self.numpy_dtype,
+                                           record_shape, n_blocks,
+                                           self.prefetch)
+            try:
+                block = block_prefetcher.get()
+                while block is not None:
+                    yield block.transpose(self._get_block_transpose())
+                    block = block_prefetcher.get()
+            finally:
+                block_prefetcher.close()
+        else:
+            for start_line in range(0, self.lines, block_lines):
+                yield self.read_block(start_line, block_lines)
+
     def have_arsf_binaryreader(self):
         """
         Check if arsf_binaryreader is available
@@ -177,9 +510,68 @@ class _BinaryReader(collections.Iterator):
         # so the difference between the two should be 0
         return actual_file_size - calculated_size == 0
 
+    def _read_prefetched(self, record_shape, n_records):
+        """
+        Get the next record from the background read thread, starting
+        the thread if needed.
+
+        Returns None once all records have been read.
+        """
+        if self.prefetcher is None:
+            self.prefetcher = _Prefetcher(self.binary_file, self.numpy_dtype,
+                                          record_shape, n_records,
+                                          self.prefetch)
+        return self.prefetcher.get()
+
+    def _read_runs(self, offsets, run_length):
+        """
+        Read runs of 'run_length' values from the file, starting at each
+        offset in 'offsets'. Offsets are given as a number of values (not
+        bytes) from the start of the file and should be in ascending order so
+        the file is read from start to end.
+
+        Returns a numpy array with the shape (len(offsets), run_length).
+
+        Used to read data which isn't stored contiguously (e.g., a band
+        from a BIL file) by seeking to each run and reading into a single
+        preallocated array.
+        """
+        out_data = numpy.empty((len(offsets), run_length),
+                               dtype=self.numpy_dtype)
+        run_size = run_length * self.byte_size
+
+        for i, offset in enumerate(offsets):
+            self.file_handler.seek(int(offset) * self.byte_size)
+            if self.file_handler.readinto(out_data[i]) != run_size:
+                raise IOError("Could not read {} bytes from offset {} in "
+                              "{}".format(run_size, int(offset) * self.byte_size,
+                                          self.binary_file))
+
+        self._reset_position()
+
+        return out_data
+
+    def _reset_position(self):
+        """
+        Reset the file, line and band after a random read so iteration
+        starts again from the beginning of the file.
+
+        Any background read thread is stopped, as it would otherwise carry
+        on from its own position in the file.
+        """
+        self.file_handler.seek(0)
+        self.current_line = -1
+        self.current_band = -1
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
     def __del__(self):
         if self.file_handler is not None:
             self.file_handler.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.memmap_data = None
 
 
 class BilReader(_BinaryReader):
@@ -191,6 +583,9 @@ class BilReader(_BinaryReader):
     If arsf_binaryreader (https://github.com/arsf/arsf_binaryreader) is available
     will use this. If not will use NumPy
 
+    If opened with 'memmap=True' the file is mapped using numpy.memmap and
+    lines, bands and pixels are returned as views without copying data.
+
     Example::
 
        from arsf_envi_reader import numpy_bin_reader
@@ -228,8 +623,18 @@ class BilReader(_BinaryReader):
         if self.current_line >= self.lines:
             raise StopIteration
 
+        # If using memmap return a view of the line
+        if self.memmap_data is not None:
+            return self.memmap_data[self.current_line]
+        # If prefetching get line from read thread
+        elif self.prefetch > 0:
+            line = self._read_prefetched((1, self.bands, self.samples),
+                                         self.lines)
+            if line is None:
+                raise StopIteration
+            return line[0]
         # If arsf_binaryreader is available read line using this
-        if HAVE_ARSF_BINARYREADER:
+        elif self.binreader_file is not None:
             line = self.binreader_file.Readline(self.current_line)
         # If arsf_binaryreader is not available read using NumPy
         else:
@@ -246,7 +651,9 @@ class BilReader(_BinaryReader):
         """
         Read data for a user specified line
         """
-        if HAVE_ARSF_BINARYREADER:
+        if self.memmap_data is not None:
+            return self.memmap_data[line_number]
+        elif self.binreader_file is not None:
             line = self.binreader_file.Readline(line_number)
         else:
             # Reset file
@@ -257,8 +664,7 @@ class BilReader(_BinaryReader):
             line = numpy.fromstring(self.file_handler.read(self.line_size),
                                     dtype=self.numpy_dtype)
             # Reset file and line
-            self.file_handler.seek(0)
-            self.current_line = -1
+            self._reset_position()
 
         line = line.reshape(self.bands, self.samples)
         return line
@@ -267,30 +673,67 @@ class BilReader(_BinaryReader):
         """
         Read data for a user specified band
 
-        Currently only supported if ARSF binary reader (binfile) library
-        is available.
+        If binfile is not available the band is read from each line in turn,
+        seeking over the other bands.
         """
-        if HAVE_ARSF_BINARYREADER:
+        if self.memmap_data is not None:
+            return self.memmap_data[:, band_number, :]
+        elif self.binreader_file is not None:
             band = self.binreader_file.Readband(band_number)
             return band[1]
         else:
-            raise NotImplementedError("Need 'binfile' library to specify band")
+            offsets = (numpy.arange(self.lines) * self.bands + band_number) \
+                        * self.samples
+            band = self._read_runs(offsets, self.samples)
+
+        return band
 
     def read_pixel(self, sample_number, line_number):
         """
         Read all bands for a given pixel
         """
+        if self.memmap_data is not None:
+            return self.memmap_data[line_number, :, sample_number]
+
         line = self.read_line(line_number)
         pixel = line[:, sample_number]
 
         return pixel
 
+    def read_block(self, start_line, n_lines):
+        """
+        Read a block of 'n_lines' lines starting at 'start_line'
+
+        Returns a numpy array n_lines*bands*samples. If the block extends
+        past the end of the file only the remaining lines are returned.
+        """
+        n_lines = min(n_lines, self.lines - start_line)
+
+        if self.memmap_data is not None:
+            return self.memmap_data[start_line:start_line + n_lines]
+        elif self.binreader_file is not None:
+            block = numpy.empty((n_lines, self.bands, self.samples),
+                                dtype=self.numpy_dtype)
+            for i in range(n_lines):
+                block[i] = self.read_line(start_line + i)
+        else:
+            # Lines are contiguous in a BIL file so read as a single run
+            offsets = [start_line * self.bands * self.samples]
+            block = self._read_runs(offsets,
+                                    n_lines * self.bands * self.samples)
+
+        block = block.reshape(n_lines, self.bands, self.samples)
+        return block
+
 class BsqReader(_BinaryReader):
     """
     Class to read ENVI BSQ file band at a time
 
     For each line returns a numpy array samples*lines
 
+    If opened with 'memmap=True' the file is mapped using numpy.memmap and
+    lines, bands and pixels are returned as views without copying data.
+
     Example::
 
        from arsf_envi_reader import numpy_bin_reader
@@ -328,8 +771,18 @@ class BsqReader(_BinaryReader):
         if self.current_band >= self.bands:
             raise StopIteration
 
-        # If arsf_binaryreader is available read line using this
-        if HAVE_ARSF_BINARYREADER:
+        # If using memmap return a view of the band
+        if self.memmap_data is not None:
+            return self.memmap_data[self.current_band]
+        # If prefetching get band from read thread
+        elif self.prefetch > 0:
+            band = self._read_prefetched((1, self.lines, self.samples),
+                                         self.bands)
+            if band is None:
+                raise StopIteration
+            return band[0]
+        # If arsf_binaryreader is available read band using this
+        elif self.binreader_file is not None:
             band = self.binreader_file.Readband(self.current_band)[1]
         # If arsf_binaryreader is not available read using NumPy
         else:
@@ -346,20 +799,28 @@ class BsqReader(_BinaryReader):
         """
         Read data for a user specified line
 
-        Currently only supported if ARSF binary reader (binfile) library
-        is available.
+        If binfile is not available the line is read from each band in turn,
+        seeking over the other lines.
         """
-        if HAVE_ARSF_BINARYREADER:
+        if self.memmap_data is not None:
+            return self.memmap_data[:, line_number, :]
+        elif self.binreader_file is not None:
             line = self.binreader_file.Readline(line_number)
             return line
         else:
-            raise NotImplementedError("Need 'binfile' library to specify line")
+            offsets = (numpy.arange(self.bands) * self.lines + line_number) \
+                        * self.samples
+            line = self._read_runs(offsets, self.samples)
+
+        return line
 
     def read_band(self, band_number):
         """
         Read data for a user specified band
         """
-        if HAVE_ARSF_BINARYREADER:
+        if self.memmap_data is not None:
+            return self.memmap_data[band_number]
+        elif self.binreader_file is not None:
             band = self.binreader_file.Readband(band_number)[1]
         else:
             # Reset file
@@ -370,8 +831,7 @@ class BsqReader(_BinaryReader):
             band = numpy.fromstring(self.file_handler.read(self.band_size),
                                     dtype=self.numpy_dtype)
             # Reset file and band
-            self.file_handler.seek(0)
-            self.current_band = -1
+            self._reset_position()
 
         band = band.reshape(self.lines, self.samples)
         return band
@@ -379,16 +839,194 @@ class BsqReader(_BinaryReader):
     def read_pixel(self, sample_number, line_number):
         """
         Read all bands for a given pixel
+
+        If binfile is not available only the value for the pixel is read
+        from each band.
         """
+        if self.memmap_data is not None:
+            return self.memmap_data[:, line_number, sample_number]
+        elif self.binreader_file is None:
+            offsets = numpy.arange(self.bands) * self.lines * self.samples \
+                        + line_number * self.samples + sample_number
+            return self._read_runs(offsets, 1)[:, 0]
+
         pixel = numpy.zeros(self.bands, dtype=self.numpy_dtype)
 
         for band_num in range(self.bands):
-            if HAVE_ARSF_BINARYREADER:
-                band = self.binreader_file.Readbandline(band_num, line_number)[1]
-                pixel[band_num] = band[sample_number]
-            else:
-                band = self.read_band(band_num)
-                pixel[band_num] = band[line_number, sample_number]
+            band = self.binreader_file.Readbandline(band_num, line_number)[1]
+            pixel[band_num] = band[sample_number]
 
         return pixel
 
+    def read_block(self, start_line, n_lines):
+        """
+        Read a block of 'n_lines' lines starting at 'start_line'
+
+        Returns a numpy array n_lines*bands*samples. If the block extends
+        past the end of the file only the remaining lines are returned.
+        """
+        n_lines = min(n_lines, self.lines - start_line)
+
+        if self.memmap_data is not None:
+            block = self.memmap_data[:, start_line:start_line + n_lines, :]
+            return block.transpose(1, 0, 2)
+        elif self.binreader_file is not None:
+            block = numpy.empty((n_lines, self.bands, self.samples),
+                                dtype=self.numpy_dtype)
+            for i in range(n_lines):
+                block[i] = self.read_line(start_line + i).reshape(self.bands,
+                                                                  self.samples)
+            return block
+        else:
+            # Read the lines from each band as a single run
+            offsets = (numpy.arange(self.bands) * self.lines + start_line) \
+                        * self.samples
+            block = self._read_runs(offsets, n_lines * self.samples)
+
+        block = block.reshape(self.bands, n_lines, self.samples)
+        return block.transpose(1, 0, 2)
+
+
+
+class BipReader(_BinaryReader):
+    """
+    Class to read ENVI BIP file line at a time
+
+    For each line returns a numpy array bands*samples (the same as BilReader)
+
+    If opened with 'memmap=True' the file is mapped using numpy.memmap and
+    lines, bands and pixels are returned as views without copying data.
+
+    Example::
+
+       from arsf_envi_reader import numpy_bin_reader
+
+       # Open input file
+       in_data = numpy_bin_reader.BipReader('FENIX219b-14-1.bip')
+
+       for line in in_data:
+          print(line.mean(axis=1))
+
+       in_data = None
+
+    """
+
+    def __next__(self):
+        # Check we have a BIP file
+        if not self.check_interleave("bip"):
+            raise Exception("The class 'BipReader' is only "
+                            "valid for BIP format files")
+
+        self.current_line +=1
+
+        # Check if the line is within image
+        if self.current_line >= self.lines:
+            raise StopIteration
+
+        # If using memmap return a view of the line
+        if self.memmap_data is not None:
+            return self.memmap_data[self.current_line].transpose()
+        # If prefetching get line from read thread
+        elif self.prefetch > 0:
+            line = self._read_prefetched((1, self.samples, self.bands),
+                                         self.lines)
+            if line is None:
+                raise StopIteration
+            return line[0].transpose()
+        # If arsf_binaryreader is available read line using this
+        elif self.binreader_file is not None:
+            line = self.binreader_file.Readline(self.current_line)
+            return line.reshape(self.bands, self.samples)
+        # If arsf_binaryreader is not available read using NumPy
+        else:
+            line = numpy.empty((self.samples, self.bands),
+                               dtype=self.numpy_dtype)
+            if self.file_handler.readinto(line) < self.line_size:
+                raise StopIteration
+
+        line = line.transpose()
+
+        return line
+
+    def read_line(self, line_number):
+        """
+        Read data for a user specified line
+        """
+        if self.memmap_data is not None:
+            return self.memmap_data[line_number].transpose()
+        elif self.binreader_file is not None:
+            line = self.binreader_file.Readline(line_number)
+            return line.reshape(self.bands, self.samples)
+        else:
+            offsets = [line_number * self.samples * self.bands]
+            line = self._read_runs(offsets, self.samples * self.bands)
+
+        line = line.reshape(self.samples, self.bands).transpose()
+        return line
+
+    def read_band(self, band_number):
+        """
+        Read data for a user specified band
+
+        As the values for each band are spread through the file this
+        requires reading each line in turn.
+        """
+        if self.memmap_data is not None:
+            return self.memmap_data[:, :, band_number]
+        elif self.binreader_file is not None:
+            band = self.binreader_file.Readband(band_number)
+            return band[1]
+
+        band = numpy.empty((self.lines, self.samples), dtype=self.numpy_dtype)
+        line = numpy.empty((self.samples, self.bands), dtype=self.numpy_dtype)
+
+        self.file_handler.seek(0)
+        for line_number in range(self.lines):
+            self.file_handler.readinto(line)
+            band[line_number] = line[:, band_number]
+
+        # Reset file and line
+        self._reset_position()
+
+        return band
+
+    def read_pixel(self, sample_number, line_number):
+        """
+        Read all bands for a given pixel
+        """
+        if self.memmap_data is not None:
+            return self.memmap_data[line_number, sample_number, :]
+        elif self.binreader_file is not None:
+            return self.read_line(line_number)[:, sample_number]
+
+        offsets = [(line_number * self.samples + sample_number) * self.bands]
+        pixel = self._read_runs(offsets, self.bands)[0]
+
+        return pixel
+
+    def read_block(self, start_line, n_lines):
+        """
+        Read a block of 'n_lines' lines starting at 'start_line'
+
+        Returns a numpy array n_lines*bands*samples. If the block extends
+        past the end of the file only the remaining lines are returned.
+        """
+        n_lines = min(n_lines, self.lines - start_line)
+
+        if self.memmap_data is not None:
+            block = self.memmap_data[start_line:start_line + n_lines]
+            return block.transpose(0, 2, 1)
+        elif self.binreader_file is not None:
+            block = numpy.empty((n_lines, self.bands, self.samples),
+                                dtype=self.numpy_dtype)
+            for i in range(n_lines):
+                block[i] = self.read_line(start_line + i)
+            return block
+        else:
+            # Lines are contiguous in a BIP file so read as a single run
+            offsets = [start_line * self.samples * self.bands]
+            block = self._read_runs(offsets,
+                                    n_lines * self.samples * self.bands)
+
+        block = block.reshape(n_lines, self.samples, self.bands)
+        return block.transpose(0, 2, 1)
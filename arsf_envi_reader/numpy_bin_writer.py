@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Module for writing ENVI Binary data
+
+Lines (or blocks of lines) are buffered in memory and written out in large
+chunks. The header is written when the file is closed using the shape and
+data type of the output file. If the file isn't closed (e.g., an exception
+is raised within a 'with' block) no header is written, so an incomplete
+file isn't mistaken for a valid one.
+
+"""
+
+###########################################################
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+###########################################################
+
+import collections
+import sys
+import numpy
+from . import envi_header
+
+#: Default amount of memory (in bytes) to use to buffer lines before writing
+DEFAULT_BUFFER_MEMORY = 64 * 1024 * 1024
+
+class _BinaryWriter(object):
+    """
+    Abstract class for writing binary files with different interleaves.
+
+    Requires the size of the output file and numpy data type. If a header
+    dictionary is provided (e.g., from the input file) keys will be copied
+    to the output header, with the size, data type and interleave set to
+    match the output file.
+    """
+    interleave = None
+
+    def __init__(self, output_file, samples, lines, bands, numpy_dtype,
+                 hdr_data_dict=None):
+
+        self.output_file = output_file
+        self.header_file = output_file + ".hdr"
+        self.samples = int(samples)
+        self.lines = int(lines)
+        self.bands = int(bands)
+        self.numpy_dtype = numpy.dtype(numpy_dtype)
+        self.byte_size = self.numpy_dtype.itemsize
+        self.line_size = self.samples * self.bands * self.byte_size
+        self.current_line = 0
+        # Set to False once the output file has been opened
+        self.closed = True
+
+        if hdr_data_dict is None:
+            hdr_data_dict = collections.OrderedDict()
+
+        self.hdr_data_dict = self.get_output_hdr_dict(hdr_data_dict)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def get_output_hdr_dict(self, hdr_data_dict):
+        """
+        Get a copy of a header dictionary with the size, data type and
+        interleave set for the output file.
+        """
+        output_hdr_dict = collections.OrderedDict(hdr_data_dict)
+
+        output_hdr_dict["samples"] = self.samples
+        output_hdr_dict["lines"] = self.lines
+        output_hdr_dict["bands"] = self.bands
+        output_hdr_dict["data type"] = \
+                    envi_header.NUMPY_TO_ENVI_DTYPE[self.numpy_dtype.name]
+        output_hdr_dict["interleave"] = self.interleave
+        # Data are written using the byte order of this machine
+        output_hdr_dict["byte order"] = 0 if sys.byteorder == "little" else 1
+        if "header offset" in output_hdr_dict:
+            output_hdr_dict["header offset"] = 0
+        if "_comments" not in output_hdr_dict:
+            output_hdr_dict["_comments"] = ""
+
+        return output_hdr_dict
+
+    def get_hdr_dict(self):
+        """
+        Return the dictionary of parameters which will be written to the
+        header. Can be edited before the file is closed.
+        """
+        return self.hdr_data_dict
+
+    def write_line(self, line, line_number=None):
+        """
+        Write a line (numpy array bands*samples).
+        """
+        self.write_block(line.reshape(1, self.bands, self.samples),
+                         line_number)
+
+    def write_block(self, block, start_line=None):
+        """
+        Write a block of lines (numpy array n_lines*bands*samples).
+        """
+        raise NotImplementedError
+
+    def _check_lines(self, start_line, n_lines):
+        """
+        Check a block of lines is within the output file.
+        """
+        if start_line < 0 or start_line + n_lines > self.lines:
+            raise IndexError("Lines {} - {} are outside output file with {} "
+                             "lines".format(start_line,
+                                            start_line + n_lines - 1,
+                                            self.lines))
+
+    def close(self):
+        """
+        Write any remaining data and the header
+        """
+        if not self.closed:
+            self.closed = True
+            self._close_data()
+            envi_header.write_envi_header(self.header_file,
+                                          self.hdr_data_dict)
+
+    def abort(self):
+        """
+        Close the data file without writing the header, used if writing
+        the file failed.
+        """
+        if not self.closed:
+            self.closed = True
+            self._close_data()
+
+    def _close_data(self):
+        raise NotImplementedError
+
+    def __del__(self):
+        self.abort()
+
+
+class BilWriter(_BinaryWriter):
+    """
+    Class to write ENVI BIL file a line or block of lines at a time.
+
+    Lines must be written in order. They are copied into a buffer of
+    'buffer_memory' bytes and converted to the output data type, the buffer
+    is written out once it is full. The output file is allocated to the full
+    size when opened.
+
+    Example::
+
+       import numpy
+       from arsf_envi_reader import numpy_bin_reader
+       from arsf_envi_reader import numpy_bin_writer
+
+       # Open input file
+       in_data = numpy_bin_reader.BilReader('FENIX219b-14-1.raw')
+
+       # Open output file
+       out_data = numpy_bin_writer.BilWriter("out_file.bil",
+                                             in_data.get_num_samples(),
+                                             in_data.get_num_lines(),
+                                             in_data.get_num_bands(),
+                                             numpy.float32,
+                                             in_data.get_hdr_dict())
+
+       for line in in_data:
+          out_data.write_line(line + 1)
+
+       # Close file and write header, if the file isn't closed no header
+       # is written.
+       out_data.close()
+       in_data = None
+
+    """
+    interleave = "bil"
+
+    def __init__(self, output_file, samples, lines, bands, numpy_dtype,
+                 hdr_data_dict=None, buffer_memory=DEFAULT_BUFFER_MEMORY):
+        _BinaryWriter.__init__(self, output_file, samples, lines, bands,
+                               numpy_dtype, hdr_data_dict)
+
+        buffer_lines = max(1, min(self.lines,
+                                  int(buffer_memory // self.line_size)))
+        self.buffer = numpy.empty((buffer_lines, self.bands, self.samples),
+                                  dtype=self.numpy_dtype)
+        self.buffer_used = 0
+
+        self.file_handler = open(output_file, "wb")
+        # Allocate full size of file
+        self.file_handler.truncate(self.lines * self.line_size)
+        self.closed = False
+
+    def write_block(self, block, start_line=None):
+        """
+        Write a block of lines (numpy array n_lines*bands*samples).
+
+        If provided 'start_line' must be the next line in the file.
+        """
+        if start_line is not None and start_line != self.current_line:
+            raise ValueError("BilWriter can only write lines in order, "
+                             "expected line {} got "
+                             "{}".format(self.current_line, start_line))
+        n_lines = block.shape[0]
+        self._check_lines(self.current_line, n_lines)
+
+        written_lines = 0
+        while written_lines < n_lines:
+            copy_lines = min(n_lines - written_lines,
+                             self.buffer.shape[0] - self.buffer_used)
+            self.buffer[self.buffer_used:self.buffer_used + copy_lines] = \
+                            block[written_lines:written_lines + copy_lines]
+            self.buffer_used += copy_lines
+            written_lines += copy_lines
+            if self.buffer_used == self.buffer.shape[0]:
+                self.flush()
+
+        self.current_line += n_lines
+
+    def flush(self):
+        """
+        Write out lines held in the buffer
+        """
+        if self.buffer_used > 0:
+            self.buffer[:self.buffer_used].tofile(self.file_handler)
+            self.buffer_used = 0
+        self.file_handler.flush()
+
+    def close(self):
+        """
+        Write any remaining data and the header.
+
+        As lines are written in order, raises an IOError (without writing
+        the header) if fewer lines were written than the output file has.
+        """
+        if not self.closed and self.current_line != self.lines:
+            self.abort()
+            raise IOError("Only {} of {} lines were written to {}, header "
+                          "not written".format(self.current_line, self.lines,
+                                               self.output_file))
+        _BinaryWriter.close(self)
+
+    def _close_data(self):
+        self.flush()
+        self.file_handler.close()
+
+
+class BsqWriter(_BinaryWriter):
+    """
+    Class to write ENVI BSQ file a line, block of lines or band at a time.
+
+    The output file is mapped using numpy.memmap so lines and bands can be
+    written in any order. If no line number is provided lines are written
+    following the previous line.
+
+    Example::
+
+       import numpy
+       from arsf_envi_reader import numpy_bin_reader
+       from arsf_envi_reader import numpy_bin_writer
+
+       # Open input file
+       in_data = numpy_bin_reader.BilReader('FENIX219b-14-1.raw')
+
+       # Open output file
+       with numpy_bin_writer.BsqWriter("out_file.bsq",
+                                       in_data.get_num_samples(),
+                                       in_data.get_num_lines(),
+                                       in_data.get_num_bands(),
+                                       numpy.float32,
+                                       in_data.get_hdr_dict()) as out_data:
+          for block in in_data.iter_blocks():
+             out_data.write_block(block + 1)
+
+       in_data = None
+
+    """
+    interleave = "bsq"
+
+    def __init__(self, output_file, samples, lines, bands, numpy_dtype,
+                 hdr_data_dict=None):
+        _BinaryWriter.__init__(self, output_file, samples, lines, bands,
+                               numpy_dtype, hdr_data_dict)
+
+        self.memmap_data = numpy.memmap(output_file, dtype=self.numpy_dtype,
+                                        mode="w+",
+                                        shape=(self.bands, self.lines,
+                                               self.samples))
+        self.closed = False
+
+    def write_block(self, block, start_line=None):
+        """
+        Write a block of lines (numpy array n_lines*bands*samples)
+        starting at 'start_line'.
+        """
+        if start_line is None:
+            start_line = self.current_line
+        n_lines = block.shape[0]
+        self._check_lines(start_line, n_lines)
+
+        self.memmap_data[:, start_line:start_line + n_lines, :] = \
+                                                    block.transpose(1, 0, 2)
+        self.current_line = start_line + n_lines
+
+    def write_band(self, band, band_number):
+        """
+        Write a band (numpy array lines*samples)
+        """
+        self.memmap_data[band_number] = band
+
+    def flush(self):
+        """
+        Write any changes to the file
+        """
+        self.memmap_data.flush()
+
+    def _close_data(self):
+        self.flush()
+        self.memmap_data = None
@@ -17,8 +17,10 @@ Requires:
 
 Known Issues:
 
-Can use a lot of memory as loads three bands of an image to memory
-and arrays for x,y,r,g,b from LAS file.
+Can use a lot of memory as loads arrays for x,y,r,g,b from LAS file.
+To limit memory use points can be read in chunks using '--chunk_size'.
+This requires laspy 2.0 or later. The image is read in tiles as they
+are needed, the memory used to keep tiles is set using '--tile_cache'.
 
 Author: Dan Clewley
 Creation Date: 07/12/2015
@@ -32,7 +34,9 @@ Creation Date: 07/12/2015
 
 from __future__ import print_function
 import argparse
+import collections
 import copy
+import glob
 import sys
 import laspy
 import numpy
@@ -43,6 +47,199 @@ from arsf_envi_reader import envi_header
 #: Debug mode - prints out more information useful for debugging.
 DEBUG = False
 
+#: Default number of points to read at once when colouring in chunks
+DEFAULT_CHUNK_SIZE = 1000000
+
+#: Default size (in pixels) of tiles read from the image
+DEFAULT_TILE_SIZE = 256
+
+#: Default amount of memory (in bytes) used to keep tiles read from the image
+DEFAULT_TILE_CACHE_MEMORY = 256*1024*1024
+
+#: Number of lines read at once when calculating statistics for a stretch
+STATS_BLOCK_LINES = 256
+
+#: Number of histogram bins used to calculate percentiles for a stretch
+HISTOGRAM_BINS = 10000
+
+#: Default lower and upper percentiles for a percentile stretch
+DEFAULT_PERCENTILES = (2, 98)
+
+#: Default maximum number of images kept open when colouring from
+#: multiple images
+DEFAULT_MAX_OPEN_IMAGES = 16
+
+def _iter_band_values(band, sample_rate=1.0, block_lines=STATS_BLOCK_LINES):
+    """
+    Read values from a GDAL band in blocks of lines, yields a flat array
+    of values for each block excluding no data values and NaNs.
+
+    If 'sample_rate' is less than 1 only a subset of lines is read,
+    e.g., for 0.1 every 10th line.
+    """
+    if not 0 < sample_rate <= 1:
+        raise Exception("Sample rate must be greater than 0 and less than "
+                        "or equal to 1, got {}".format(sample_rate))
+
+    n_samples = band.XSize
+    n_lines = band.YSize
+    nodata = band.GetNoDataValue()
+
+    line_step = max(1, int(round(1.0 / sample_rate)))
+    if line_step == 1:
+        windows = [(y_off, min(block_lines, n_lines - y_off))
+                   for y_off in range(0, n_lines, block_lines)]
+    else:
+        windows = [(y_off, 1) for y_off in range(0, n_lines, line_step)]
+
+    for y_off, y_size in windows:
+        values = band.ReadAsArray(0, y_off, n_samples, y_size).ravel()
+        valid = numpy.isfinite(values)
+        if nodata is not None:
+            valid &= values != nodata
+        yield values[valid].astype(numpy.float64)
+
+def _iter_bands_values(bands, sample_rate=1.0):
+    """
+    Read values from a GDAL band, or a list of bands, in blocks using
+    _iter_band_values.
+
+    Bands in the list can also be given as (image file, band number), the
+    image is only opened while values are read from it so many images
+    don't need to be open at once.
+    """
+    if not isinstance(bands, list):
+        bands = [bands]
+    for band in bands:
+        input_ds = None
+        if isinstance(band, tuple):
+            input_ds = gdal.Open(band[0], gdal.GA_ReadOnly)
+            if input_ds is None:
+                raise Exception("Could not open image {}".format(band[0]))
+            band = input_ds.GetRasterBand(band[1])
+        for values in _iter_band_values(band, sample_rate):
+            yield values
+        band = None
+        input_ds = None
+
+def get_band_statistics(band, sample_rate=1.0):
+    """
+    Get statistics for a GDAL band in a single pass, reading a block of
+    lines at a time. Values for each block are combined using the
+    method of Chan et al. (a parallel version of Welford's algorithm).
+
+    If a list of bands is provided (e.g., the same band from overlapping
+    images) statistics are calculated for values from all bands, see
+    _iter_bands_values.
+
+    Returns number of values, mean, standard deviation, minimum and maximum.
+    """
+    count = 0
+    mean = 0.0
+    sum_squares = 0.0
+    min_value = numpy.inf
+    max_value = -numpy.inf
+
+    for values in _iter_bands_values(band, sample_rate):
+        block_count = values.shape[0]
+        if block_count == 0:
+            continue
+        block_mean = values.mean()
+        block_sum_squares = ((values - block_mean)**2).sum()
+
+        delta = block_mean - mean
+        new_count = count + block_count
+        mean += delta * block_count / new_count
+        sum_squares += block_sum_squares \
+                        + delta**2 * count * block_count / new_count
+        count = new_count
+
+        min_value = min(min_value, values.min())
+        max_value = max(max_value, values.max())
+
+    if count == 0:
+        raise Exception("No valid values found in band")
+
+    return count, mean, numpy.sqrt(sum_squares / count), min_value, max_value
+
+def get_band_percentiles(band, percentiles=DEFAULT_PERCENTILES,
+                         sample_rate=1.0, n_bins=HISTOGRAM_BINS):
+    """
+    Get percentiles for a GDAL band from a histogram, rather than sorting
+    all values. Requires two passes through the band, one to get the
+    range of values and one to build the histogram.
+
+    Percentiles are interpolated within histogram bins so are accurate to
+    within (max - min) / n_bins. As for get_band_statistics a list of bands
+    can be provided.
+    """
+    _, _, _, min_value, max_value = get_band_statistics(band, sample_rate)
+
+    if min_value == max_value:
+        return [min_value for _ in percentiles]
+
+    bin_counts = numpy.zeros(n_bins, dtype=numpy.int64)
+    for values in _iter_bands_values(band, sample_rate):
+        bin_counts += numpy.histogram(values, bins=n_bins,
+                                      range=(min_value, max_value))[0]
+
+    bin_width = (max_value - min_value) / n_bins
+    cumulative_counts = numpy.cumsum(bin_counts)
+
+    out_values = []
+    for percentile in percentiles:
+        target_count = percentile / 100.0 * cumulative_counts[-1]
+        bin_index = min(int(numpy.searchsorted(cumulative_counts,
+                                               target_count)), n_bins - 1)
+        count_before = cumulative_counts[bin_index] - bin_counts[bin_index]
+        bin_fraction = 0.0
+        if bin_counts[bin_index] > 0:
+            bin_fraction = (target_count - count_before) \
+                                / float(bin_counts[bin_index])
+        out_values.append(min_value + (bin_index + bin_fraction) * bin_width)
+
+    return out_values
+
+def get_stretch_params(bands, stretch="sd", percentiles=DEFAULT_PERCENTILES,
+                       sample_rate=1.0):
+    """
+    Get the minimum and range used to stretch each of a list of GDAL
+    bands (or lists of bands to use values from all of them).
+
+    Stretches available are:
+
+    * sd - 2 standard deviation stretch (as apply_standard_deviation_stretch)
+    * percentile - linear stretch between two percentiles
+
+    Returns a list of (stretch_min, stretch_range) for each band.
+
+    """
+    stretch_params = []
+    for band in bands:
+        if stretch == "sd":
+            stdev = get_band_statistics(band, sample_rate)[2]
+            stretch_params.append((0, 4 * stdev))
+        elif stretch == "percentile":
+            low_value, high_value = get_band_percentiles(band, percentiles,
+                                                         sample_rate)
+            stretch_params.append((low_value, high_value - low_value))
+        else:
+            raise Exception("Stretch '{}' was not recognised. Options "
+                            "are 'sd' or 'percentile'".format(stretch))
+    return stretch_params
+
+#: Point formats with RGB to use for each input point format
+RGB_POINT_FORMATS = {0: 2, 1: 3, 2: 2, 3: 3, 4: 5, 5: 5,
+                     6: 7, 7: 7, 8: 8, 9: 10, 10: 10}
+
+# Earliest LAS version (major, minor) supporting each of RGB_POINT_FORMATS
+RGB_POINT_FORMAT_VERSIONS = {2: (1, 2), 3: (1, 2), 5: (1, 3),
+                             7: (1, 4), 8: (1, 4), 10: (1, 4)}
+
+# Header values copied from the input LAS file when writing in chunks
+COPY_HEADER_VALUES = ["file_source_id", "uuid", "system_identifier",
+                      "generating_software", "creation_date"]
+
 DEFAULT_WAVELENGTHS = [640, 540, 470]
 
 def get_bands_from_wavelengths(input_image, wavelengths=DEFAULT_WAVELENGTHS):
@@ -57,14 +254,9 @@ def get_bands_from_wavelengths(input_image, wavelengths=DEFAULT_WAVELENGTHS):
     if input_header is None:
         raise Exception("Need to use ENVI header to get bands")
 
-    header_dict = envi_header.read_hdr_file(input_header)
-    image_wavelengths = header_dict['wavelength'].split(',')
+    header = envi_header.EnviHeader.from_file(input_header)
 
-    out_bands = []
-    for wavelength in wavelengths:
-        band = min(range(len(image_wavelengths)),
-                   key=lambda x:abs(float(image_wavelengths[x])-wavelength))
-        out_bands.append(band)
+    out_bands = [int(band) for band in header.get_nearest_bands(wavelengths)]
 
     return out_bands
 
@@ -72,9 +264,16 @@ def get_bands_from_wavelengths(input_image, wavelengths=DEFAULT_WAVELENGTHS):
 class ExtractPixels(object):
     """
     Class to extract RGB values for a given pixel
+
+    By default the three bands are read to memory. If 'read_bands' is False
+    the image is read in tiles as they are needed by get_pixelvals_window.
+    Tiles are aligned to blocks in the image where possible and the most
+    recently used are kept, up to 'tile_cache_memory' bytes.
     """
     def __init__(self, input_image, red_band_num=None,
-                 green_band_num=None, blue_band_num=None):
+                 green_band_num=None, blue_band_num=None, read_bands=True,
+                 tile_size=DEFAULT_TILE_SIZE,
+                 tile_cache_memory=DEFAULT_TILE_CACHE_MEMORY):
         self.input_ds = gdal.Open(input_image, gdal.GA_ReadOnly)
 
         if self.input_ds is None:
@@ -87,6 +286,9 @@ class ExtractPixels(object):
         self.image_tl_y = geotransform[3]
         self.pixel_y_size = geotransform[5]
 
+        self.n_samples = self.input_ds.RasterXSize
+        self.n_lines = self.input_ds.RasterYSize
+
         imagebands = self.input_ds.RasterCount
 
         # Check if image bands have been provided.
@@ -116,41 +318,177 @@ class ExtractPixels(object):
             raise Exception("Specified band is greater than number of bands in "
                             "image ({})".format(imagebands))
 
+        self.band_nums = [red_band_num, green_band_num, blue_band_num]
+
+        # No data value for each band, 0 is used if not set
+        self.nodata_values = []
+        for band_num in self.band_nums:
+            nodata = self.input_ds.GetRasterBand(band_num).GetNoDataValue()
+            self.nodata_values.append(0 if nodata is None else nodata)
+
+        # Minimum and range used to stretch values read using
+        # get_pixelvals_window
+        self.stretch_params = None
 
-        self.red_band = self.input_ds.GetRasterBand(red_band_num).ReadAsArray()
-        self.green_band = self.input_ds.GetRasterBand(green_band_num).ReadAsArray()
-        self.blue_band = self.input_ds.GetRasterBand(blue_band_num).ReadAsArray()
+        # Tiles read from the image, least recently used first
+        block_x_size, block_y_size = \
+                self.input_ds.GetRasterBand(red_band_num).GetBlockSize()
+        self.tile_x_size = self._get_tile_length(block_x_size, tile_size,
+                                                 self.n_samples)
+        self.tile_y_size = self._get_tile_length(block_y_size, tile_size,
+                                                 self.n_lines)
+        self.tile_cache = collections.OrderedDict()
+        self.tile_cache_memory = tile_cache_memory
+        self.tile_cache_used = 0
+
+        if read_bands:
+            self.red_band = self.input_ds.GetRasterBand(red_band_num).ReadAsArray()
+            self.green_band = self.input_ds.GetRasterBand(green_band_num).ReadAsArray()
+            self.blue_band = self.input_ds.GetRasterBand(blue_band_num).ReadAsArray()
+        else:
+            self.red_band = None
+            self.green_band = None
+            self.blue_band = None
 
     def __del__(self):
+        self.tile_cache = None
         self.input_ds = None
 
-    def apply_standard_deviation_stretch(self, in_array):
+    @staticmethod
+    def _get_tile_length(block_length, tile_length, image_length):
+        """
+        Get the length of a tile, as a multiple of the block length unless
+        blocks are much larger than the requested length (e.g., lines of a
+        BIL file).
+        """
+        if block_length <= tile_length * 4:
+            tile_length = int(numpy.ceil(tile_length / float(block_length))) \
+                            * block_length
+        return min(tile_length, image_length)
+
+    def _get_tile(self, tile_row, tile_col):
+        """
+        Get a tile (numpy array 3*tile_y_size*tile_x_size) containing the
+        red, green and blue bands, reading it from the image if it isn't
+        in the cache.
+        """
+        tile_key = (tile_row, tile_col)
+        tile = self.tile_cache.pop(tile_key, None)
+
+        if tile is None:
+            x_off = tile_col * self.tile_x_size
+            y_off = tile_row * self.tile_y_size
+            x_size = min(self.tile_x_size, self.n_samples - x_off)
+            y_size = min(self.tile_y_size, self.n_lines - y_off)
+
+            tile = numpy.array([self.input_ds.GetRasterBand(band_num).ReadAsArray(x_off,
+                                                                                  y_off,
+                                                                                  x_size,
+                                                                                  y_size)
+                                for band_num in self.band_nums])
+            self.tile_cache_used += tile.nbytes
+
+            # Remove least recently used tiles until within memory limit
+            while self.tile_cache and \
+                    self.tile_cache_used > self.tile_cache_memory:
+                _, old_tile = self.tile_cache.popitem(last=False)
+                self.tile_cache_used -= old_tile.nbytes
+
+        self.tile_cache[tile_key] = tile
+
+        return tile
+
+    def apply_standard_deviation_stretch(self, in_array, nodata=None):
         """
         Apply a 2 standard deviation stretch to scale pixel values from
         0 - 255
+
+        No data values and NaNs are excluded when calculating the standard
+        deviation, the same as get_band_statistics.
         """
-        mean = in_array.mean()
-        stdev = in_array.std()
+        valid = numpy.isfinite(in_array)
+        if nodata is not None:
+            valid &= in_array != nodata
+        valid_values = in_array[valid].astype(numpy.float64)
+        if valid_values.shape[0] == 0:
+            raise Exception("No valid values found in band")
+
+        mean = valid_values.mean()
+        stdev = valid_values.std()
 
         sd_min = mean - 2*stdev
         sd_max = mean + 2*stdev
         sd_range = sd_max - sd_min
 
-        out_array = (in_array / sd_range) * 255
+        return self.stretch_values(in_array, sd_range)
+
+    @staticmethod
+    def stretch_values(in_array, stretch_range, stretch_min=0):
+        """
+        Scale pixel values from 0 - 255 using the minimum and range of
+        a stretch.
+
+        For a standard deviation stretch, values are divided by the range
+        (four standard deviations) without subtracting the minimum.
+        """
+        out_array = ((in_array - stretch_min) / stretch_range) * 255
 
         out_array[out_array < 0] = 0
         out_array[out_array > 255] = 255
 
         return out_array
 
-    def scale_bands(self):
+    def get_stretch_params(self, stretch="sd", percentiles=DEFAULT_PERCENTILES,
+                           sample_rate=1.0):
+        """
+        Get the minimum and range used to stretch each band, reading the
+        image in blocks (or a sample of lines if 'sample_rate' is less than 1)
+        so bands don't need to be read to memory.
+
+        See get_stretch_params (module function) for the stretches
+        available.
+
+        Returns a list of (stretch_min, stretch_range) for each band.
+
+        """
+        return get_stretch_params([self.input_ds.GetRasterBand(band_num)
+                                   for band_num in self.band_nums],
+                                  stretch, percentiles, sample_rate)
+
+    def scale_bands(self, stretch="sd", percentiles=DEFAULT_PERCENTILES,
+                    sample_rate=1.0):
         """
         Scale image bands (required if not between 0 - 255)
+
+        If bands haven't been read to memory the parameters for the stretch
+        are calculated using get_stretch_params and the stretch is applied
+        to values as they are read.
         """
+        if self.red_band is not None and stretch == "sd":
+            red_nodata, green_nodata, blue_nodata = \
+                    [self.input_ds.GetRasterBand(band_num).GetNoDataValue()
+                     for band_num in self.band_nums]
+            self.red_band = self.apply_standard_deviation_stretch(self.red_band,
+                                                                  red_nodata)
+            self.green_band = self.apply_standard_deviation_stretch(self.green_band,
+                                                                    green_nodata)
+            self.blue_band = self.apply_standard_deviation_stretch(self.blue_band,
+                                                                   blue_nodata)
+            return
 
-        self.red_band = self.apply_standard_deviation_stretch(self.red_band)
-        self.green_band = self.apply_standard_deviation_stretch(self.green_band)
-        self.blue_band = self.apply_standard_deviation_stretch(self.blue_band)
+        self.stretch_params = self.get_stretch_params(stretch, percentiles,
+                                                      sample_rate)
+
+        if self.red_band is not None:
+            (red_params, green_params, blue_params) = self.stretch_params
+            self.red_band = self.stretch_values(self.red_band, red_params[1],
+                                                red_params[0])
+            self.green_band = self.stretch_values(self.green_band,
+                                                  green_params[1],
+                                                  green_params[0])
+            self.blue_band = self.stretch_values(self.blue_band, blue_params[1],
+                                                 blue_params[0])
+            self.stretch_params = None
 
     def get_pixelvals(self, in_x, in_y):
         """
@@ -158,7 +496,12 @@ class ExtractPixels(object):
 
         Uses the centre coordinate of each pixel.
 
+        Requires the bands to have been read into memory (read_bands=True).
+
         """
+        if self.red_band is None:
+            raise Exception("Bands must be read into memory (read_bands=True) "
+                            "to use get_pixelvals")
 
         pixel_x = ((in_x - self.image_tl_x) / self.pixel_x_size) \
                   + (self.pixel_x_size / 2.0)
@@ -183,6 +526,432 @@ class ExtractPixels(object):
                                                                          in_x))
         return pixel_vals
 
+    def _get_pixel_positions(self, in_x, in_y):
+        """
+        Get the pixel (column and row) of arrays of x and y in geographic
+        coordinates.
+
+        Returns arrays of columns and rows for points within the image and a
+        boolean array which is True for points within the image.
+
+        """
+        in_x = numpy.asarray(in_x, dtype=numpy.float64)
+        in_y = numpy.asarray(in_y, dtype=numpy.float64)
+
+        pixel_x = ((in_x - self.image_tl_x) / self.pixel_x_size) \
+                  + (self.pixel_x_size / 2.0)
+        pixel_y = ((in_y - self.image_tl_y) / self.pixel_y_size) \
+                  + (self.pixel_y_size / 2.0)
+
+        in_image = (pixel_x >= 0) & (pixel_y >= 0) \
+                   & (pixel_x < self.n_samples) & (pixel_y < self.n_lines)
+
+        pixel_x = pixel_x[in_image].astype(numpy.intp)
+        pixel_y = pixel_y[in_image].astype(numpy.intp)
+
+        if DEBUG:
+            print("{} points are outside image.".format(in_x.shape[0]
+                                                         - pixel_x.shape[0]))
+
+        return pixel_x, pixel_y, in_image
+
+    def get_pixelvals_array(self, in_x, in_y):
+        """
+        Get pixel values for arrays of x and y in geographic coordinates.
+
+        Uses the same pixel positions as get_pixelvals for all points at once.
+
+        Returns a numpy array n_points*3 containing the red, green and
+        blue values for each point and a boolean array which is True for
+        points within the image. Values for points outside the image are 0.
+
+        If the bands haven't been read into memory (read_bands=False) values
+        are read from tiles using get_pixelvals_window.
+
+        """
+        if self.red_band is None:
+            return self.get_pixelvals_window(in_x, in_y)
+
+        pixel_x, pixel_y, in_image = self._get_pixel_positions(in_x, in_y)
+
+        pixel_vals = numpy.zeros((in_image.shape[0], 3),
+                                 dtype=numpy.result_type(self.red_band,
+                                                         self.green_band,
+                                                         self.blue_band))
+        pixel_vals[in_image, 0] = self.red_band[pixel_y, pixel_x]
+        pixel_vals[in_image, 1] = self.green_band[pixel_y, pixel_x]
+        pixel_vals[in_image, 2] = self.blue_band[pixel_y, pixel_x]
+
+        return pixel_vals, in_image
+
+    def get_pixelvals_window(self, in_x, in_y, exclude_nodata=False):
+        """
+        Get pixel values for arrays of x and y in geographic coordinates,
+        reading only the tiles of the image which contain points.
+
+        Points are grouped by tile so each tile is only read once.
+
+        Returns the same as get_pixelvals_array, values are stretched if
+        scale_bands has been called. If 'exclude_nodata' is True points
+        where all three bands are no data are treated as outside the image.
+
+        """
+        pixel_x, pixel_y, in_image = self._get_pixel_positions(in_x, in_y)
+
+        pixel_vals = numpy.zeros((in_image.shape[0], 3), dtype=numpy.float64)
+
+        if pixel_x.shape[0] == 0:
+            return pixel_vals, in_image
+
+        # Sort points by tile
+        n_tile_cols = -(-self.n_samples // self.tile_x_size)
+        tile_ids = (pixel_y // self.tile_y_size) * n_tile_cols \
+                    + pixel_x // self.tile_x_size
+        point_order = numpy.argsort(tile_ids, kind="mergesort")
+        sorted_tile_ids = tile_ids[point_order]
+        tile_bounds = numpy.concatenate(([0],
+                                         numpy.flatnonzero(numpy.diff(sorted_tile_ids)) + 1,
+                                         [sorted_tile_ids.shape[0]]))
+
+        in_image_vals = numpy.empty((pixel_x.shape[0], 3), dtype=numpy.float64)
+
+        for start, end in zip(tile_bounds[:-1], tile_bounds[1:]):
+            tile_points = point_order[start:end]
+            tile_row, tile_col = divmod(int(sorted_tile_ids[start]), n_tile_cols)
+            tile = self._get_tile(tile_row, tile_col)
+            in_image_vals[tile_points] = \
+                    tile[:, pixel_y[tile_points] - tile_row * self.tile_y_size,
+                         pixel_x[tile_points] - tile_col * self.tile_x_size].T
+
+        if exclude_nodata:
+            has_data = (in_image_vals != self.nodata_values).any(axis=1)
+            in_image[in_image] = has_data
+            in_image_vals = in_image_vals[has_data]
+
+        # Only stretch values which have been looked up
+        if self.stretch_params is not None:
+            for i, (stretch_min, stretch_range) in enumerate(self.stretch_params):
+                in_image_vals[:, i] = self.stretch_values(in_image_vals[:, i],
+                                                          stretch_range,
+                                                          stretch_min)
+
+        pixel_vals[in_image] = in_image_vals
+
+        return pixel_vals, in_image
+
+
+def get_image_footprint(input_image):
+    """
+    Get the bounds of an image (min_x, max_x, min_y, max_y) from its
+    geotransform. Rotation is not taken into account.
+    """
+    input_ds = gdal.Open(input_image, gdal.GA_ReadOnly)
+
+    if input_ds is None:
+        raise Exception("Could not open image {}".format(input_image))
+
+    geotransform = input_ds.GetGeoTransform()
+    corner_x = [geotransform[0],
+                geotransform[0] + input_ds.RasterXSize * geotransform[1]]
+    corner_y = [geotransform[3],
+                geotransform[3] + input_ds.RasterYSize * geotransform[5]]
+    input_ds = None
+
+    return min(corner_x), max(corner_x), min(corner_y), max(corner_y)
+
+
+class ImageFootprintIndex(object):
+    """
+    Grid index of image footprints, used to find images which overlap a
+    bounding box without checking every image.
+
+    Each cell of the grid stores a list of the images with footprints
+    overlapping it. If a cell size isn't provided the mean width / height
+    of the footprints is used.
+    """
+    def __init__(self, footprints, cell_size=None):
+        self.footprints = footprints
+
+        if cell_size is None:
+            cell_size = numpy.mean([max(max_x - min_x, max_y - min_y)
+                                    for min_x, max_x, min_y, max_y
+                                    in footprints])
+        if not cell_size > 0:
+            # All footprints have zero size (or there are none)
+            cell_size = 1.0
+        self.cell_size = cell_size
+
+        self.cells = collections.defaultdict(list)
+        for image_num, footprint in enumerate(footprints):
+            for cell in self._get_cells(footprint):
+                self.cells[cell].append(image_num)
+
+    def _get_cells(self, bbox):
+        """
+        Get the cells (column, row) which overlap a bounding box
+        """
+        min_x, max_x, min_y, max_y = bbox
+        for cell_col in range(int(numpy.floor(min_x / self.cell_size)),
+                              int(numpy.floor(max_x / self.cell_size)) + 1):
+            for cell_row in range(int(numpy.floor(min_y / self.cell_size)),
+                                  int(numpy.floor(max_y / self.cell_size)) + 1):
+                yield cell_col, cell_row
+
+    def query(self, bbox):
+        """
+        Get the images with footprints which overlap a bounding box
+        (min_x, max_x, min_y, max_y).
+
+        Returns a sorted list of image numbers.
+        """
+        min_x, max_x, min_y, max_y = bbox
+        candidates = set()
+        for cell in self._get_cells(bbox):
+            candidates.update(self.cells.get(cell, []))
+
+        return sorted(image_num for image_num in candidates
+                      if self.footprints[image_num][0] <= max_x
+                      and self.footprints[image_num][1] >= min_x
+                      and self.footprints[image_num][2] <= max_y
+                      and self.footprints[image_num][3] >= min_y)
+
+
+class MultiImageExtractPixels(object):
+    """
+    Class to extract RGB values from several overlapping images (e.g.,
+    mapped flight lines).
+
+    For each set of points the images which overlap are found using an
+    ImageFootprintIndex. Each point is coloured from the first image
+    which has data for it, with images in the order:
+
+    * first - order images were provided
+    * centre - nearest footprint centre to the centre of the points first
+      (as an approximation to the image nearest nadir)
+
+    Images are only opened when they are first needed, and tiles are only
+    kept for images used by the most recent set of points. Up to
+    'max_open_images' images are kept open, the least recently used are
+    closed.
+
+    When bands are scaled the same stretch, calculated from all images, is
+    applied to every image so there are no differences in colour where
+    images overlap.
+
+    """
+    def __init__(self, input_images, red_band_num=None,
+                 green_band_num=None, blue_band_num=None,
+                 select="first",
+                 tile_cache_memory=DEFAULT_TILE_CACHE_MEMORY,
+                 max_open_images=DEFAULT_MAX_OPEN_IMAGES):
+        if select not in ("first", "centre"):
+            raise Exception("Image selection '{}' was not recognised. "
+                            "Options are 'first' or 'centre'".format(select))
+
+        self.input_images = input_images
+        self.band_nums = (red_band_num, green_band_num, blue_band_num)
+        self.select = select
+        self.tile_cache_memory = tile_cache_memory
+        self.max_open_images = max_open_images
+        self.stretch_params = None
+
+        self.footprint_index = ImageFootprintIndex([get_image_footprint(input_image)
+                                                    for input_image
+                                                    in input_images])
+        # Open images, least recently used first
+        self.image_pixelvals = collections.OrderedDict()
+
+    def _open_image(self, image_num):
+        """
+        Create an ExtractPixels instance for an image
+        """
+        red_band_num, green_band_num, blue_band_num = self.band_nums
+        pixelval = ExtractPixels(self.input_images[image_num],
+                                 red_band_num=red_band_num,
+                                 green_band_num=green_band_num,
+                                 blue_band_num=blue_band_num,
+                                 read_bands=False,
+                                 tile_cache_memory=self.tile_cache_memory)
+        pixelval.stretch_params = self.stretch_params
+        return pixelval
+
+    def scale_bands(self, stretch="sd", percentiles=DEFAULT_PERCENTILES,
+                    sample_rate=1.0):
+        """
+        Scale image bands (required if not between 0 - 255).
+
+        The parameters for the stretch are calculated from the values in all
+        images (see get_stretch_params) and applied to values from each image
+        as they are read.
+        """
+        # Get the bands used for each image, images are opened one at a
+        # time when statistics are calculated
+        image_bands = [[], [], []]
+        for image_num, input_image in enumerate(self.input_images):
+            pixelval = self.image_pixelvals.get(image_num)
+            if pixelval is None:
+                pixelval = self._open_image(image_num)
+            for colour_bands, band_num in zip(image_bands, pixelval.band_nums):
+                colour_bands.append((input_image, band_num))
+            pixelval = None
+
+        self.stretch_params = get_stretch_params(image_bands, stretch,
+                                                 percentiles, sample_rate)
+
+        for pixelval in self.image_pixelvals.values():
+            pixelval.stretch_params = self.stretch_params
+
+    def _get_image_pixelvals(self, image_num):
+        """
+        Get the ExtractPixels instance for an image, opening it if needed
+        """
+        pixelval = self.image_pixelvals.pop(image_num, None)
+        if pixelval is None:
+            pixelval = self._open_image(image_num)
+        # Move to end so least recently used images are closed first
+        self.image_pixelvals[image_num] = pixelval
+        return pixelval
+
+    def get_pixelvals_window(self, in_x, in_y):
+        """
+        Get pixel values for arrays of x and y in geographic coordinates.
+
+        Returns a numpy array n_points*3 containing the red, green and
+        blue values for each point and a boolean array which is True for
+        points where a value was found in any image.
+
+        """
+        in_x = numpy.asarray(in_x, dtype=numpy.float64)
+        in_y = numpy.asarray(in_y, dtype=numpy.float64)
+
+        pixel_vals = numpy.zeros((in_x.shape[0], 3), dtype=numpy.float64)
+        coloured = numpy.zeros(in_x.shape[0], dtype=bool)
+
+        if in_x.shape[0] == 0:
+            return pixel_vals, coloured
+
+        bbox = (in_x.min(), in_x.max(), in_y.min(), in_y.max())
+        image_nums = self.footprint_index.query(bbox)
+
+        if self.select == "centre":
+            centre_x = (bbox[0] + bbox[1]) / 2.0
+            centre_y = (bbox[2] + bbox[3]) / 2.0
+            footprints = self.footprint_index.footprints
+            image_nums.sort(key=lambda image_num:
+                            ((footprints[image_num][0]
+                              + footprints[image_num][1]) / 2.0 - centre_x)**2
+                            + ((footprints[image_num][2]
+                                + footprints[image_num][3]) / 2.0 - centre_y)**2)
+
+        for image_num in image_nums:
+            not_coloured = numpy.flatnonzero(~coloured)
+            if not_coloured.shape[0] == 0:
+                break
+            image_vals, has_data = \
+                    self._get_image_pixelvals(image_num).get_pixelvals_window(in_x[not_coloured],
+                                                                              in_y[not_coloured],
+                                                                              exclude_nodata=True)
+            pixel_vals[not_coloured[has_data]] = image_vals[has_data]
+            coloured[not_coloured[has_data]] = True
+
+        # Only keep tiles for images used for these points
+        for image_num, pixelval in self.image_pixelvals.items():
+            if image_num not in image_nums:
+                pixelval.tile_cache.clear()
+                pixelval.tile_cache_used = 0
+
+        # Close least recently used images
+        while len(self.image_pixelvals) > self.max_open_images:
+            self.image_pixelvals.popitem(last=False)
+
+        return pixel_vals, coloured
+
+
+def colour_las_file_chunked(input_las, output_las, pixelval,
+                            chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Attribute points in a LAS file with RGB values, reading and writing
+    points in chunks so memory use depends on the chunk size rather than
+    the size of the LAS file.
+
+    Requires:
+
+    * input_las - Input LAS file
+    * output_las - Output LAS file
+    * pixelval - ExtractPixels or MultiImageExtractPixels instance, values
+      for each chunk are read using get_pixelvals_window
+    * chunk_size - Number of points to read at once
+
+    Requires laspy 2.0 or later.
+
+    Returns the number of points coloured and the total number of points.
+
+    """
+    if not hasattr(laspy, "open"):
+        raise Exception("Reading LAS files in chunks requires laspy 2.0 or "
+                        "later")
+
+    colour_pixels = 0
+    total_points = 0
+
+    with laspy.open(input_las) as input_file:
+        input_header = input_file.header
+        out_point_format = \
+                    RGB_POINT_FORMATS[input_header.point_format.id]
+
+        # Create header for output with a point format which has RGB fields,
+        # LAS 1.0 and 1.1 don't support RGB so these are written as 1.2
+        out_version = max((input_header.version.major,
+                           input_header.version.minor),
+                          RGB_POINT_FORMAT_VERSIONS[out_point_format])
+        out_header = laspy.LasHeader(point_format=out_point_format,
+                                     version="{}.{}".format(*out_version))
+        out_header.global_encoding = input_header.global_encoding
+        for header_value in COPY_HEADER_VALUES:
+            setattr(out_header, header_value,
+                    getattr(input_header, header_value))
+        out_header.scales = input_header.scales
+        out_header.offsets = input_header.offsets
+
+        # Extra bytes VLR is created from the extra dimensions
+        extra_dimensions = list(input_header.point_format.extra_dimensions)
+        out_header.vlrs = [vlr for vlr in input_header.vlrs
+                           if not isinstance(vlr, laspy.vlrs.known.ExtraBytesVlr)]
+        if extra_dimensions:
+            out_header.add_extra_dims(
+                [laspy.ExtraBytesParams(dimension.name, dimension.type_str(),
+                                        description=dimension.description,
+                                        offsets=dimension.offsets,
+                                        scales=dimension.scales,
+                                        no_data=dimension.no_data)
+                 for dimension in extra_dimensions])
+
+        with laspy.open(output_las, mode="w", header=out_header) as output_file:
+            for points in input_file.chunk_iterator(chunk_size):
+                pixel_vals, in_image = pixelval.get_pixelvals_window(points.x,
+                                                                     points.y)
+
+                out_points = laspy.ScaleAwarePointRecord.zeros(len(points),
+                                                               header=out_header)
+                for dimension in points.point_format.standard_dimension_names:
+                    if dimension in out_points.point_format.dimension_names:
+                        out_points[dimension] = points[dimension]
+                # Copy stored (unscaled) values for extra dimensions
+                for dimension in extra_dimensions:
+                    out_points.array[dimension.name] = \
+                                points.array[dimension.name]
+
+                out_points.red = pixel_vals[:, 0].astype(numpy.uint8)
+                out_points.green = pixel_vals[:, 1].astype(numpy.uint8)
+                out_points.blue = pixel_vals[:, 2].astype(numpy.uint8)
+
+                output_file.write_points(out_points)
+
+                colour_pixels += numpy.count_nonzero(in_image)
+                total_points += len(points)
+
+    return colour_pixels, total_points
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="""Attribute a LAS file with
  colour information from a raster for visualisation in programs such as:
@@ -192,7 +961,18 @@ if __name__ == "__main__":
     parser.add_argument("inputlas", nargs=1,type=str, help="Input LAS file")
     parser.add_argument("outputlas", nargs=1,type=str, help="Output LAS file")
     parser.add_argument("--image", required=True,
-                        help="Image to extract values from.")
+                        nargs="+",
+                        help="Image to extract values from. Multiple "
+                             "images or patterns (e.g., '*.bil') can be "
+                             "provided for overlapping flight lines.")
+    parser.add_argument("--select", required=False,
+                        type=str,
+                        choices=["first", "centre"],
+                        default="first",
+                        help="If multiple images cover a point use the first "
+                             "image with data, or the image with the "
+                             "footprint centre nearest to the points "
+                             "(Default first)")
     parser.add_argument("--red", required=False,
                         type=int,
                         default=None,
@@ -209,8 +989,91 @@ if __name__ == "__main__":
                         action="store_true",
                         default=False,
                         help="Scale pixel values (if not already 0 - 255)")
+    parser.add_argument("--stretch", required=False,
+                        type=str,
+                        choices=["sd", "percentile"],
+                        default="sd",
+                        help="Stretch used to scale pixel values, 2 standard "
+                             "deviation or between two percentiles "
+                             "(Default sd)")
+    parser.add_argument("--percentiles", required=False,
+                        type=float,
+                        nargs=2,
+                        default=DEFAULT_PERCENTILES,
+                        metavar=("LOW", "HIGH"),
+                        help="Percentiles for percentile stretch "
+                             "(Default {} {})".format(*DEFAULT_PERCENTILES))
+    parser.add_argument("--stats_sample_rate", required=False,
+                        type=float,
+                        default=1.0,
+                        help="Fraction of lines in image to read when "
+                             "calculating statistics for stretch, e.g., 0.1 "
+                             "to read every 10th line (Default 1)")
+    parser.add_argument("--tile_cache", required=False,
+                        type=int,
+                        default=DEFAULT_TILE_CACHE_MEMORY // (1024*1024),
+                        help="Memory (in MB) to use for keeping tiles read "
+                             "from the image (Default {})".format(
+                                 DEFAULT_TILE_CACHE_MEMORY // (1024*1024)))
+    parser.add_argument("--chunk_size", required=False,
+                        type=int,
+                        default=None,
+                        help="Read and colour points in chunks of this size "
+                             "to limit memory use (e.g., {}). Requires laspy "
+                             "2.0 or later".format(DEFAULT_CHUNK_SIZE))
     args=parser.parse_args()
 
+    if not 0 < args.stats_sample_rate <= 1:
+        parser.error("--stats_sample_rate must be greater than 0 and less "
+                     "than or equal to 1")
+
+    # Expand any patterns in list of images
+    input_images = []
+    for image in args.image:
+        if glob.has_magic(image):
+            input_images.extend(sorted(glob.glob(image)))
+        else:
+            input_images.append(image)
+
+    if len(input_images) == 0:
+        print("No images found matching {}".format(" ".join(args.image)),
+              file=sys.stderr)
+        sys.exit(1)
+
+    # Set up pixel extraction class
+    if len(input_images) == 1:
+        pixelval = ExtractPixels(input_images[0],
+                                 red_band_num=args.red,
+                                 green_band_num=args.green,
+                                 blue_band_num=args.blue,
+                                 read_bands=False,
+                                 tile_cache_memory=args.tile_cache*1024*1024)
+    else:
+        print("Colouring from {} images".format(len(input_images)))
+        pixelval = MultiImageExtractPixels(input_images,
+                                           red_band_num=args.red,
+                                           green_band_num=args.green,
+                                           blue_band_num=args.blue,
+                                           select=args.select,
+                                           tile_cache_memory=args.tile_cache*1024*1024)
+
+    # Scale pixel values between 0 - 255 if needed.
+    if args.scale:
+        pixelval.scale_bands(stretch=args.stretch,
+                             percentiles=args.percentiles,
+                             sample_rate=args.stats_sample_rate)
+
+    if args.chunk_size is not None:
+        print("Colouring points from {} in chunks of {}".format(args.inputlas[0],
+                                                                args.chunk_size))
+        colour_pixels, total_points = colour_las_file_chunked(args.inputlas[0],
+                                                              args.outputlas[0],
+                                                              pixelval,
+                                                              args.chunk_size)
+        print("Set colour for {}/{} points".format(colour_pixels, total_points))
+        print("Written out data to {}".format(args.outputlas[0]))
+        sys.exit(0)
+
     print("Reading in data from {}".format(args.inputlas[0]))
     input_file = laspy.file.File(args.inputlas[0], mode = "r")
 
@@ -226,43 +1089,15 @@ if __name__ == "__main__":
     # Get scaled x and y values
     point_x = input_file.get_x_scaled()
     point_y = input_file.get_y_scaled()
-    out_red = numpy.zeros_like(point_x, dtype=numpy.uint8)
-    out_green = numpy.zeros_like(point_x, dtype=numpy.uint8)
-    out_blue = numpy.zeros_like(point_x, dtype=numpy.uint8)
-    # Set up pixel extraction class
-
-    pixelval = ExtractPixels(args.image,
-                             red_band_num=args.red,
-                             green_band_num=args.green,
-                             blue_band_num=args.blue)
-
-    # Scale pixel values between 0 - 255 if needed.
-    if args.scale:
-        pixelval.scale_bands()
-
-    print("Getting RGB values:")
-    status = 0
-    status_percent = 0
-    status_inc = point_x.shape[0] / 10
-
-    colour_pixels = 0
-
-    for i in range(point_x.shape[0]):
-        pixel_vals = pixelval.get_pixelvals(point_x[i], point_y[i])
 
-        if pixel_vals is not None:
-            out_red[i] = pixel_vals[0]
-            out_green[i] = pixel_vals[1]
-            out_blue[i] = pixel_vals[2]
-            colour_pixels += 1
+    print("Getting RGB values")
+    pixel_vals, in_image = pixelval.get_pixelvals_window(point_x, point_y)
 
-        if i >= status and status_percent < 100:
-            print("{}...".format(status_percent), end="")
-            sys.stdout.flush()
-            status_percent += 10
-            status += status_inc
+    out_red = pixel_vals[:, 0].astype(numpy.uint8)
+    out_green = pixel_vals[:, 1].astype(numpy.uint8)
+    out_blue = pixel_vals[:, 2].astype(numpy.uint8)
 
-    print("100 %")
+    colour_pixels = numpy.count_nonzero(in_image)
 
     print("Set colour for {}/{} points".format(colour_pixels, point_x.shape[0]))
 
@@ -11,6 +11,17 @@
 #To run:
 # python fwf_extract.py LAS1.3_filename
 #
+#To write all waveforms to a single file:
+# python fwf_extract.py --outfile waveforms.h5 LAS1.3_filename
+#
+#To write a grid index so extracting small areas doesn't read every point:
+# python fwf_extract.py --build_index LAS1.3_filename
+#The index is written to LAS1.3_filename.idx and used for extractions if it exists.
+#
+#To extract waveforms for many areas in one pass, with a directory (or file) for each:
+# python fwf_extract.py --regions plots.csv LAS1.3_filename
+#where plots.csv has columns name,north,south,east,west (or use a GeoJSON file of polygons)
+#
 #
 # Requires las1_3_handler.py
 #
@@ -27,9 +38,15 @@ def main(argv):
     parser.add_argument('f', metavar ='<filename>',help ='LAS file to extract data from',default=0)
     parser.add_argument('-o', metavar = 'output dir', help ='directory to output ASCII files (defaults to current directory if not specified)',default=0)
     parser.add_argument('--area', type=float, nargs=4, metavar =('North', 'South', 'East', 'West'), help = 'limits of area you wish to extract. If not specified you will be asked to enter them interactively on the command line',default= (0,0,0,0))
+    parser.add_argument('--regions', dest ='regions', type=str,default=None,help ='CSV file of bounding boxes (columns north,south,east,west and optionally name) or GeoJSON file of polygons to extract waveforms for. All regions are extracted in a single pass over the file, with a subdirectory of the output directory (or --outfile with the region name added) for each')
     parser.add_argument('--header', dest ='print_header', action='store_const', const=1, default=0,help ='outputs the header information of the LAS file')
     parser.add_argument('--plottoscreen', dest ='plottoscreen', action='store_true', default=False,help ='Plot all waveforms to the screen')
     parser.add_argument('--plottofile', dest ='plottofile', type=str,nargs=1,default=[None],help ='Plot all waveforms to a PDF file')
+    parser.add_argument('--build_index', dest ='build_index', action='store_true', default=False,help ='write a grid index of the point records to a sidecar file (<filename>.idx or --index) and exit. The index is used to read only points near the area when extracting waveforms')
+    parser.add_argument('--index', dest ='index_file', type=str,default=None,help ='grid index file to write or use (default <filename>.idx, used if it exists)')
+    parser.add_argument('--cell_size', dest ='cell_size', type=float,default=None,help ='size of grid cells when writing an index (default is %d cells along the longest side of the file)' % las1_3_handler.index_grid_size)
+    parser.add_argument('--outfile', dest ='outfile', type=str,default=None,help ='write all waveforms to a single HDF5 (.h5, requires h5py) or NumPy (.npz) file instead of an ASCII file for each waveform. An existing file is overwritten unless --append is given')
+    parser.add_argument('--append', dest ='append', action='store_true', default=False,help ='append waveforms to an existing HDF5 --outfile instead of overwriting it. The file must have been written from the same LAS file')
 
     args = parser.parse_args()
     user_limits = args.area
@@ -37,6 +54,11 @@ def main(argv):
     output_dir = args.o
     print_header= args.print_header
 
+    if args.append and args.outfile == None:
+        print "--append can only be used with --outfile"
+        sys.exit(1)
+    #end if
+
 # gets the header data from the LAS 1.3 file & check file is in correct format
     headdata=las1_3_handler.readLASHeader(las_file)
 
@@ -45,6 +67,32 @@ def main(argv):
         las1_3_handler.printLASHeader(headdata,las_file)
 
     #end if
+
+# if --build_index is specified, write the index and exit
+    if args.build_index:
+        index_file = las1_3_handler.writeLASIndex(headdata,las_file,index_file=args.index_file,cell_size=args.cell_size)
+        print "Written index to %s" % index_file
+        sys.exit(0)
+    #end if
+
+# use an index if one was specified or one exists for the file
+    index_file = args.index_file
+    if index_file == None and os.path.isfile(las_file + ".idx"):
+        index_file = las_file + ".idx"
+    #end if
+    if index_file != None:
+        try:
+            las1_3_handler.readLASIndex(index_file,headdata,las_file)
+        except Exception as err:
+            if args.index_file != None:
+                print "Could not use index: %s" % err
+                sys.exit(1)
+            #end if
+            print "Not using index, %s\nRun with --build_index to update it" % err
+            index_file = None
+        #end try
+    #end if
+
     if output_dir == 0:
         print "\nOutput directory was not specified, will use current directory\n"
         output_dir = os.getcwd()+'/'
@@ -74,6 +122,21 @@ def main(argv):
 
 
 
+# extract waveforms for all regions if a file of regions was specified
+    if args.regions != None:
+        if args.plottoscreen or args.plottofile[0] != None:
+            print "Plotting waveforms is not supported when extracting regions"
+            sys.exit(1)
+        #end if
+        if not os.path.isfile(args.regions):
+            print "\nRegions file %s does not exist\n" % args.regions
+            sys.exit(1)
+        #end if
+        regions = las1_3_handler.readRegions(args.regions)
+        las1_3_handler.readLASRegionWaves(headdata,las_file,output_dir,regions,output_file=args.outfile,index_file=index_file,append=args.append)
+        sys.exit(0)
+    #end if
+
 # Limits of the LAS 1.3 file
     Max_x= headdata[30]
     Max_y= headdata[32]
@@ -117,7 +180,7 @@ def main(argv):
      #end if
 
 # run the Las 1.3 extractions
-    las1_3_handler.readLASWaves(headdata,las_file, output_dir,user_limits,plottoscreen=args.plottoscreen,plotfile=args.plottofile[0])
+    las1_3_handler.readLASWaves(headdata,las_file, output_dir,user_limits,plottoscreen=args.plottoscreen,plotfile=args.plottofile[0],output_file=args.outfile,index_file=index_file,append=args.append)
 
 
 main(sys.argv[1:])
@@ -45,7 +45,7 @@ if __name__ == "__main__":
         print('Could not open input header ({})'.format(args.inputfile[0]), file=sys.stderr)
         sys.exit(1)
 
-    header_dict = envi_header.read_hdr_file(args.inputfile[0])
+    header_dict = envi_header.EnviHeader.from_file(args.inputfile[0])
 
     band_info_dict = {}
     nbands =  int(header_dict['bands'])
@@ -56,8 +56,7 @@ if __name__ == "__main__":
         # them out, just the number of values
         if nbands != 1 and header_dict[item].count(',') >= nbands - 1:
             print(' {} : {} values'.format(item, header_dict['bands']))
-            item_list = header_dict[item].split(',')
-            band_info_dict[item] = item_list
+            band_info_dict[item] = header_dict.get_values(item)
         else:
             print(' {} : {}'.format(item, header_dict[item]))
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build an index of ENVI files within a directory tree and query it to find
+files from a given day and / or overlapping a bounding box.
+
+Files found are printed one per line so they can be passed to other scripts
+(e.g., plot_info_from_headers.py or batch_run_apl.py).
+
+"""
+
+###########################################################
+# This file has been created by ARSF Data Analysis Node and
+# is licensed under the GPL v3 Licence. A copy of this
+# licence is available to download with this file.
+###########################################################
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+from arsf_envi_reader import envi_index
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+                        Index ENVI files within directories and list files
+                        from the index.
+                        Created by ARSF-DAN at Plymouth Marine Laboratory.
+                        Latest version available from https://github.com/pmlrsg/arsf_tools/.''')
+    parser.add_argument("index", nargs=1, type=str,
+                        help="Index file (SQLite database)")
+    parser.add_argument("-u", "--update", nargs="+", required=False,
+                        type=str, default=None,
+                        help="Directories to search for ENVI files and add "
+                             "to the index")
+    parser.add_argument("--checksum", action="store_true", default=False,
+                        help="Calculate checksums for new files when "
+                             "updating the index")
+    parser.add_argument("-d", "--date", required=False, type=str,
+                        default=None,
+                        help="Only list files from this date (same format "
+                             "as header, e.g., 17-06-2017)")
+    parser.add_argument("-b", "--bbox", nargs=4, required=False, type=float,
+                        default=None, metavar=("MIN_X", "MAX_X",
+                                               "MIN_Y", "MAX_Y"),
+                        help="Only list files overlapping bounding box")
+    parser.add_argument("-i", "--interleave", required=False, type=str,
+                        default=None,
+                        help="Only list files with interleave (e.g., bil)")
+    parser.add_argument("--bad_size", action="store_true", default=False,
+                        help="Only list files where the size doesn't "
+                             "match the header")
+    parser.add_argument("-l", "--long", action="store_true", default=False,
+                        help="Print date, times and dimensions as well as "
+                             "file name")
+    args = parser.parse_args()
+
+    if args.update is not None:
+        for directory in args.update:
+            if not os.path.isdir(directory):
+                print("Directory '{}' does not exist".format(directory),
+                      file=sys.stderr)
+                sys.exit(1)
+        n_updated = envi_index.update_index(args.index[0], args.update,
+                                            checksum=args.checksum)
+        print("Added or updated {} files".format(n_updated), file=sys.stderr)
+
+    size_ok = None
+    if args.bad_size:
+        size_ok = False
+
+    for row in envi_index.query_index(args.index[0], date=args.date,
+                                      bbox=args.bbox,
+                                      interleave=args.interleave,
+                                      size_ok=size_ok):
+        if args.long:
+            print("{} {} {} {} {}x{}x{} {}".format(row["path"], row["date"],
+                                                   row["start_time"],
+                                                   row["stop_time"],
+                                                   row["lines"], row["samples"],
+                                                   row["bands"],
+                                                   row["data_type"]))
+        else:
+            print(row["path"])
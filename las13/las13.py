@@ -32,11 +32,13 @@ class las13():
         else:
             raise Exception("Expected string argument for filename.")
 
-    def points_in_bounds(self,bounds):
+    def points_in_bounds(self,bounds,index_file=None):
         """
         Function that searches the LAS file and returns all points within the given rectangular bounds.
         Inputs:
            bounds - a list of 4 floating point values describing north, south, west and east bounds.
+           index_file - a grid index for the LAS file (written using fwf_extract.py --build_index). If given
+                        only points in cells of the index intersecting the bounds are read.
 
         Returns:
            An object of type las13reader.PulseManager.
@@ -46,7 +48,10 @@ class las13():
         if len(bounds)!=4:
             raise Exception("Expected bounds list of length 4: north,south,west,east.")
 
-        pmanager=self.reader.GetPointsInBounds(bounds[0],bounds[1],bounds[2],bounds[3])
+        if index_file is not None:
+            pmanager=self.reader.GetPointsInBounds(bounds[0],bounds[1],bounds[2],bounds[3],index_file)
+        else:
+            pmanager=self.reader.GetPointsInBounds(bounds[0],bounds[1],bounds[2],bounds[3])
         return pmanager
 
     def points_with_classification(self,classification):
@@ -1,4 +1,7 @@
 #include "Las1_3_handler.h"
+#include "LasGridIndex.h"
+#include <cfloat>
+#include <cmath>
 #include <cstdio>
 #include <cstdlib>
 #include <vector>
@@ -212,6 +215,91 @@ PulseManager* Las1_3_handler::GetPointsInBounds(float boundsn,float boundss,floa
    return i_pulseManager;
 }
 
+//-----------------------------------------------------------------------------
+// Function to return a pulse manager containing points within the given bounds
+// using a grid index to only read points in cells intersecting the bounds
+//-----------------------------------------------------------------------------
+PulseManager* Las1_3_handler::GetPointsInBounds(float boundsn,float boundss,float boundsw,float boundse,std::string indexfilename)
+{
+   if((boundsn < boundss)||(boundse < boundsw))
+   {
+      std::cout<<"Bounds should be [N, S, W, E]. I got: "<<boundsn <<" "<< boundss<<" "<<boundsw<<" "<<boundse<<std::endl;
+      return NULL;
+   }
+
+   LasGridIndex index(indexfilename);
+   if(!index.Matches(public_header,filesize))
+   {
+      std::cerr << "Index "<<indexfilename<<" does not match LAS file, reading all points\n";
+      return GetPointsInBounds(boundsn,boundss,boundsw,boundse);
+   }
+
+   //Point positions are compared as floats so pad the bounds used to select
+   //cells to include any points which round to within the bounds
+   double pad=FLT_EPSILON*std::max(std::max(fabs(boundsn),fabs(boundss)),std::max(fabs(boundsw),fabs(boundse)));
+   std::vector<std::pair<uint64_t,uint64_t> > runs=index.GetRecordRuns(boundsn+pad,boundss-pad,boundsw-pad,boundse+pad);
+
+   //Set up the new pulse manager
+   PulseManager* i_pulseManager=NewPulseManager();
+   Types::Data_Point_Record_Format_4 point_info;
+
+   unsigned int count=0;
+   unsigned int countDiscrete = 0;
+   unsigned int countIgnored = 0;
+   // temporarly saving discrete values that are associated with a
+   // waveform but the 1st return haven't been saved yet
+   std::vector<Vec3d> discretePoints;
+   // the corresponding intensities of the discrete points
+   std::vector<unsigned short> discreteIntensities;
+   // the corresponding wave offsets of the dicrete points
+   std::vector<int> discreteWaveOffsets;
+   std::vector<double> discretePointInWaveform;
+   std::vector<int> discreteClassification;
+
+   for(std::vector<std::pair<uint64_t,uint64_t> >::iterator run=runs.begin();run!=runs.end();run++)
+   {
+      //Seek to the first point in the run
+      lasfile.clear();
+      lasfile.seekg(public_header.offset_to_point+run->first*public_header.point_data_record_length,std::ios::beg);
+
+      for(uint64_t i=0; (i < run->second) && (run->first+i < public_header.number_of_point_records); ++i)
+      {
+         if(!ReadPoint(&point_info))
+            continue;
+
+         //Get the point x,y position
+         float pointx=point_info.X*public_header.x_scale_factor + public_header.x_offset;
+         float pointy=point_info.Y*public_header.y_scale_factor + public_header.y_offset;
+         //if the point is within the bounds
+         if((pointx<boundse)&&(pointx>boundsw)&&(pointy<boundsn)&&(pointy > boundss))
+         {
+            HandlePoint(point_info,count,i_pulseManager,discretePoints,discreteIntensities,
+                  discreteWaveOffsets,discretePointInWaveform,discreteClassification,countDiscrete,countIgnored);
+         }
+      }
+   }
+   if(!quiet)
+   {
+      if(count==0)
+      {
+          std::cout << "no waveforms associated with that area\n";
+      }
+      else
+      {
+          std::cout << count << " waveforms found\n";
+          std::cout << countDiscrete << " additional discrete points found\n";
+          std::cout << countIgnored << " discrete points ignored (bad wave form pointer)\n";
+      }
+   }
+
+   i_pulseManager->sortDiscretePoints(discretePoints,discreteIntensities,discreteWaveOffsets,discretePointInWaveform,discreteClassification);
+
+   //clear any flags from the reader
+   lasfile.clear();
+
+   return i_pulseManager;
+}
+
 //-----------------------------------------------------------------------------
 // Function to get points with a given classification value
 //-----------------------------------------------------------------------------
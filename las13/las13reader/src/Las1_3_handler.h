@@ -41,6 +41,13 @@ public:
    //-------------------------------------------------------------------------
    PulseManager* GetPointsInBounds(float boundsn,float boundss,float boundsw,float boundse);
 
+   //-------------------------------------------------------------------------
+   //Function to only return points contained in certain bounds, reading only
+   //the points in cells of a grid index (see LasGridIndex.h) intersecting the
+   //bounds. If the index doesn't match the file all points are read.
+   //-------------------------------------------------------------------------
+   PulseManager* GetPointsInBounds(float boundsn,float boundss,float boundsw,float boundse,std::string indexfilename);
+
    //-------------------------------------------------------------------------   
    //Delete (free memory) from PulseManagers
    //-------------------------------------------------------------------------
@@ -0,0 +1,114 @@
+#include "LasGridIndex.h"
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <iostream>
+
+//-----------------------------------------------------------------------------
+// Constructor - open index file and read the header and cell offsets
+//-----------------------------------------------------------------------------
+LasGridIndex::LasGridIndex(
+        std::string i_filename
+        ): m_filename(i_filename),isopen(false)
+{
+   indexfile.open(m_filename.c_str(),std::ios::binary | std::ios::in);
+   if(!indexfile.is_open())
+   {
+      std::cerr << "Index file failed to open. \n";
+      return;
+   }
+
+   indexfile.read((char *) &index_header,sizeof(index_header));
+   if((!indexfile.good())||(strncmp(index_header.file_signiture,"LAS13IDX",8)!=0))
+   {
+      std::cerr << "Not a LAS 1.3 index file: "<<m_filename<<"\n";
+      return;
+   }
+   if(index_header.version!=1)
+   {
+      std::cerr << "Incorrect index version. Only version 1 is supported.\n";
+      return;
+   }
+
+   uint64_t ncells=(uint64_t)index_header.number_of_columns*index_header.number_of_rows;
+   cell_offsets.resize(ncells+1);
+   indexfile.read((char *) &cell_offsets[0],(ncells+1)*sizeof(uint64_t));
+   if(!indexfile.good())
+   {
+      std::cerr << "Index file is too short: "<<m_filename<<"\n";
+      return;
+   }
+   runs_start=indexfile.tellg();
+   isopen=true;
+}
+
+//-----------------------------------------------------------------------------
+LasGridIndex::~LasGridIndex()
+{
+   indexfile.close();
+}
+
+//-----------------------------------------------------------------------------
+// Check the index is for the given LAS file and hasn't changed since
+//-----------------------------------------------------------------------------
+bool LasGridIndex::Matches(const Types::Public_Header_Block& public_header,uint64_t las_file_size)const
+{
+   return isopen && (index_header.number_of_point_records==public_header.number_of_point_records)
+                 && (index_header.las_file_size==las_file_size);
+}
+
+//-----------------------------------------------------------------------------
+void LasGridIndex::GetColumnRow(double x,double y,uint32_t& column,uint32_t& row)const
+{
+   double c=floor((x-index_header.min_x)/index_header.cell_size);
+   double r=floor((y-index_header.min_y)/index_header.cell_size);
+   column=(uint32_t)std::max(0.0,std::min(c,(double)index_header.number_of_columns-1));
+   row=(uint32_t)std::max(0.0,std::min(r,(double)index_header.number_of_rows-1));
+}
+
+//-----------------------------------------------------------------------------
+// Function to get the runs of records in cells intersecting the given bounds
+//-----------------------------------------------------------------------------
+std::vector<std::pair<uint64_t,uint64_t> > LasGridIndex::GetRecordRuns(double boundsn,double boundss,double boundsw,double boundse)
+{
+   std::vector<std::pair<uint64_t,uint64_t> > runs;
+   if(!isopen)
+      return runs;
+
+   uint32_t mincolumn,maxcolumn,minrow,maxrow;
+   GetColumnRow(boundsw,boundss,mincolumn,minrow);
+   GetColumnRow(boundse,boundsn,maxcolumn,maxrow);
+
+   //Cells in each row are consecutive so runs for each row are read at once
+   std::vector<uint32_t> rowruns;
+   for(uint32_t row=minrow;row<=maxrow;row++)
+   {
+      uint64_t first=cell_offsets[(uint64_t)row*index_header.number_of_columns+mincolumn];
+      uint64_t last=cell_offsets[(uint64_t)row*index_header.number_of_columns+maxcolumn+1];
+      if(last<=first)
+         continue;
+      rowruns.resize((last-first)*2);
+      indexfile.clear();
+      indexfile.seekg(runs_start+(std::streamoff)(first*2*sizeof(uint32_t)),std::ios::beg);
+      indexfile.read((char *) &rowruns[0],(last-first)*2*sizeof(uint32_t));
+      if(!indexfile.good())
+      {
+         std::cerr << "Failed reading runs from index file: "<<m_filename<<"\n";
+         break;
+      }
+      for(uint64_t i=0;i<last-first;i++)
+         runs.push_back(std::make_pair((uint64_t)rowruns[2*i],(uint64_t)rowruns[2*i+1]));
+   }
+
+   //Sort by first record and join runs which follow on from each other
+   std::sort(runs.begin(),runs.end());
+   std::vector<std::pair<uint64_t,uint64_t> > joined;
+   for(std::vector<std::pair<uint64_t,uint64_t> >::iterator it=runs.begin();it!=runs.end();it++)
+   {
+      if((!joined.empty())&&(joined.back().first+joined.back().second==it->first))
+         joined.back().second+=it->second;
+      else
+         joined.push_back(*it);
+   }
+   return joined;
+}
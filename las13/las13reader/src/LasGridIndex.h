@@ -0,0 +1,77 @@
+#ifndef LASGRIDINDEX_H
+#define LASGRIDINDEX_H
+
+#include <fstream>
+#include <string>
+#include <vector>
+#include <utility>
+#include <stdint.h>
+
+#include "Types.h"
+
+//The code is released under the GNU General Public License v3.0.
+//Reads the grid index sidecar file written for a LAS1.3 file by las1_3_handler.py
+//(python fwf_extract.py --build_index LAS1.3_filename). For each cell of a regular
+//grid the index stores runs of consecutive point records within the cell so points
+//within bounds can be read without reading every point in the file.
+
+class LasGridIndex
+{
+public:
+   //-------------------------------------------------------------------------
+   /// @brief default constructor
+   /// @param[in] i_filename the name of the index file to be read
+   //-------------------------------------------------------------------------
+   LasGridIndex(std::string i_filename);
+
+   //-------------------------------------------------------------------------
+   /// @brief default destructor
+   //-------------------------------------------------------------------------
+   ~LasGridIndex();
+
+   //-------------------------------------------------------------------------
+   /// @brief check the index was read and matches a LAS file
+   /// @param[in] public_header the public header of the LAS file
+   /// @param[in] las_file_size the size of the LAS file in bytes
+   //-------------------------------------------------------------------------
+   bool Matches(const Types::Public_Header_Block& public_header,uint64_t las_file_size)const;
+
+   //-------------------------------------------------------------------------
+   /// @brief get runs of point records in cells intersecting the bounds
+   /// @return pairs of (first record, number of records) sorted by first
+   /// record, runs which follow on from each other are joined. Points still
+   /// need to be checked against the bounds as cells extend past them
+   //-------------------------------------------------------------------------
+   std::vector<std::pair<uint64_t,uint64_t> > GetRecordRuns(double boundsn,double boundss,double boundsw,double boundse);
+
+   bool IsOpen()const{return isopen;}
+
+protected:
+   //-------------------------------------------------------------------------
+   /// @brief the name of the index file
+   //-------------------------------------------------------------------------
+   std::string m_filename;
+   //-------------------------------------------------------------------------
+   /// @brief the header of the index file
+   //-------------------------------------------------------------------------
+   Types::Grid_Index_Header index_header;
+   //-------------------------------------------------------------------------
+   /// @brief offset of the first run for each cell (and the end of the last)
+   //-------------------------------------------------------------------------
+   std::vector<uint64_t> cell_offsets;
+   //-------------------------------------------------------------------------
+   /// @brief runs are read from the file for each query
+   //-------------------------------------------------------------------------
+   std::ifstream indexfile;
+   std::streampos runs_start;
+   bool isopen;
+
+private:
+   //-------------------------------------------------------------------------
+   /// @brief get the column and row of the cell containing x,y clipped to
+   /// the edges of the grid
+   //-------------------------------------------------------------------------
+   void GetColumnRow(double x,double y,uint32_t& column,uint32_t& row)const;
+};
+
+#endif // LASGRIDINDEX_H
@@ -218,6 +218,39 @@ public:
 #pragma pack(pop)
 
 
+
+    // header of the grid index sidecar file (little endian) written by
+    // writeLASIndex in las1_3_handler.py, followed by
+    // uint64 cell offsets [number_of_columns*number_of_rows+1] and
+    // uint32 runs [number_of_runs][2] (first record, number of records)
+#pragma pack(push)
+#pragma pack(1)
+   typedef struct Grid_Index_Header                      //  68 bytes
+   {
+      // ---------------------------------------------------------------
+      // file signiture is always "LAS13IDX"
+      // ---------------------------------------------------------------
+      char file_signiture[8];                            //   8 bytes  0
+      uint32_t version;                                  //   4 bytes  1
+      // ---------------------------------------------------------------
+      // number of point records and size of the LAS file when indexed
+      // ---------------------------------------------------------------
+      uint64_t number_of_point_records;                  //   8 bytes  2
+      uint64_t las_file_size;                            //   8 bytes  3
+      // ---------------------------------------------------------------
+      // origin and size of the grid, the cell for a point is
+      // (row*number_of_columns+column). Points outside the grid are in
+      // the nearest cell at the edge
+      // ---------------------------------------------------------------
+      double min_x;                                      //   8 bytes  4
+      double min_y;                                      //   8 bytes  5
+      double cell_size;                                  //   8 bytes  6
+      uint32_t number_of_columns;                        //   4 bytes  7
+      uint32_t number_of_rows;                           //   4 bytes  8
+      uint64_t number_of_runs;                           //   8 bytes  9
+   }Grid_Index_Header;
+#pragma pack(pop)
+
 };
 
 
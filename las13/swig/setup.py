@@ -11,7 +11,7 @@ import os
 #if windows then statically link the libstdc++ and libgcc - this assumes using mingw32 to compile
 if os.name=='nt':
     las13reader_module = Extension('_las13reader',
-                            sources=['las13reader_wrap.cxx', '../las13reader/src/Las1_3_handler.cpp',
+                            sources=['las13reader_wrap.cxx', '../las13reader/src/Las1_3_handler.cpp','../las13reader/src/LasGridIndex.cpp',
                                   '../las13reader/src/Pulse.cpp','../las13reader/src/PulseManager.cpp','../las13reader/src/vec3d.cpp'],
                             extra_compile_args=["-std=c++0x"],
                             extra_link_args=["-lstdc++","-lgcc","-static"]
@@ -19,7 +19,7 @@ if os.name=='nt':
 
 else:
     las13reader_module = Extension('_las13reader',
-                            sources=['las13reader_wrap.cxx', '../las13reader/src/Las1_3_handler.cpp',
+                            sources=['las13reader_wrap.cxx', '../las13reader/src/Las1_3_handler.cpp','../las13reader/src/LasGridIndex.cpp',
                                   '../las13reader/src/Pulse.cpp','../las13reader/src/PulseManager.cpp','../las13reader/src/vec3d.cpp'],
                             extra_compile_args=["-std=c++0x"]
                             )
@@ -16,7 +16,25 @@
 # printLASHeader: prints Public Header formatted from LAS 1.3 file
 # writeWaveform: creates waveform files, one file per waveform
 # getUserInput: request user to input area for waveform data extraction
+# readLASPoints: reads point records (format 4) in chunks into NumPy structured arrays
+# decodePointFlags: gets return number, number of returns, scan direction and edge flags for points
+# scalePointCoordinates: gets scaled X, Y, Z for points
+# getPointsInArea: gets a mask of points within an area
+# openWaveformData: memory maps the waveform data packets of a LAS 1.3 file
+# readWaveforms: gathers waveforms for many points into a 2D array
+# getWaveformSamplePositions: gets X, Y, Z of each waveform sample
+# getWaveformColumns: gets point attributes, waveforms and origin / offset vectors as columns
+# WaveformFileWriter: writes waveforms for all points to a single HDF5 or NPZ file
+# writeLASIndex: writes a grid index of point records to a sidecar file
+# readLASIndex: reads a grid index written by writeLASIndex
+# getIndexedRecordRuns: gets runs of point records which may be within an area from an index
+# joinRecordRuns: sorts and joins runs of point records
+# readRegions: reads many regions (bounding boxes or polygons) from a CSV or GeoJSON file
+# getPointsInPolygon: gets a mask of points within a polygon
+# RegionIndex: grid index of regions used to find the regions containing each point
+# readWavePacketDescriptor: reads the waveform packet descriptor from a LAS 1.3 file
 # readLASWaves: function that extracts waveforms from LAS 1.3 file
+# readLASRegionWaves: function that extracts waveforms for many regions in one pass over a LAS 1.3 file
 # plotWaveform: function to plot a waveform
 #
 #
@@ -66,9 +84,21 @@ import os.path
 import struct
 import math
 import warnings
+import collections
+import csv
+import json
+import numpy
 import pylab
 from matplotlib.backends.backend_pdf import PdfPages
 
+# Try to import h5py (required to write waveforms to HDF5)
+HAVE_H5PY = False
+try:
+    import h5py
+    HAVE_H5PY = True
+except ImportError:
+    pass
+
 public_header_length = 235 # Public Header length in bytes.
 VbleRec_header_length = 54 # Variable Length Record Header length in bytes
 EVLR_length = 60 #Extended Variable Lenght Record Header, in Version 1.3 the only EVLR is waveform data packets
@@ -81,6 +111,35 @@ VbleRec_head_format="=H16sHH32s"
 EVLR_format="=H16sHQ32s"
 point_data_format="=3lHBBbBBBdBQL4f" #Note it should be 3lHBBbHBdBQL4f but User data (field [7]) is decomposed in two :0,gain
 wv_packet_format = "=cclldd"
+# NumPy equivalent of point_data_format, fields are in the same order so records
+# converted to tuples can be indexed in the same way as those from struct.unpack
+point_data_names = ["x", "y", "z", "intensity", "return_flags", "classification",
+                    "scan_angle", "user_data", "agc_gain", "point_source_id",
+                    "gps_time", "wave_descriptor", "wave_offset", "wave_size",
+                    "return_point_location", "x_t", "y_t", "z_t"]
+point_data_formats = ["<i4", "<i4", "<i4", "<u2", "u1", "u1",
+                      "i1", "u1", "u1", "u1",
+                      "<f8", "u1", "<u8", "<u4",
+                      "<f4", "<f4", "<f4", "<f4"]
+point_data_dtype = numpy.dtype({"names" : point_data_names, "formats" : point_data_formats})
+point_chunk_size = 1000000 # Number of point records read at once by readLASPoints
+waveform_batch_samples = 4194304 # Number of waveform samples gathered at once by readWaveforms
+
+# Grid index sidecar file (little endian), also read by the las13reader C++ library:
+#  header: signature "LAS13IDX", version, number of point records, size of LAS file,
+#          min x, min y, cell size, number of columns, number of rows, number of runs
+#  cell offsets: uint64[n_columns*n_rows+1], runs for cell (row*n_columns+column) are
+#                cell_offsets[cell] to cell_offsets[cell+1]
+#  runs: uint32[n_runs][2], first record and number of consecutive records in the cell
+# Points outside the header bounds are put in the nearest cell at the edge of the grid.
+index_signature = "LAS13IDX"
+index_version = 1
+index_head_format = "<8sIQQdddIIQ"
+index_head_names = ["signature", "version", "n_points", "las_file_size",
+                    "min_x", "min_y", "cell_size", "n_columns", "n_rows", "n_runs"]
+index_grid_size = 256 # Default number of cells along the longest side of the grid
+region_grid_size = 1024 # Maximum number of cells along the longest side of a RegionIndex grid
+region_csv_columns = ["north", "south", "east", "west"] # Columns in a CSV file of regions
 
 ##
 #Function readLASHeader
@@ -209,9 +268,18 @@ def printLASHeader(headdata,filename):
 #            wavedata[1][*] contains the amplitude values
 #  wv_info: contains generic information about the waveforms as read from the Waveform Packet Descriptor"""
 #  output_dir: directory to output ASCII files to
+#  scale_factors: X, Y, Z scale factors from the header (default point_scale_factors)
+#  offsets: X, Y, Z offsets from the header (default point_offsets)
 ##
 
-def writeWaveform(wavedata,wv_info,output_dir):
+def writeWaveform(wavedata,wv_info,output_dir,scale_factors=None,offsets=None):
+
+    if scale_factors == None:
+        scale_factors = point_scale_factors
+    #end if
+    if offsets == None:
+        offsets = point_offsets
+    #end if
 
     GPStime= wavedata[0][10]
     sampling=wv_info[3]/1000.0 #sampling frequency in nanoseconds
@@ -222,10 +290,10 @@ def writeWaveform(wavedata,wv_info,output_dir):
 
     w_point=[0,0,0]
     for i in range(3):
-        w_point[i]=wavedata[0][i]*point_scale_factors[i]+point_offsets[i]
+        w_point[i]=wavedata[0][i]*scale_factors[i]+offsets[i]
     #end for
 
-    print >>wvfile, "Point {0:31} {1} {2} {3}".format("", wavedata[0][0]*point_scale_factors[0], wavedata[0][1]*point_scale_factors[1], wavedata[0][2]*point_scale_factors[2])
+    print >>wvfile, "Point {0:31} {1} {2} {3}".format("", wavedata[0][0]*scale_factors[0], wavedata[0][1]*scale_factors[1], wavedata[0][2]*scale_factors[2])
     print >>wvfile, "Return Number {0:23} {1}".format("", int(wavedata[0][4]&7))
     print >>wvfile, "Number of returns for this pulse {0:4} {1}".format("", int((wavedata[0][4]& 56)/8))
     print >>wvfile, "Time {0:32} {1}".format("", wavedata[0][10])
@@ -257,25 +325,1093 @@ def writeWaveform(wavedata,wv_info,output_dir):
         print "If this is the case then waveform and origin positions will be incorrect. If you expect Z to increase from the lidar to the target then this is probably not a problem."
 
     # Calculating origin from: X=xo+x(t)
-    xo= w_point[0]- wavedata[0][15]*wavedata[0][14]
-    yo= w_point[1]- wavedata[0][16]*wavedata[0][14]
-    zo= w_point[2]- wavedata[0][17]*wavedata[0][14]
-    #print >>wvfile, "Xo\t", xo
-    #print >>wvfile, "Yo\t", yo
-    #print >>wvfile, "Zo\t",  zo
+    sample_positions = getWaveformSamplePositions([w_point], [wavedata[0][14]], [wavedata[0][15:18]], sampling, len(wavedata[1]))[0]
+    #print >>wvfile, "Xo\t", sample_positions[0][0]
+    #print >>wvfile, "Yo\t", sample_positions[0][1]
+    #print >>wvfile, "Zo\t", sample_positions[0][2]
     print >>wvfile, "Intensity  X  Y  Z"
 
-    for i in range(len(wavedata[1])):
-        print >>wvfile, wavedata[1][i],round(xo,4),round(yo,4),round(zo,4)
-        xo+=(wavedata[0][15]*sampling*1000)
-        yo+=(wavedata[0][16]*sampling*1000)
-        zo+=(wavedata[0][17]*sampling*1000)
-    #end for
+    wvfile.writelines("%s %s %s %s\n" % (intensity, round(xo,4), round(yo,4), round(zo,4))
+                      for intensity, (xo, yo, zo) in zip(wavedata[1], sample_positions.tolist()))
 
     wvfile.close()
 
 #end function
 
+##
+# Function getPointDataDtype
+# Gets NumPy dtype for point records, allowing for records longer than point_data_length
+#
+# Arguments:
+#  record_length: Point Data Record Length from header
+#
+# Returns:
+#  NumPy dtype for point records
+##
+
+def getPointDataDtype(record_length):
+
+    if record_length == point_data_dtype.itemsize:
+        return point_data_dtype
+    #end if
+
+    return numpy.dtype({"names" : point_data_dtype.names,
+                        "formats" : [point_data_dtype.fields[name][0] for name in point_data_dtype.names],
+                        "offsets" : [point_data_dtype.fields[name][1] for name in point_data_dtype.names],
+                        "itemsize" : record_length})
+
+#end function
+
+##
+# Function readLASPoints
+# Reads point data records (format 4) in chunks into NumPy structured arrays
+# rather than unpacking each point separately.
+#
+# Arguments:
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file to read points from
+#  chunk_size: number of points to read at once
+#  record_runs: only read these records, given as arrays of first record and number
+#               of records in each run sorted by first record (see getIndexedRecordRuns)
+#
+# Yields:
+#  first_point: index of first point in chunk
+#  points: structured array of points with fields point_data_names, if record_runs is
+#          given the points within a chunk may not be consecutive records
+##
+
+def readLASPoints(headdata,filename,chunk_size=point_chunk_size,record_runs=None):
+
+    Size_points = headdata[17]
+    N_points = headdata[18]
+    Offset_points = headdata[14]
+
+    record_dtype = getPointDataDtype(Size_points)
+
+    lasfile = open(filename, "rb")
+
+    try:
+        if record_runs is None:
+            lasfile.seek(Offset_points)
+            first_point = 0
+            while first_point < N_points:
+                points = numpy.fromfile(lasfile, dtype=record_dtype, count=min(chunk_size, N_points - first_point))
+                if points.shape[0] == 0:
+                    break
+                #end if
+                yield first_point, points
+                first_point += points.shape[0]
+            #end while
+        else:
+            # Join runs into chunks of up to chunk_size points, splitting long runs
+            chunk = []
+            n_chunk = 0
+            for run_start, run_length in zip(*record_runs):
+                run_start = int(run_start)
+                run_end = min(run_start + int(run_length), N_points)
+                while run_start < run_end:
+                    n_read = min(chunk_size - n_chunk, run_end - run_start)
+                    lasfile.seek(Offset_points + run_start*Size_points)
+                    points = numpy.fromfile(lasfile, dtype=record_dtype, count=n_read)
+                    if points.shape[0] == 0:
+                        break
+                    #end if
+                    if n_chunk == 0:
+                        first_point = run_start
+                    #end if
+                    chunk.append(points)
+                    n_chunk += points.shape[0]
+                    run_start += points.shape[0]
+                    if n_chunk >= chunk_size:
+                        yield first_point, numpy.concatenate(chunk)
+                        chunk = []
+                        n_chunk = 0
+                    #end if
+                #end while
+            #end for
+            if n_chunk > 0:
+                yield first_point, numpy.concatenate(chunk)
+            #end if
+        #end if
+    finally:
+        lasfile.close()
+    #end try
+
+#end function
+
+##
+# Function decodePointFlags
+# Gets the values stored in the return byte of each point
+#
+# Arguments:
+#  points: structured array of points as returned by readLASPoints
+#
+# Returns:
+#  return_num, n_returns, scan_dir, edge_fl: arrays with a value for each point
+##
+
+def decodePointFlags(points):
+
+    flags = points["return_flags"]
+    return_num = flags & 7
+    n_returns = (flags & 56) >> 3
+    scan_dir = (flags & 64) >> 6
+    edge_fl = (flags & 128) >> 7
+
+    return (return_num, n_returns, scan_dir, edge_fl)
+
+#end function
+
+##
+# Function scalePointCoordinates
+# Applies scale factors and offsets from the header to get X, Y, Z of each point
+#
+# Arguments:
+#  points: structured array of points as returned by readLASPoints
+#  headdata: header as returned by ReadLASHeader
+#
+# Returns:
+#  point_x, point_y, point_z: arrays of scaled coordinates
+##
+
+def scalePointCoordinates(points,headdata):
+
+    point_x = points["x"]*headdata[24] + headdata[27]
+    point_y = points["y"]*headdata[25] + headdata[28]
+    point_z = points["z"]*headdata[26] + headdata[29]
+
+    return (point_x, point_y, point_z)
+
+#end function
+
+##
+# Function getPointsInArea
+# Gets a mask of points within an area
+#
+# Arguments:
+#  points: structured array of points as returned by readLASPoints
+#  headdata: header as returned by ReadLASHeader
+#  user_limits: area [N,S,E,W]
+#
+# Returns:
+#  boolean array which is True for points within the area
+##
+
+def getPointsInArea(points,headdata,user_limits):
+
+    max_north = user_limits[0]
+    min_north = user_limits[1]
+    max_east = user_limits[2]
+    min_east = user_limits[3]
+
+    point_x, point_y, point_z = scalePointCoordinates(points,headdata)
+
+    return (min_east < point_x) & (point_x < max_east) & (min_north < point_y) & (point_y < max_north)
+
+#end function
+
+##
+# Function openWaveformData
+# Memory maps the waveform data packet records of a LAS 1.3 file so waveforms can be
+# read without seeking and reading for each point
+#
+# Arguments:
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file
+#
+# Returns:
+#  int8 numpy.memmap starting at the start of the waveform data packet record
+##
+
+def openWaveformData(headdata,filename):
+
+    Offset_EVLRH = headdata[36]
+
+    return numpy.memmap(filename, dtype=numpy.int8, mode="r", offset=Offset_EVLRH)
+
+#end function
+
+##
+# Function readWaveforms
+# Gathers waveforms for many points into a 2D array. Waveforms are read in order of offset
+# within the file so the data is read sequentially.
+#
+# Arguments:
+#  wave_data: memmap as returned by openWaveformData
+#  wave_offsets: offset of each waveform (from point records)
+#  wave_sizes: size of each waveform in bytes (from point records)
+#
+# Returns:
+#  waveforms: int8 array n_points*n_samples (longest waveform), shorter waveforms are padded with 0
+##
+
+def readWaveforms(wave_data,wave_offsets,wave_sizes):
+
+    wave_offsets = numpy.asarray(wave_offsets, dtype=numpy.int64)
+    wave_sizes = numpy.asarray(wave_sizes, dtype=numpy.int64)
+
+    if wave_offsets.shape[0] == 0:
+        return numpy.zeros((0,0), dtype=numpy.int8)
+    #end if
+
+    if (wave_offsets + wave_sizes).max() > wave_data.shape[0]:
+        raise IOError("Waveform data packets extend past the end of the file")
+    #end if
+
+    waveforms = numpy.zeros((wave_offsets.shape[0], int(wave_sizes.max())), dtype=numpy.int8)
+
+    wave_order = numpy.argsort(wave_offsets, kind="mergesort")
+    sorted_offsets = wave_offsets[wave_order]
+    sorted_sizes = wave_sizes[wave_order]
+    # Number of samples before the end of each waveform
+    sample_ends = numpy.cumsum(sorted_sizes)
+
+    # Read waveforms in batches of about waveform_batch_samples samples so memory used
+    # for indices doesn't depend on the number of points
+    first_wave = 0
+    while first_wave < wave_order.shape[0]:
+        first_sample = sample_ends[first_wave] - sorted_sizes[first_wave]
+        last_wave = max(numpy.searchsorted(sample_ends, first_sample + waveform_batch_samples, side="right"), first_wave + 1)
+
+        batch_sizes = sorted_sizes[first_wave:last_wave]
+        batch_starts = sample_ends[first_wave:last_wave] - batch_sizes - first_sample
+        # Sample number within the waveform for each sample in the batch
+        sample_nums = numpy.arange(sample_ends[last_wave - 1] - first_sample) - numpy.repeat(batch_starts, batch_sizes)
+        sample_index = numpy.repeat(sorted_offsets[first_wave:last_wave], batch_sizes) + sample_nums
+
+        waveforms[numpy.repeat(wave_order[first_wave:last_wave], batch_sizes), sample_nums] = wave_data[sample_index]
+
+        first_wave = last_wave
+    #end while
+
+    return waveforms
+
+#end function
+
+##
+# Function getWaveformSamplePositions
+# Gets the X, Y, Z of each waveform sample for many points. The position of the first
+# sample (origin) is calculated from X=xo+x(t) and the offset between each sample added,
+# giving the same values as adding the offset one sample at a time.
+#
+# Arguments:
+#  point_xyz: array n_points*3 of scaled point coordinates
+#  return_point_location: array of return point locations (picoseconds)
+#  xyz_t: array n_points*3 of parametric line offsets x(t), y(t), z(t)
+#  sampling: temporal sample spacing in nanoseconds
+#  n_samples: number of samples in each waveform
+#
+# Returns:
+#  array n_points*n_samples*3 with X, Y, Z for each sample
+##
+
+def getWaveformSamplePositions(point_xyz,return_point_location,xyz_t,sampling,n_samples):
+
+    origins, sample_offsets = getWaveformOrigins(point_xyz,return_point_location,xyz_t,sampling)
+
+    positions = numpy.empty((origins.shape[0], n_samples, 3), dtype=numpy.float64)
+    positions[:,0,:] = origins
+    positions[:,1:,:] = sample_offsets[:,numpy.newaxis,:]
+
+    return numpy.cumsum(positions, axis=1, out=positions)
+
+#end function
+
+##
+# Function getWaveformOrigins
+# Gets the position of the first sample of each waveform (origin) and the offset between samples
+#
+# Arguments:
+#  point_xyz: array n_points*3 of scaled point coordinates
+#  return_point_location: array of return point locations (picoseconds)
+#  xyz_t: array n_points*3 of parametric line offsets x(t), y(t), z(t)
+#  sampling: temporal sample spacing in nanoseconds
+#
+# Returns:
+#  origins: array n_points*3 with X, Y, Z of first sample
+#  sample_offsets: array n_points*3 with offset in X, Y, Z between samples
+##
+
+def getWaveformOrigins(point_xyz,return_point_location,xyz_t,sampling):
+
+    point_xyz = numpy.asarray(point_xyz, dtype=numpy.float64)
+    return_point_location = numpy.asarray(return_point_location, dtype=numpy.float64)
+    xyz_t = numpy.asarray(xyz_t, dtype=numpy.float64)
+
+    # Calculating origin from: X=xo+x(t)
+    origins = point_xyz - xyz_t*return_point_location[:,numpy.newaxis]
+    # *1000 to convert from km to meters *sampling to get offset between each sample
+    sample_offsets = xyz_t*sampling*1000
+
+    return (origins, sample_offsets)
+
+#end function
+
+##
+# Function getWaveformColumns
+# Gets point attributes, waveforms and origin / offset vectors for many points as columns
+# which can be written to a single file
+#
+# Arguments:
+#  points: structured array of points as returned by readLASPoints
+#  waveforms: array of waveforms as returned by readWaveforms
+#  headdata: header as returned by ReadLASHeader
+#  wv_info: generic information about the waveforms from the Waveform Packet Descriptor
+#
+# Returns:
+#  ordered dictionary of arrays with a value (or row) for each point
+##
+
+def getWaveformColumns(points,waveforms,headdata,wv_info):
+
+    sampling=wv_info[3]/1000.0 #sampling frequency in nanoseconds
+
+    point_x, point_y, point_z = scalePointCoordinates(points,headdata)
+    return_num, n_returns, scan_dir, edge_fl = decodePointFlags(points)
+    origins, sample_offsets = getWaveformOrigins(numpy.column_stack((point_x, point_y, point_z)),
+                                                 points["return_point_location"],
+                                                 numpy.column_stack((points["x_t"], points["y_t"], points["z_t"])),
+                                                 sampling)
+
+    columns = collections.OrderedDict()
+    columns["x"] = point_x
+    columns["y"] = point_y
+    columns["z"] = point_z
+    columns["intensity"] = points["intensity"]
+    columns["return_number"] = return_num
+    columns["number_of_returns"] = n_returns
+    columns["scan_direction"] = scan_dir
+    columns["edge_of_flight_line"] = edge_fl
+    columns["classification"] = points["classification"]
+    columns["scan_angle"] = points["scan_angle"]
+    columns["agc_gain"] = points["agc_gain"]
+    columns["gps_time"] = points["gps_time"]
+    columns["return_point_location"] = points["return_point_location"]
+    columns["n_samples"] = points["wave_size"]
+    columns["origin"] = origins
+    columns["sample_offset"] = sample_offsets
+    columns["waveform"] = waveforms
+
+    return columns
+
+#end function
+
+##
+# Class WaveformFileWriter
+# Writes waveforms and point attributes for all points to a single file rather than a text
+# file for each waveform. Columns from getWaveformColumns are appended a chunk at a time.
+#
+# Two formats are available, chosen from the file extension:
+#  .h5 / .hdf5: HDF5 file with a dataset for each column (requires h5py). Datasets are
+#               extended as each chunk is written so only one chunk is held in memory.
+#               An existing file is overwritten unless 'append' is set, in which case
+#               waveforms are appended if the file was written with the same digitiser
+#               settings and LAS file.
+#  .npz: NumPy zip file. Chunks are kept in memory and written when the file is closed.
+#
+# Waveforms are stored as an int8 array n_points*n_samples, waveforms shorter than the
+# longest are padded with 0 (the length is stored in 'n_samples').
+##
+
+class WaveformFileWriter(object):
+
+    def __init__(self,filename,wv_info,las_filename=None,append=False):
+
+        self.filename = filename
+        self.wv_info = wv_info
+        self.n_points = 0
+
+        extension = os.path.splitext(filename)[1].lower()
+
+        if extension in (".h5", ".hdf5"):
+            if not HAVE_H5PY:
+                raise ImportError("h5py is required to write waveforms to HDF5")
+            #end if
+            attrs = collections.OrderedDict()
+            attrs["temporal_sample_spacing"] = wv_info[3]/1000.0
+            attrs["digitiser_gain"] = wv_info[4]
+            attrs["digitiser_offset"] = wv_info[5]
+            if las_filename is not None:
+                attrs["las_file"] = os.path.abspath(las_filename)
+            #end if
+            if append and os.path.isfile(filename):
+                self.h5file = h5py.File(filename, "a")
+                for name, value in attrs.items():
+                    if name not in self.h5file.attrs or self.h5file.attrs[name] != value:
+                        existing = self.h5file.attrs.get(name)
+                        self.h5file.close()
+                        raise ValueError("Can't append to %s, %s is %s (expected %s)" % (filename, name, existing, value))
+                    #end if
+                #end for
+            else:
+                self.h5file = h5py.File(filename, "w")
+                for name, value in attrs.items():
+                    self.h5file.attrs[name] = value
+                #end for
+            #end if
+            self.npz_columns = None
+        elif extension == ".npz":
+            if append:
+                raise ValueError("Appending is only supported for HDF5 files")
+            #end if
+            self.h5file = None
+            self.npz_columns = collections.OrderedDict()
+            self.las_filename = las_filename
+        else:
+            raise ValueError("Output file must have extension .h5, .hdf5 or .npz (found %s)" % extension)
+        #end if
+
+    def append(self,columns):
+
+        n_points = columns["x"].shape[0]
+
+        if self.h5file is not None:
+            for name, values in columns.items():
+                if name not in self.h5file:
+                    self.h5file.create_dataset(name, data=values, chunks=True,
+                                               maxshape=(None,) + (None,)*(values.ndim - 1))
+                else:
+                    dataset = self.h5file[name]
+                    old_length = dataset.shape[0]
+                    new_shape = [old_length + n_points] + list(dataset.shape[1:])
+                    if values.ndim > 1:
+                        new_shape[1] = max(new_shape[1], values.shape[1])
+                    #end if
+                    dataset.resize(tuple(new_shape))
+                    if values.ndim > 1:
+                        dataset[old_length:, :values.shape[1]] = values
+                    else:
+                        dataset[old_length:] = values
+                    #end if
+                #end if
+            #end for
+            self.h5file.flush()
+        else:
+            for name, values in columns.items():
+                self.npz_columns.setdefault(name, []).append(numpy.array(values))
+            #end for
+        #end if
+
+        self.n_points += n_points
+
+    def close(self):
+
+        if self.h5file is not None:
+            self.h5file.close()
+            self.h5file = None
+        elif self.npz_columns is not None:
+            out_columns = {}
+            for name, chunks in self.npz_columns.items():
+                if chunks[0].ndim > 1:
+                    # Pad waveforms to the longest in any chunk
+                    width = max(chunk.shape[1] for chunk in chunks)
+                    chunks = [numpy.pad(chunk, ((0, 0), (0, width - chunk.shape[1])), "constant") for chunk in chunks]
+                #end if
+                out_columns[name] = numpy.concatenate(chunks)
+            #end for
+            out_columns["temporal_sample_spacing"] = numpy.array(self.wv_info[3]/1000.0)
+            out_columns["digitiser_gain"] = numpy.array(self.wv_info[4])
+            out_columns["digitiser_offset"] = numpy.array(self.wv_info[5])
+            if self.las_filename is not None:
+                out_columns["las_file"] = numpy.array(os.path.abspath(self.las_filename))
+            #end if
+            numpy.savez(self.filename, **out_columns)
+            self.npz_columns = None
+        #end if
+
+#end class
+
+##
+# Function getIndexColumnRow
+# Gets the column and row of the grid index cell containing each X, Y. Positions
+# outside the grid are put in the nearest cell at the edge.
+#
+# Arguments:
+#  point_x, point_y: arrays of X and Y
+#  index_head: dictionary of header values from the index (index_head_names)
+#
+# Returns:
+#  columns, rows: int64 arrays
+##
+
+def getIndexColumnRow(point_x,point_y,index_head):
+
+    columns = numpy.floor((numpy.asarray(point_x) - index_head["min_x"])/index_head["cell_size"])
+    rows = numpy.floor((numpy.asarray(point_y) - index_head["min_y"])/index_head["cell_size"])
+
+    columns = numpy.clip(columns, 0, index_head["n_columns"] - 1).astype(numpy.int64)
+    rows = numpy.clip(rows, 0, index_head["n_rows"] - 1).astype(numpy.int64)
+
+    return (columns, rows)
+
+#end function
+
+##
+# Function writeLASIndex
+# Writes a grid index of the point records in a LAS 1.3 file to a sidecar file. For
+# each cell of a regular grid over the header bounds the index stores runs of
+# consecutive point records within the cell, so points within an area can be read
+# without reading every point in the file (see getIndexedRecordRuns).
+#
+# Arguments:
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file to index
+#  index_file: name of index file (defaults to filename + ".idx")
+#  cell_size: size of grid cells (defaults to index_grid_size cells along the longest side)
+#  chunk_size: number of points to read at once
+#
+# Returns:
+#  index_file: name of index file written
+##
+
+def writeLASIndex(headdata,filename,index_file=None,cell_size=None,chunk_size=point_chunk_size):
+
+    if index_file == None:
+        index_file = filename + ".idx"
+    #end if
+
+    Max_x= headdata[30]
+    Min_x= headdata[31]
+    Max_y= headdata[32]
+    Min_y= headdata[33]
+
+    if cell_size == None:
+        cell_size = max(Max_x - Min_x, Max_y - Min_y)/float(index_grid_size)
+    #end if
+    if cell_size <= 0:
+        # All points have the same X, Y so use a single cell
+        cell_size = 1.0
+    #end if
+
+    index_head = {"signature" : index_signature,
+                  "version" : index_version,
+                  "n_points" : headdata[18],
+                  "las_file_size" : os.path.getsize(filename),
+                  "min_x" : Min_x,
+                  "min_y" : Min_y,
+                  "cell_size" : float(cell_size),
+                  "n_columns" : max(int(math.ceil((Max_x - Min_x)/cell_size)), 1),
+                  "n_rows" : max(int(math.ceil((Max_y - Min_y)/cell_size)), 1)}
+    n_cells = index_head["n_columns"]*index_head["n_rows"]
+
+    run_cells = []
+    run_starts = []
+    run_lengths = []
+
+    for first_point, points in readLASPoints(headdata,filename,chunk_size):
+        point_x, point_y, point_z = scalePointCoordinates(points,headdata)
+        columns, rows = getIndexColumnRow(point_x,point_y,index_head)
+        cells = rows*index_head["n_columns"] + columns
+
+        # Split points into runs of consecutive points within the same cell
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(cells)) + 1))
+        lengths = numpy.diff(numpy.append(starts, cells.shape[0]))
+        cells = cells[starts]
+
+        # Continue the last run from the previous chunk
+        if len(run_cells) > 0 and run_cells[-1][-1] == cells[0]:
+            run_lengths[-1][-1] += lengths[0]
+            starts = starts[1:]
+            lengths = lengths[1:]
+            cells = cells[1:]
+        #end if
+
+        if cells.shape[0] > 0:
+            run_cells.append(cells)
+            run_starts.append(starts + first_point)
+            run_lengths.append(lengths)
+        #end if
+    #end for
+
+    if len(run_cells) > 0:
+        run_cells = numpy.concatenate(run_cells)
+        run_starts = numpy.concatenate(run_starts)
+        run_lengths = numpy.concatenate(run_lengths)
+    else:
+        run_cells = numpy.zeros(0, dtype=numpy.int64)
+        run_starts = numpy.zeros(0, dtype=numpy.int64)
+        run_lengths = numpy.zeros(0, dtype=numpy.int64)
+    #end if
+
+    # Sort runs by cell, keeping them in order of record within each cell
+    run_order = numpy.argsort(run_cells, kind="mergesort")
+    runs = numpy.column_stack((run_starts[run_order], run_lengths[run_order])).astype("<u4")
+    cell_offsets = numpy.searchsorted(run_cells[run_order], numpy.arange(n_cells + 1)).astype("<u8")
+
+    index_head["n_runs"] = runs.shape[0]
+
+    indexfile = open(index_file, "wb")
+    try:
+        indexfile.write(struct.pack(index_head_format, *[index_head[name] for name in index_head_names]))
+        cell_offsets.tofile(indexfile)
+        runs.tofile(indexfile)
+    finally:
+        indexfile.close()
+    #end try
+
+    return index_file
+
+#end function
+
+##
+# Function readLASIndex
+# Reads a grid index written by writeLASIndex. If headdata and filename are given checks
+# the index matches the LAS file.
+#
+# Arguments:
+#  index_file: name of index file
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file the index is for
+#
+# Returns:
+#  index_head: dictionary of header values (index_head_names)
+#  cell_offsets: uint64 array of the first run for each cell
+#  runs: uint32 array n_runs*2 of first record and number of records in each run
+##
+
+def readLASIndex(index_file,headdata=None,filename=None):
+
+    head_length = struct.calcsize(index_head_format)
+
+    indexfile = open(index_file, "rb")
+    try:
+        record = indexfile.read(head_length)
+    finally:
+        indexfile.close()
+    #end try
+
+    if len(record) != head_length:
+        raise Exception("Index file %s is too short" % index_file)
+    #end if
+
+    index_head = dict(zip(index_head_names, struct.unpack(index_head_format, record)))
+
+    if index_head["signature"] != index_signature:
+        raise Exception("%s is not a LAS 1.3 index file" % index_file)
+    #end if
+    if index_head["version"] != index_version:
+        raise Exception("Index file %s is version %d, expected version %d" % (index_file, index_head["version"], index_version))
+    #end if
+    if headdata != None and index_head["n_points"] != headdata[18]:
+        raise Exception("Index file %s is for %d points, LAS file contains %d points" % (index_file, index_head["n_points"], headdata[18]))
+    #end if
+    if filename != None and index_head["las_file_size"] != os.path.getsize(filename):
+        raise Exception("Index file %s does not match the size of %s, has the file changed since it was indexed?" % (index_file, filename))
+    #end if
+
+    n_cells = index_head["n_columns"]*index_head["n_rows"]
+
+    if os.path.getsize(index_file) != head_length + (n_cells + 1)*8 + index_head["n_runs"]*8:
+        raise Exception("Index file %s is not the expected size" % index_file)
+    #end if
+
+    cell_offsets = numpy.memmap(index_file, dtype="<u8", mode="r", offset=head_length, shape=(n_cells + 1,))
+    if index_head["n_runs"] > 0:
+        runs = numpy.memmap(index_file, dtype="<u4", mode="r", offset=head_length + (n_cells + 1)*8, shape=(index_head["n_runs"], 2))
+    else:
+        runs = numpy.zeros((0, 2), dtype="<u4")
+    #end if
+
+    return (index_head, cell_offsets, runs)
+
+#end function
+
+##
+# Function getIndexedRecordRuns
+# Gets the runs of point records in grid cells which intersect an area. Runs which follow
+# on from each other are joined. Points within the runs still need to be checked
+# (e.g., using getPointsInArea) as cells can extend past the area.
+#
+# Arguments:
+#  index: index as returned by readLASIndex
+#  user_limits: area [N,S,E,W]
+#
+# Returns:
+#  run_starts, run_lengths: int64 arrays of first record and number of records in each
+#                           run, sorted by first record
+##
+
+def getIndexedRecordRuns(index,user_limits):
+
+    index_head, cell_offsets, runs = index
+
+    max_north = user_limits[0]
+    min_north = user_limits[1]
+    max_east = user_limits[2]
+    min_east = user_limits[3]
+
+    columns, rows = getIndexColumnRow([min_east, max_east],[min_north, max_north],index_head)
+
+    # Cells in each row are consecutive so runs for each row are read at once
+    row_runs = []
+    for row in range(rows[0], rows[1] + 1):
+        first_cell = row*index_head["n_columns"] + columns[0]
+        last_cell = row*index_head["n_columns"] + columns[1]
+        row_runs.append(runs[cell_offsets[first_cell]:cell_offsets[last_cell + 1]])
+    #end for
+
+    selected_runs = numpy.concatenate(row_runs).astype(numpy.int64)
+
+    return joinRecordRuns(selected_runs[:,0],selected_runs[:,1])
+
+#end function
+
+##
+# Function joinRecordRuns
+# Sorts runs of point records and joins runs which overlap or follow on from each other
+#
+# Arguments:
+#  run_starts: first record of each run
+#  run_lengths: number of records in each run
+#
+# Returns:
+#  run_starts, run_lengths: int64 arrays sorted by first record
+##
+
+def joinRecordRuns(run_starts,run_lengths):
+
+    run_starts = numpy.asarray(run_starts, dtype=numpy.int64)
+    run_lengths = numpy.asarray(run_lengths, dtype=numpy.int64)
+
+    if run_starts.shape[0] == 0:
+        return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+    #end if
+
+    run_order = numpy.argsort(run_starts, kind="mergesort")
+    run_starts = run_starts[run_order]
+    # Furthest end of this run or any run before it
+    run_ends = numpy.maximum.accumulate(run_starts + run_lengths[run_order])
+
+    # A new run starts if there is a gap since the end of all previous runs
+    new_run = numpy.ones(run_starts.shape[0], dtype=bool)
+    new_run[1:] = run_starts[1:] > run_ends[:-1]
+    new_run_index = numpy.flatnonzero(new_run)
+    last_in_run = numpy.append(new_run_index[1:] - 1, run_starts.shape[0] - 1)
+
+    return (run_starts[new_run_index], run_ends[last_in_run] - run_starts[new_run_index])
+
+#end function
+
+##
+# Function readRegions
+# Reads regions to extract waveforms for from a file. Two formats are supported:
+#  .csv: a row for each bounding box with columns north, south, east, west and optionally
+#        name. If there is no header row the columns are taken in that order.
+#  .json / .geojson: GeoJSON FeatureCollection of Polygon or MultiPolygon features, using
+#        'name' or 'id' from the properties as the name if available. Holes are excluded.
+# Coordinates must be in the same projection as the LAS file.
+#
+# Arguments:
+#  filename: CSV or GeoJSON file
+#
+# Returns:
+#  list of regions as dictionaries with keys:
+#   name: name of region, made unique and safe to use as a file name
+#   bounds: bounding box [N,S,E,W]
+#   rings: list of polygon rings as arrays n_vertices*2 or None for a bounding box
+##
+
+def readRegions(filename):
+
+    regions = []
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension == ".csv":
+        csvfile = open(filename, "r")
+        try:
+            rows = [row for row in csv.reader(csvfile) if len(row) > 0]
+        finally:
+            csvfile.close()
+        #end try
+
+        try:
+            [float(value) for value in rows[0][:len(region_csv_columns)]]
+            column_names = region_csv_columns + ["name"]
+        except ValueError:
+            column_names = [value.strip().lower() for value in rows[0]]
+            rows = rows[1:]
+        #end try
+
+        for column in region_csv_columns:
+            if column not in column_names:
+                raise Exception("Column '%s' not found in %s" % (column, filename))
+            #end if
+        #end for
+
+        for row in rows:
+            row = dict(zip(column_names, row))
+            regions.append({"name" : row.get("name", str(len(regions) + 1)).strip(),
+                            "bounds" : [float(row[column]) for column in region_csv_columns],
+                            "rings" : None})
+        #end for
+    elif extension in (".json", ".geojson"):
+        jsonfile = open(filename, "r")
+        try:
+            geojson = json.load(jsonfile)
+        finally:
+            jsonfile.close()
+        #end try
+
+        if geojson.get("type") == "FeatureCollection":
+            features = geojson["features"]
+        else:
+            features = [geojson]
+        #end if
+
+        for feature in features:
+            if feature.get("type") == "Feature":
+                geometry = feature["geometry"]
+                properties = feature.get("properties") or {}
+            else:
+                geometry = feature
+                properties = {}
+            #end if
+
+            if geometry["type"] == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                raise Exception("Only Polygon and MultiPolygon geometries are supported (found %s)" % geometry["type"])
+            #end if
+
+            rings = [numpy.array(ring, dtype=numpy.float64)[:,:2] for polygon in polygons for ring in polygon]
+            vertices = numpy.concatenate(rings)
+            name = properties.get("name", properties.get("id", feature.get("id", len(regions) + 1)))
+            regions.append({"name" : unicode(name).strip(),
+                            "bounds" : [vertices[:,1].max(), vertices[:,1].min(), vertices[:,0].max(), vertices[:,0].min()],
+                            "rings" : rings})
+        #end for
+    else:
+        raise Exception("Regions must be a CSV (.csv) or GeoJSON (.json, .geojson) file (found %s)" % extension)
+    #end if
+
+    # Make names safe to use as file names and unique
+    used_names = set()
+    for region in regions:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", region["name"].encode("ascii", "replace") if isinstance(region["name"], unicode) else region["name"])
+        if name in ("", ".", ".."):
+            name = "region"
+        #end if
+        unique_name = name
+        n_name = 1
+        while unique_name in used_names:
+            n_name += 1
+            unique_name = "%s_%d" % (name, n_name)
+        #end while
+        used_names.add(unique_name)
+        region["name"] = unique_name
+    #end for
+
+    return regions
+
+#end function
+
+##
+# Function getPointsInPolygon
+# Gets a mask of points within a polygon using the even-odd rule, so holes (and separate
+# parts of a multipolygon) can be given as additional rings.
+#
+# Arguments:
+#  point_x, point_y: arrays of X and Y
+#  rings: list of polygon rings as arrays n_vertices*2
+#
+# Returns:
+#  boolean array which is True for points within the polygon
+##
+
+def getPointsInPolygon(point_x,point_y,rings):
+
+    point_x = numpy.asarray(point_x, dtype=numpy.float64)
+    point_y = numpy.asarray(point_y, dtype=numpy.float64)
+    inside = numpy.zeros(point_x.shape, dtype=bool)
+
+    for ring in rings:
+        start_x = ring[:,0]
+        start_y = ring[:,1]
+        end_x = numpy.roll(start_x, -1)
+        end_y = numpy.roll(start_y, -1)
+        # Count crossings of a ray from each point towards +X, one edge at a time
+        for x_1, y_1, x_2, y_2 in zip(start_x, start_y, end_x, end_y):
+            if y_1 == y_2:
+                continue
+            #end if
+            crosses = (y_1 > point_y) != (y_2 > point_y)
+            crosses &= point_x < x_1 + (point_y - y_1)*(x_2 - x_1)/(y_2 - y_1)
+            inside ^= crosses
+        #end for
+    #end for
+
+    return inside
+
+#end function
+
+##
+# Class RegionIndex
+# Grid index of many regions (as returned by readRegions) used to find the regions
+# containing each point without testing every point against every region. Each grid
+# cell stores the regions whose bounding box intersects it, points are then tested
+# against the bounding boxes (and polygons) of the regions in their cell.
+#
+# Arguments:
+#  regions: list of regions as returned by readRegions
+#  cell_size: size of grid cells (defaults to the median size of the regions, limited
+#             to region_grid_size cells along the longest side)
+##
+
+class RegionIndex(object):
+
+    def __init__(self,regions,cell_size=None):
+
+        self.regions = regions
+        bounds = numpy.array([region["bounds"] for region in regions], dtype=numpy.float64).reshape(-1, 4)
+        self.max_north = bounds[:,0]
+        self.min_north = bounds[:,1]
+        self.max_east = bounds[:,2]
+        self.min_east = bounds[:,3]
+
+        if len(regions) == 0:
+            self.n_columns = 0
+            self.n_rows = 0
+            self.cell_offsets = numpy.zeros(1, dtype=numpy.int64)
+            self.cell_regions = numpy.zeros(0, dtype=numpy.int64)
+            return
+        #end if
+
+        self.min_x = self.min_east.min()
+        self.min_y = self.min_north.min()
+        self.max_x = self.max_east.max()
+        self.max_y = self.max_north.max()
+        extent = max(self.max_x - self.min_x, self.max_y - self.min_y)
+
+        if cell_size == None:
+            cell_size = numpy.median(numpy.maximum(self.max_east - self.min_east, self.max_north - self.min_north))
+        #end if
+        cell_size = max(cell_size, extent/float(region_grid_size))
+        if cell_size <= 0:
+            cell_size = 1.0
+        #end if
+        self.cell_size = cell_size
+
+        self.n_columns = max(int(math.ceil((self.max_x - self.min_x)/cell_size)), 1)
+        self.n_rows = max(int(math.ceil((self.max_y - self.min_y)/cell_size)), 1)
+
+        # Add each region to all cells its bounding box intersects
+        min_columns, min_rows = self.getColumnRow(self.min_east, self.min_north)
+        max_columns, max_rows = self.getColumnRow(self.max_east, self.max_north)
+        region_cells = []
+        region_nums = []
+        for region_num in range(len(regions)):
+            columns, rows = numpy.meshgrid(numpy.arange(min_columns[region_num], max_columns[region_num] + 1),
+                                           numpy.arange(min_rows[region_num], max_rows[region_num] + 1))
+            region_cells.append((rows*self.n_columns + columns).ravel())
+            region_nums.append(numpy.repeat(region_num, region_cells[-1].shape[0]))
+        #end for
+        region_cells = numpy.concatenate(region_cells)
+        region_order = numpy.argsort(region_cells, kind="mergesort")
+        self.cell_regions = numpy.concatenate(region_nums)[region_order]
+        self.cell_offsets = numpy.searchsorted(region_cells[region_order], numpy.arange(self.n_columns*self.n_rows + 1))
+
+    def getColumnRow(self,point_x,point_y):
+
+        columns = numpy.floor((numpy.asarray(point_x) - self.min_x)/self.cell_size)
+        rows = numpy.floor((numpy.asarray(point_y) - self.min_y)/self.cell_size)
+
+        columns = numpy.clip(columns, 0, self.n_columns - 1).astype(numpy.int64)
+        rows = numpy.clip(rows, 0, self.n_rows - 1).astype(numpy.int64)
+
+        return (columns, rows)
+
+    def getPointRegions(self,point_x,point_y):
+
+        point_x = numpy.asarray(point_x, dtype=numpy.float64)
+        point_y = numpy.asarray(point_y, dtype=numpy.float64)
+
+        if len(self.regions) == 0:
+            return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+        #end if
+
+        # Points outside the grid can't be in any region
+        in_grid = numpy.flatnonzero((self.min_x < point_x) & (point_x < self.max_x) & (self.min_y < point_y) & (point_y < self.max_y))
+        columns, rows = self.getColumnRow(point_x[in_grid], point_y[in_grid])
+        cells = rows*self.n_columns + columns
+
+        # Pair each point with each region in its cell
+        first_region = self.cell_offsets[cells]
+        n_regions = self.cell_offsets[cells + 1] - first_region
+        point_index = numpy.repeat(in_grid, n_regions)
+        pair_offsets = numpy.repeat(first_region - (numpy.cumsum(n_regions) - n_regions), n_regions)
+        region_index = self.cell_regions[pair_offsets + numpy.arange(point_index.shape[0])]
+
+        # Keep pairs where the point is within the bounding box of the region
+        in_region = (self.min_east[region_index] < point_x[point_index]) & (point_x[point_index] < self.max_east[region_index]) \
+                    & (self.min_north[region_index] < point_y[point_index]) & (point_y[point_index] < self.max_north[region_index])
+        point_index = point_index[in_region]
+        region_index = region_index[in_region]
+
+        # Sort by region, keeping the points for each region in order
+        pair_order = numpy.lexsort((point_index, region_index))
+        point_index = point_index[pair_order]
+        region_index = region_index[pair_order]
+
+        # Test points against polygons
+        in_region = numpy.ones(point_index.shape[0], dtype=bool)
+        region_starts = numpy.flatnonzero(numpy.diff(numpy.append(-1, region_index)))
+        region_ends = numpy.append(region_starts[1:], region_index.shape[0])
+        for region_start, region_end in zip(region_starts, region_ends):
+            rings = self.regions[region_index[region_start]]["rings"]
+            if rings != None:
+                points = point_index[region_start:region_end]
+                in_region[region_start:region_end] = getPointsInPolygon(point_x[points], point_y[points], rings)
+            #end if
+        #end for
+
+        return (point_index[in_region], region_index[in_region])
+
+#end class
+
+##
+# Function readWavePacketDescriptor
+# Reads the variable length records of a LAS 1.3 file to get the waveform packet descriptor
+#
+# Arguments:
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file
+#
+# Returns:
+#  wv_info: waveform packet descriptor (wv_packet_format)
+##
+
+def readWavePacketDescriptor(headdata,filename):
+
+    wv_info = None
+
+    lasfile = open(filename, "rb")
+
+    try:
+        lasfile.seek(headdata[13])
+        for v_rec in range(headdata[15]):
+            headdata_rec = struct.unpack(VbleRec_head_format, lasfile.read(VbleRec_header_length))
+            Rec_length = headdata_rec[3]
+            skip_record = lasfile.read(Rec_length)
+
+            #If RecordID>= 100 it is a waveform Packet Descriptor
+            if (headdata_rec[2] >= 100) and (headdata_rec[2] < 356):
+                wv_info = struct.unpack(wv_packet_format,skip_record)
+            #end if
+        #end for
+    finally:
+        lasfile.close()
+    #end try
+
+    if wv_info == None:
+        raise Exception("No waveform packet descriptor found in " + filename)
+    #end if
+
+    return wv_info
+
+#end function
+
 ##
 # Function getUserInput
 # Request user to input area for waveform data extraction
@@ -457,12 +1593,17 @@ def getUserInput(headdata):
 #  user_limits: area to be extracted
 #  plottoscreen: whether to plot waveforms to screen
 #  plotfile: name of a pdf file to plot to
+#  output_file: name of a single HDF5 (.h5) or NPZ (.npz) file to write all waveforms to,
+#               instead of a text file for each (see WaveformFileWriter)
+#  append: append waveforms to an existing HDF5 output_file instead of overwriting it
+#  index_file: grid index written by writeLASIndex, if given only points in cells
+#              intersecting the area are read
 #
 # Returns:
 #  creates one output filr for waveform named waveform_tttttt_tttttt_x.txt where x indicates the number of return: 1 for first return, 2 for second return...etc"""
 ##
 
-def readLASWaves(headdata,filename,output_dir,user_limits,plottoscreen=False,plotfile=None):
+def readLASWaves(headdata,filename,output_dir,user_limits,plottoscreen=False,plotfile=None,output_file=None,index_file=None,append=False):
 
     record = ""
     tb=None
@@ -613,60 +1754,66 @@ def readLASWaves(headdata,filename,output_dir,user_limits,plottoscreen=False,plo
     #end for
 
     # Read points
-    Size_points = headdata[17]
     N_points = headdata[18]
-    Offset_points = headdata[14]
-    Offset_EVLRH = headdata[36]
-
-    max_north = user_limits[0]
-    min_north = user_limits[1]
-    max_east = user_limits[2]
-    min_east = user_limits[3]
 
-    # Move to first point
-    lasfile.seek(Offset_points)
     count =0
-    c_point=[0,0]
     print "Starting to process %d points" %N_points
-    print "Will output ASCII files to ", output_dir
-
-    for p in range(N_points):
-        Point = lasfile.read(Size_points)
-        point_info = struct.unpack(point_data_format,Point)
-        c_point=[0,0]
-        return_num=(point_info[4]&7)
-        n_returns=(point_info[4] & 56)
-        scan_dir=(point_info[4]&64)/64
-        edge_fl=(point_info[4]&128)/128
-        c_point[0]=(point_info[0]*point_scale_factors[0])+point_offsets[0]
-        c_point[1]=(point_info[1]*point_scale_factors[1])+point_offsets[1]
-        if  min_east<c_point[0]<max_east and min_north<c_point[1]< max_north:
-            wave_desc = point_info[11]
-
-            if wave_desc <> 0: # if there is waveform asociated to this point
+    if output_file != None:
+        print "Will output waveforms to ", output_file
+        wave_writer = WaveformFileWriter(output_file,wv_info,filename,append)
+    else:
+        print "Will output ASCII files to ", output_dir
+        wave_writer = None
+    #end if
+
+    wave_data = openWaveformData(headdata,filename)
+
+    if index_file != None:
+        record_runs = getIndexedRecordRuns(readLASIndex(index_file,headdata,filename),user_limits)
+        print "Using index %s, reading %d of %d points" %(index_file, record_runs[1].sum(), N_points)
+    else:
+        record_runs = None
+    #end if
+
+    # Read points in chunks and select those within the area
+    # which have a waveform asociated
+    for first_point, points in readLASPoints(headdata,filename,record_runs=record_runs):
+        selected = getPointsInArea(points,headdata,user_limits) & (points["wave_descriptor"] != 0)
+        selected_points = points[selected]
+
+        # Read all waveforms for the chunk at once
+        waveforms = readWaveforms(wave_data, selected_points["wave_offset"], selected_points["wave_size"])
+
+        if wave_writer != None and selected_points.shape[0] > 0:
+            wave_writer.append(getWaveformColumns(selected_points,waveforms,headdata,wv_info))
+        #end if
+
+        # Text files and plots are created for each waveform
+        if wave_writer == None or plottoscreen != False or plotfile != None:
+            for p in range(selected_points.shape[0]):
+                point_info = selected_points[p].item()
+
                 wavedata = []
                 wavedata.append(point_info)
-                wave_offset = Offset_EVLRH + point_info[12]
-                wave_size = point_info[13]
-
-                tmp= lasfile.tell() #saves current position in input file before jumpin to wave info
-                lasfile.seek(wave_offset)
-                wave_dat = lasfile.read(wave_size)
-                wave_data = struct.unpack("=%db" %wave_size, wave_dat)
-                wavedata.append(wave_data)
+                wavedata.append(waveforms[p,:point_info[13]].tolist())
 
-                writeWaveform(wavedata,wv_info,output_dir)
+                if wave_writer == None:
+                    writeWaveform(wavedata,wv_info,output_dir)
+                #end if
 
                 if plottoscreen != False or plotfile != None:
                     plotWaveform(wavedata,wv_info[3]/1000.0,fileobj=pdfplots,title="waveform_%0.6d_%0.6d_%d.txt"%(int(wavedata[0][10]),int(round((math.modf(wavedata[0][10])[0])*1000000)),int(wavedata[0][4]&7)))
-
-                lasfile.seek(tmp) # Goes back to next point in file
-
-                count+=1
-            #end if
+                #end if
+            #end for
         #end if
+
+        count+=selected_points.shape[0]
     #end for
 
+    if wave_writer != None:
+        wave_writer.close()
+    #end if
+
     if plotfile != None:
         pdfplots.close()
 
@@ -698,6 +1845,122 @@ def readLASWaves(headdata,filename,output_dir,user_limits,plottoscreen=False,plo
 
 #end function
 
+##
+# Function readLASRegionWaves
+# Extracts waveforms for many regions in a single pass over the point records. Each point
+# is matched to the regions containing it using a RegionIndex, a point within several
+# regions is written to each.
+#
+# Arguments:
+#  headdata: header as returned by ReadLASHeader
+#  filename: LAS 1.3 file
+#  output_dir: directory to output files to, ASCII files are written to a subdirectory
+#              for each region
+#  regions: list of regions as returned by readRegions
+#  output_file: name of a HDF5 (.h5) or NPZ (.npz) file, the region name is added to the
+#               name to give a file for each region (e.g., waveforms_plot1.h5)
+#  append: append waveforms to existing HDF5 files instead of overwriting them
+#  index_file: grid index written by writeLASIndex, if given only points in cells
+#              intersecting the regions are read
+#
+# Returns:
+#  numpy array with the number of waveforms extracted for each region
+##
+
+def readLASRegionWaves(headdata,filename,output_dir,regions,output_file=None,index_file=None,append=False):
+
+    wv_info = readWavePacketDescriptor(headdata,filename)
+    region_index = RegionIndex(regions)
+
+    N_points = headdata[18]
+    print "Starting to process %d points for %d regions" %(N_points, len(regions))
+
+    if index_file != None:
+        index = readLASIndex(index_file,headdata,filename)
+        region_runs = [getIndexedRecordRuns(index,region["bounds"]) for region in regions]
+        record_runs = joinRecordRuns(numpy.concatenate([runs[0] for runs in region_runs] + [numpy.zeros(0, dtype=numpy.int64)]),
+                                     numpy.concatenate([runs[1] for runs in region_runs] + [numpy.zeros(0, dtype=numpy.int64)]))
+        print "Using index %s, reading %d of %d points" %(index_file, record_runs[1].sum(), N_points)
+    else:
+        record_runs = None
+    #end if
+
+    if output_file != None:
+        output_base, output_extension = os.path.splitext(output_file)
+        print "Will output waveforms to %s_<region>%s" %(output_base, output_extension)
+    else:
+        print "Will output ASCII files to a directory for each region in ", output_dir
+    #end if
+
+    # Files / directories are created for each region when the first waveform is found
+    wave_writers = {}
+    region_dirs = {}
+    counts = numpy.zeros(len(regions), dtype=numpy.int64)
+
+    wave_data = openWaveformData(headdata,filename)
+
+    try:
+        for first_point, points in readLASPoints(headdata,filename,record_runs=record_runs):
+            point_x, point_y, point_z = scalePointCoordinates(points,headdata)
+            point_index, point_regions = region_index.getPointRegions(point_x,point_y)
+
+            has_wave = points["wave_descriptor"][point_index] != 0
+            point_index = point_index[has_wave]
+            point_regions = point_regions[has_wave]
+            if point_index.shape[0] == 0:
+                continue
+            #end if
+
+            # Read each waveform once, even if the point is within several regions
+            unique_points, point_rows = numpy.unique(point_index, return_inverse=True)
+            selected_points = points[unique_points]
+            waveforms = readWaveforms(wave_data, selected_points["wave_offset"], selected_points["wave_size"])
+            if output_file != None:
+                columns = getWaveformColumns(selected_points,waveforms,headdata,wv_info)
+            #end if
+
+            # Pairs are sorted by region so write the points for each region together
+            region_starts = numpy.flatnonzero(numpy.diff(numpy.append(-1, point_regions)))
+            region_ends = numpy.append(region_starts[1:], point_regions.shape[0])
+            for region_start, region_end in zip(region_starts, region_ends):
+                region_num = point_regions[region_start]
+                rows = point_rows[region_start:region_end]
+                name = regions[region_num]["name"]
+
+                if output_file != None:
+                    if region_num not in wave_writers:
+                        wave_writers[region_num] = WaveformFileWriter("%s_%s%s" %(output_base, name, output_extension),wv_info,filename,append)
+                    #end if
+                    wave_writers[region_num].append(collections.OrderedDict((column, values[rows]) for column, values in columns.items()))
+                else:
+                    if region_num not in region_dirs:
+                        region_dirs[region_num] = os.path.join(output_dir, name) + "/"
+                        if not os.path.isdir(region_dirs[region_num]):
+                            os.makedirs(region_dirs[region_num])
+                        #end if
+                    #end if
+                    for row in rows:
+                        point_info = selected_points[row].item()
+                        writeWaveform([point_info, waveforms[row,:point_info[13]].tolist()],wv_info,region_dirs[region_num],headdata[24:27],headdata[27:30])
+                    #end for
+                #end if
+
+                counts[region_num] += rows.shape[0]
+            #end for
+        #end for
+    finally:
+        for wave_writer in wave_writers.values():
+            wave_writer.close()
+        #end for
+    #end try
+
+    print "Number of extracted waves: %d" % counts.sum()
+    print "Regions with waveforms: %d of %d" %((counts > 0).sum(), len(regions))
+
+    return counts
+
+#end function
+
 # Function to plot the waveforms either to the screen interactively or to a pdf file
 def plotWaveform(waveform,sampletime,fileobj=None,title=None):
        #plot the waveform data as a blue line
@@ -26,7 +26,7 @@ import argparse
 import csv
 import os
 import sys
-from arsf_envi_reader import envi_header
+from arsf_envi_reader import header_scanner
 import matplotlib.pyplot as plt
 import re
 import numpy as np
@@ -66,6 +66,11 @@ if __name__ == "__main__":
                             help="Output file to store values for each band to")
     parser.add_argument("-k","--keep_order", required=False, action = "store_true",
                             help="If used, will keep the order specified in the commmand line")
+    parser.add_argument("-w","--workers", required=False, type=int, default=1,
+                            help="Number of processes to use to read headers")
+    parser.add_argument("--cache", required=False, type=str, default=None,
+                            help="File to cache values read from headers in. "
+                                 "If run again only new or changed headers will be read.")
     args = parser.parse_args()
 
     # On Windows don't have shell expansion so fake it using glob
@@ -93,21 +98,6 @@ if __name__ == "__main__":
                 'temp' : {'xlabel':'File Index','ylabel':'Temperature of detector (K)','filename':'temp.png'}
     }
 
-    # Set up values to plot
-    nbands = []
-    nsamples = []
-    nlines = []
-    fps = []
-    tint = []
-    tint1 = []
-    tint2 = []
-    binning = []
-    binning2 = []
-    temp = []
-    dates = []
-    start_times = []
-    stop_times = []
-
     for each_hdr in args.inputfiles:
         # Check a header file has been provided.
         if os.path.splitext(each_hdr)[-1].lower() != '.hdr':
@@ -119,79 +109,22 @@ if __name__ == "__main__":
                   file=sys.stderr)
             sys.exit(1)
 
-        header_dict = envi_header.read_hdr_file(each_hdr)
-
-        # Get supplimentary info for csv if available
-        if 'acquisition date' in header_dict.keys():
-            dates.append(header_dict['acquisition date'].split(' ')[-1])
-        else:
-            dates.append(float('nan'))
-        if 'gps start time' in header_dict.keys():
-            start_times.append(header_dict['gps start time'].split(' ')[-1])
-        else:
-            start_times.append(float('nan'))
-        if 'gps stop time' in header_dict.keys():
-            stop_times.append(header_dict['gps stop time'].split(' ')[-1])
-        else:
-            stop_times.append(float('nan'))
-        if "bands" in header_dict.keys():
-            nbands.append(int(header_dict['bands']))
-        else:
-            nbands.append(float('nan'))
-        if "samples" in header_dict.keys():
-            nsamples.append(int(header_dict['samples']))
-        else:
-            nsamples.append(float('nan'))
-        if "lines" in header_dict.keys():
-            nlines.append(int(header_dict['lines']))
-        else:
-            nlines.append(float('nan'))
-        if "fps" in header_dict.keys():
-            fps.append(float(header_dict['fps']))
-        else:
-            fps.append(float('nan'))
-        if "tint" in header_dict.keys():
-            tint.append(float(header_dict['tint']))
-        else:
-            tint.append(float('nan'))
-        if "tint1" in header_dict.keys():
-            tint1.append(float(header_dict['tint1']))
-        elif "tint_vnir" in header_dict.keys():
-            tint1.append(float(header_dict['tint_vnir']))
-        else:
-            tint1.append(float('nan'))
-        if "tint2" in header_dict.keys():
-            tint2.append(float(header_dict['tint2']))
-        elif "tint_swir" in header_dict.keys():
-            tint2.append(float(header_dict['tint_swir']))
-        else:
-            tint2.append(float('nan'))
-        if "binning" in header_dict.keys():
-            binning.append(int(header_dict['binning'][0]))
-        elif "binning_vnir" in header_dict.keys():
-            binning.append(int(header_dict['binning_vnir'][0]))
-        else:
-            binning.append(float('nan'))
-        if "binning2" in header_dict.keys():
-            binning2.append(int(header_dict['binning2'][0]))
-        elif "binning_swir" in header_dict.keys():
-            binning2.append(int(header_dict['binning_swir'][0]))
-        else:
-            binning2.append(float('nan'))
-        if "temperature" in header_dict.keys():
-        # won't be in dark frame files
-            temp.append(float(header_dict['temperature'].split(',')[0]))
-        else:
-            temp.append(float('nan'))
+    # Read values from all headers into a table
+    header_table = header_scanner.scan_headers(args.inputfiles,
+                                               workers=args.workers,
+                                               cache_file=args.cache)
 
     #Dynamic dictionary created from the keys in the header_dict
-    dicttoplot={'fps': {'fps' : fps} ,
-                'tint': {'tint' : tint, 'tint1' : tint1, 'tint2' : tint2},
-                'nbands' : {'bands' : nbands},
-                'nsamples' : {'samples' : nsamples},
-                'nlines' : {'lines' : nlines},
-                'binning' : {'binning' : binning, 'binning2' : binning2},
-                'temp' : {'temperature' : temp}
+    dicttoplot={'fps': {'fps' : header_table['fps']} ,
+                'tint': {'tint' : header_table['tint'],
+                         'tint1' : header_table['tint1'],
+                         'tint2' : header_table['tint2']},
+                'nbands' : {'bands' : header_table['bands']},
+                'nsamples' : {'samples' : header_table['samples']},
+                'nlines' : {'lines' : header_table['lines']},
+                'binning' : {'binning' : header_table['binning'],
+                             'binning2' : header_table['binning2']},
+                'temp' : {'temperature' : header_table['temperature']}
              }
 
     #Loop for plotting each item from the dicttoplot
@@ -222,76 +155,44 @@ if __name__ == "__main__":
     # Save (all) parameters to csv if requested
     if args.outcsv is not None:
 
-        # first check all files have same records
-        for item in dicttoplot.keys():
-            for each in dicttoplot[item]:
-                if np.nansum(dicttoplot[item][each])>0:
-                    if len(dicttoplot[item][each]) != len(nbands):
-                        print("Some header files are missing certain entries. Cannot create csv.")
-                        sys.exit(1)
+        # Columns to write out and the type to write values as. The date
+        # and times are always included, other columns only if they sum
+        # to more than 0.
+        csv_columns = [('date', 'Date', str),
+                       ('start_time', 'UTC_Start_Time', str),
+                       ('stop_time', 'UTC_Stop_Time', str),
+                       ('bands', 'Bands', int),
+                       ('samples', 'Samples', int),
+                       ('lines', 'Lines', int),
+                       ('fps', 'FPS', float),
+                       ('tint', 'Tint (ms)', float),
+                       ('tint1', 'Tint1 (ms)', float),
+                       ('tint2', 'Tint2 (ms)', float),
+                       ('binning', 'Spectral_Binning', int),
+                       ('binning2', 'Spectral_Bining2', int),
+                       ('temperature', 'Temp, K', float)]
+        csv_columns = [(field, heading, field_type)
+                       for field, heading, field_type in csv_columns
+                       if field_type is str
+                       or np.nansum(header_table[field]) > 0]
 
         with open(args.outcsv,'w') as f:
             out_file = csv.writer(f)
 
-            for i in range(len(nbands)):
-                # For first line write header
-                if i == 0:
-                    header_row = ['File']
-                    if len(dates)==len(nbands):
-                        header_row.append('Date')
-                    if len(start_times)==len(nbands):
-                        header_row.append('UTC_Start_Time')
-                    if len(stop_times)==len(nbands):
-                        header_row.append('UTC_Stop_Time')
-                    if np.nansum(nbands)>0:
-                        header_row.append('Bands')
-                    if np.nansum(nsamples)>0:
-                        header_row.append('Samples')
-                    if np.nansum(nlines)>0:
-                        header_row.append('Lines')
-                    if np.nansum(fps)>0:
-                        header_row.append('FPS')
-                    if np.nansum(tint)>0:
-                        header_row.append('Tint (ms)')
-                    if np.nansum(tint1)>0:
-                        header_row.append('Tint1 (ms)')
-                    if np.nansum(tint2)>0:
-                        header_row.append('Tint2 (ms)')
-                    if np.nansum(binning)>0:
-                        header_row.append('Spectral_Binning')
-                    if np.nansum(binning2)>0:
-                        header_row.append('Spectral_Bining2')
-                    if np.nansum(temp)>0:
-                        header_row.append('Temp, K')
-                    out_file.writerow(header_row)
-                else:
-                    out_line = [args.inputfiles[i]]
-                    if len(dates)==len(nbands):
-                        out_line.append(dates[i])
-                    if len(start_times)==len(nbands):
-                        out_line.append(start_times[i])
-                    if len(stop_times)==len(nbands):
-                        out_line.append(stop_times[i])
-                    if np.nansum(nbands)>0:
-                        out_line.append(nbands[i])
-                    if np.nansum(nsamples)>0:
-                        out_line.append(nsamples[i])
-                    if np.nansum(nlines)>0:
-                        out_line.append(nlines[i])
-                    if np.nansum(fps)>0:
-                        out_line.append(fps[i])
-                    if np.nansum(tint)>0:
-                        out_line.append(tint[i])
-                    if np.nansum(tint1)>0:
-                        out_line.append(tint1[i])
-                    if np.nansum(tint2)>0:
-                        out_line.append(tint2[i])
-                    if np.nansum(binning)>0:
-                        out_line.append(binning[i])
-                    if np.nansum(binning2)>0:
-                        out_line.append(binning2[i])
-                    if np.nansum(temp)>0:
-                        out_line.append(temp[i])
-                    out_file.writerow(out_line)
+            out_file.writerow(['File'] + [heading for _, heading, _
+                                          in csv_columns])
+
+            for header_row in header_table:
+                out_line = [header_row['file']]
+                for field, _, field_type in csv_columns:
+                    value = header_row[field]
+                    # Write missing values as nan
+                    if field_type is str:
+                        if value == '':
+                            value = float('nan')
+                    elif not np.isnan(value):
+                        value = field_type(value)
+                    out_line.append(value)
+                out_file.writerow(out_line)
 
         print("csv file written to {}".format(args.outcsv))